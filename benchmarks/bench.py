@@ -0,0 +1,248 @@
+"""Benchmark the bundler and packers on synthetic projects.
+
+Usage::
+
+    python benchmarks/bench.py [--sizes small,medium] [--repeat 3] [--save NAME] [--compare NAME]
+
+Wheels are generated for each size and served from a local index on
+localhost, so no network access is needed. Results are saved to
+``benchmarks/results/NAME.json``, and ``--compare`` fails if any benchmark
+is slower than a saved run by more than ``--threshold``.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_HERE))
+
+from pdm.core import Core
+
+from synthetic import SIZES, LocalIndex, generate_wheels, write_index, write_project
+from pdm_winpacker.winpacker import Bundler, PackedApp
+from pdm_winpacker.winpacker.bundler.wheelinstaller import extract_wheel
+from pdm_winpacker.winpacker.packers import NSISPacker, ZipPacker
+from pdm_winpacker.winpacker.utils import CACHE_ENV_VAR
+
+
+RESULTS_DIR = os.path.join(_HERE, 'results')
+DEFAULT_SIZES = 'small,medium'
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+# Differences smaller than this are noise, however large they are relatively
+MIN_REGRESSION = 0.02
+
+
+def _timeit(func, repeat, setup=None):
+    """Run func repeat times, calling setup untimed before each run"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': times}
+
+
+def _tree_bytes(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.lstat(os.path.join(root, f)).st_size for f in files)
+    return size
+
+
+class SizeBenchmarks():
+    """All the benchmarks of one size, sharing its generated project"""
+
+    def __init__(self, size, workdir, repeat):
+        self.size = size
+        self.workdir = workdir
+        self.repeat = repeat
+        self.results = {}
+
+        self.wheels = generate_wheels(os.path.join(workdir, 'wheels'), size)
+        all_wheels = [wheel for wheels in self.wheels.values() for wheel in wheels]
+        moved = dict(zip(all_wheels, write_index(all_wheels, os.path.join(workdir, 'index'))))
+        self.wheels = {kind: [moved[wheel] for wheel in wheels] for kind, wheels in self.wheels.items()}
+        self.cache_dir = os.path.join(workdir, 'cache')
+
+    def record(self, name, result, **info):
+        result.update(info)
+        self.results[f'{self.size.name}/{name}'] = result
+        print(f"  {name:<36} median {result['median']:8.3f}s  min {result['min']:8.3f}s")
+
+    def _fresh_dir(self, path):
+        def setup():
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+        return setup
+
+    def bench_extract_wheel(self):
+        target = os.path.join(self.workdir, 'extract')
+        for kind, wheels in self.wheels.items():
+            self.record(
+                f'extract_wheel[{kind}]',
+                _timeit(lambda: [extract_wheel(wheel, target) for wheel in wheels], self.repeat, self._fresh_dir(target)),
+                wheels=len(wheels), wheel_bytes=sum(os.path.getsize(wheel) for wheel in wheels),
+            )
+
+        # Linked from the extracted wheel cache
+        wheels = [wheel for kind_wheels in self.wheels.values() for wheel in kind_wheels]
+        extract_cache = os.path.join(self.workdir, 'extract-cache')
+        for wheel in wheels:
+            extract_wheel(wheel, os.path.join(self.workdir, 'extract-warmup'), cache_dir=extract_cache)
+        self.record(
+            'extract_wheel[cached]',
+            _timeit(lambda: [extract_wheel(wheel, target, cache_dir=extract_cache) for wheel in wheels],
+                    self.repeat, self._fresh_dir(target)),
+            wheels=len(wheels),
+        )
+
+    def _packed_app(self):
+        core = Core()
+        core.ui.verbosity = -1
+        project = core.create_project(self.project_dir)
+        return PackedApp(project)
+
+    def bench_bundler(self, index_url):
+        self.project_dir = write_project(os.path.join(self.workdir, 'project'), self.size,
+                                         [wheel for wheels in self.wheels.values() for wheel in wheels], index_url)
+        os.chdir(self.project_dir)
+        packed_app = self._packed_app()
+
+        def clean():
+            packed_app.clean_build_directry()
+
+        def clean_cache():
+            clean()
+            if os.path.exists(self.cache_dir):
+                shutil.rmtree(self.cache_dir)
+
+        # Resolving the lockfile isn't part of the stage being measured
+        dependencies = Bundler(packed_app)._dependencies
+
+        def prepare_dependencies():
+            bundler = Bundler(packed_app)
+            bundler.__dict__['_dependencies'] = dependencies
+            bundler.prepare_dependencies()
+
+        self.record('prepare_dependencies[cold]', _timeit(prepare_dependencies, self.repeat, clean_cache),
+                    dependencies=len(dependencies[0]))
+        self.record('prepare_dependencies[warm]', _timeit(prepare_dependencies, self.repeat, clean),
+                    dependencies=len(dependencies[0]))
+
+        self.record('prepare_packages', _timeit(lambda: Bundler(packed_app).prepare_packages(), self.repeat, clean),
+                    modules=self.size.package_modules)
+
+        # Pack the whole build directory
+        clean()
+        prepare_dependencies()
+        Bundler(packed_app).prepare_packages()
+        packed_app.bundle_fingerprint = 'benchmark'
+        build_bytes = _tree_bytes(packed_app.build_dir)
+
+        def invalidate_zip():
+            packed_app.manifest.invalidate('zip')
+
+        self.record('ZipPacker.pack', _timeit(lambda: ZipPacker(packed_app).pack(), self.repeat, invalidate_zip),
+                    build_bytes=build_bytes)
+
+        packed_app.install_dirs[:] = [('pkgs', '$INSTDIR'), ('Python', '$INSTDIR'), ('bin', '$INSTDIR')]
+        packed_app.install_files[:] = [(f'data_{i}.txt', f'$INSTDIR\\data\\{i % 50}') for i in range(self.size.install_files)]
+        self.record('NSISPacker._write_nsi', _timeit(lambda: NSISPacker(packed_app)._write_nsi(), self.repeat),
+                    install_files=self.size.install_files)
+
+    def run(self):
+        print(f"{self.size.name}:")
+        self.bench_extract_wheel()
+        cwd = os.getcwd()
+        os.environ[CACHE_ENV_VAR] = self.cache_dir
+        try:
+            with LocalIndex(os.path.join(self.workdir, 'index')) as index:
+                self.bench_bundler(index.url)
+        finally:
+            os.chdir(cwd)
+            del os.environ[CACHE_ENV_VAR]
+        return self.results
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks which are slower than the baseline by more than threshold"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result['median'] / before['median'] - 1 if before['median'] else 0.0
+        slower = result['median'] - before['median'] > MIN_REGRESSION and change > threshold
+        print(f"  {name:<44} {before['median']:8.3f}s -> {result['median']:8.3f}s {change:+7.1%}{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"Comma separated sizes from {', '.join(SIZES)}, default: {DEFAULT_SIZES}")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help=f"Runs of each benchmark, default: {DEFAULT_REPEAT}")
+    parser.add_argument('--save', metavar='NAME', help="Save the results to benchmarks/results/NAME.json")
+    parser.add_argument('--compare', metavar='NAME', help="Compare with benchmarks/results/NAME.json, failing on regressions")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative slowdown counted as a regression, default: {DEFAULT_THRESHOLD}")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated files, and print where they are")
+    options = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in options.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes: {', '.join(unknown)}")
+
+    baseline = None
+    if options.compare:
+        with open(os.path.join(RESULTS_DIR, f'{options.compare}.json'), encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    workdir = tempfile.mkdtemp(prefix='winpacker-bench-')
+    results = {}
+    try:
+        for size in sizes:
+            results.update(SizeBenchmarks(SIZES[size], os.path.join(workdir, size), options.repeat).run())
+    finally:
+        if options.keep:
+            print(f"Generated files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if options.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{options.save}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'repeat': options.repeat,
+                'results': results,
+            }, f, indent=1)
+        print(f"Saved results to {path}")
+
+    if baseline is not None:
+        print(f"Compared with {options.compare}:")
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {options.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
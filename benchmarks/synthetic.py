@@ -0,0 +1,221 @@
+"""Synthetic wheels, projects and a local package index for the benchmarks.
+
+Everything is generated from a fixed seed, so the same size always produces
+the same files, and the index is served from localhost, so nothing needs
+network access.
+"""
+import os
+import base64
+import random
+import hashlib
+import zipfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+PY_TAG = 'cp310'
+PLATFORM_TAG = 'win_amd64'
+
+
+class Size():
+    """How much of everything to generate"""
+
+    def __init__(self, name, small_wheels, modules, binary_wheels, binary_size, data_wheels, package_modules, install_files):
+        self.name = name
+        # Wheels of many small pure Python modules
+        self.small_wheels = small_wheels
+        self.modules = modules
+        # Wheels with a few large native extensions, which don't compress
+        self.binary_wheels = binary_wheels
+        self.binary_size = binary_size
+        # Wheels using a .data directory for purelib, platlib, scripts and data
+        self.data_wheels = data_wheels
+        # Modules in the project's own package
+        self.package_modules = package_modules
+        # Extra entries for the installer script
+        self.install_files = install_files
+
+
+SIZES = {
+    'small': Size('small', small_wheels=4, modules=50, binary_wheels=1, binary_size=1 << 20,
+                  data_wheels=1, package_modules=50, install_files=100),
+    'medium': Size('medium', small_wheels=12, modules=200, binary_wheels=2, binary_size=8 << 20,
+                   data_wheels=3, package_modules=200, install_files=1000),
+    'large': Size('large', small_wheels=30, modules=500, binary_wheels=4, binary_size=32 << 20,
+                  data_wheels=6, package_modules=1000, install_files=5000),
+}
+
+
+def _module_source(rng, name, n):
+    lines = [f'"""Synthetic module {name}"""', 'import os', '']
+    for i in range(n):
+        lines.append(f'def function_{i}(value={rng.randrange(1000)}):')
+        lines.append(f'    """Return value scaled by {i}"""')
+        lines.append(f'    return os.path.join(str(value * {i}), {name!r})')
+        lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _record_line(arcname, data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode('ascii')
+    return f'{arcname},sha256={digest},{len(data)}'
+
+
+def build_wheel(directory, name, version, files, tag='py3-none-any'):
+    """Write a wheel of files, a dict of archive name to bytes, and return its path"""
+    dist_info = f'{name}-{version}.dist-info'
+    files = dict(files)
+    files[f'{dist_info}/METADATA'] = f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'.encode('utf-8')
+    files[f'{dist_info}/WHEEL'] = (f'Wheel-Version: 1.0\nGenerator: winpacker-benchmarks\n'
+                                   f'Root-Is-Purelib: {"true" if tag.endswith("any") else "false"}\nTag: {tag}\n').encode('utf-8')
+    files[f'{dist_info}/top_level.txt'] = f'{name}\n'.encode('utf-8')
+    record = [_record_line(arcname, data) for arcname, data in files.items()]
+    record.append(f'{dist_info}/RECORD,,')
+    files[f'{dist_info}/RECORD'] = '\n'.join(record).encode('utf-8')
+
+    path = os.path.join(directory, f'{name}-{version}-{tag}.whl')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, data in files.items():
+            zf.writestr(arcname, data)
+    return path
+
+
+def small_files_wheel(directory, rng, name, size):
+    """A package of many small modules in a few subpackages"""
+    files = {f'{name}/__init__.py': b''}
+    for i in range(size.modules):
+        subpackage = f'{name}/sub{i % 5}'
+        files[f'{subpackage}/__init__.py'] = b''
+        files[f'{subpackage}/module_{i}.py'] = _module_source(rng, f'{name}.module_{i}', 20)
+    files[f'{name}/tests/__init__.py'] = b''
+    files[f'{name}/tests/test_{name}.py'] = _module_source(rng, f'{name}.tests', 5)
+    return build_wheel(directory, name, '1.0', files)
+
+
+def binary_wheel(directory, rng, name, size):
+    """A package with a few large native extensions"""
+    files = {f'{name}/__init__.py': b'from ._core0 import *\n'}
+    for i in range(4):
+        files[f'{name}/_core{i}.{PY_TAG}-{PLATFORM_TAG}.pyd'] = rng.randbytes(size.binary_size // 4)
+    files[f'{name}/data/table.bin'] = rng.randbytes(size.binary_size // 8)
+    return build_wheel(directory, name, '1.0', files, tag=f'{PY_TAG}-{PY_TAG}-{PLATFORM_TAG}')
+
+
+def data_wheel(directory, rng, name, size):
+    """A wheel installing from every part of a .data directory"""
+    data_dir = f'{name}-1.0.data'
+    files = {f'{name}/__init__.py': b''}
+    for i in range(size.modules // 4):
+        files[f'{data_dir}/purelib/{name}_extra/module_{i}.py'] = _module_source(rng, f'{name}_extra.module_{i}', 10)
+        files[f'{data_dir}/data/share/{name}/file_{i}.txt'] = rng.randbytes(512)
+    files[f'{data_dir}/purelib/{name}_extra/__init__.py'] = b''
+    files[f'{data_dir}/platlib/{name}_native.{PY_TAG}-{PLATFORM_TAG}.pyd'] = rng.randbytes(size.binary_size // 4)
+    files[f'{data_dir}/scripts/{name}-tool'] = f'#!python\nimport {name}\n'.encode('utf-8')
+    files[f'{data_dir}/headers/{name}.h'] = b'#define SYNTHETIC 1\n'
+    return build_wheel(directory, name, '1.0', files)
+
+
+WHEEL_KINDS = {
+    'small-files': small_files_wheel,
+    'binaries': binary_wheel,
+    'data-layout': data_wheel,
+}
+
+
+def generate_wheels(directory, size, seed=0):
+    """Generate the wheels for a size, returning a dict of kind to wheel paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    counts = {'small-files': size.small_wheels, 'binaries': size.binary_wheels, 'data-layout': size.data_wheels}
+    wheels = {}
+    for kind, n in counts.items():
+        prefix = kind.split('-')[0]
+        wheels[kind] = [WHEEL_KINDS[kind](directory, rng, f'synth_{prefix}{i}', size) for i in range(n)]
+    return wheels
+
+
+def write_index(wheel_paths, root):
+    """Move wheels into a PEP 503 simple index under root/simple, returning
+    their new paths.
+    """
+    moved = []
+    for path in wheel_paths:
+        filename = os.path.basename(path)
+        project = filename.split('-', 1)[0].replace('_', '-')
+        project_dir = os.path.join(root, 'simple', project)
+        os.makedirs(project_dir, exist_ok=True)
+        moved.append(os.path.join(project_dir, filename))
+        os.replace(path, moved[-1])
+        with open(moved[-1], 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(f'<html><body><a href="{filename}#sha256={sha256}">{filename}</a></body></html>\n')
+    return moved
+
+
+class LocalIndex():
+    """Serve a directory over HTTP on localhost, standing in for a package index"""
+
+    def __init__(self, root):
+        self.root = root
+        self._server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}/simple'
+
+    def __enter__(self):
+        handler = partial(_QuietHandler, directory=self.root)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _lock_entry(path, url):
+    name, version = os.path.basename(path).split('-')[:2]
+    with open(path, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    return name.replace('_', '-'), version, f'{url}/{name.replace("_", "-")}/{os.path.basename(path)}', sha256
+
+
+def write_project(directory, size, wheel_paths, index_url, seed=0):
+    """Write a project depending on every wheel, with a lockfile pointing at the index"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    entries = sorted(_lock_entry(path, index_url) for path in wheel_paths)
+    dependencies = ', '.join(f'"{name}=={version}"' for name, version, _, _ in entries)
+
+    with open(os.path.join(directory, 'pyproject.toml'), 'w', encoding='utf-8') as f:
+        f.write(f'[project]\nname = "benchapp"\nversion = "1.0"\ndependencies = [{dependencies}]\n'
+                f'requires-python = ">=3.7"\n\n'
+                f'[[tool.pdm.source]]\nname = "pypi"\nurl = "{index_url}"\nverify_ssl = false\n\n'
+                f'[tool.pdm.win-packer]\napp_name = "Bench App"\npy_version = "3.10.11"\n\n'
+                f'[tool.pdm.win-packer.commands.benchapp]\nentry_point = "benchapp:main"\nconsole = true\n')
+
+    lines = ['# This file is @generated by PDM.', '']
+    for name, version, _, _ in entries:
+        lines += ['[[package]]', f'name = "{name}"', f'version = "{version}"', 'summary = ""', '']
+    lines += ['[metadata]', 'lock_version = "4.1"', 'content_hash = "sha256:0"', '', '[metadata.files]']
+    for name, version, url, sha256 in entries:
+        lines += [f'"{name} {version}" = [', f'    {{url = "{url}", hash = "sha256:{sha256}"}},', ']']
+    with open(os.path.join(directory, 'pdm.lock'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    package_dir = os.path.join(directory, 'benchapp')
+    os.makedirs(package_dir, exist_ok=True)
+    with open(os.path.join(package_dir, '__init__.py'), 'w', encoding='utf-8') as f:
+        f.write('def main():\n    return 0\n')
+    for i in range(size.package_modules):
+        with open(os.path.join(package_dir, f'module_{i}.py'), 'wb') as f:
+            f.write(_module_source(rng, f'benchapp.module_{i}', 20))
+    return directory
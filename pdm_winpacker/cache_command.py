@@ -0,0 +1,89 @@
+import time
+import argparse
+
+from pdm.cli.commands.base import BaseCommand
+from pdm.exceptions import PdmUsageError
+from pdm.project import Project
+
+from . winpacker import PackedApp
+from . winpacker.cache import format_size, get_cache, parse_size
+
+
+def _group(relpath):
+    """What kind of entry something in the cache is"""
+    if '/' in relpath:
+        return relpath.split('/', 1)[0]
+    return 'wheels' if relpath.endswith('.whl') else 'downloads'
+
+
+class CacheCommand(BaseCommand):
+    """Manage the cache of downloads, Python builds and extracted wheels"""
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        subparsers = parser.add_subparsers(title="Sub commands")
+        InfoCommand.register_to(subparsers, "info")
+        PruneCommand.register_to(subparsers, "prune")
+        ClearCommand.register_to(subparsers, "clear")
+        self.parser = parser
+
+    def handle(self, project: Project, options: argparse.Namespace) -> None:
+        self.parser.print_help()
+
+
+class InfoCommand(BaseCommand):
+    """Show the size of the cache and what's in it"""
+
+    def handle(self, project: Project, options: argparse.Namespace) -> None:
+        cache = get_cache()
+        max_size = PackedApp(project).cache_max_size
+        with project.core.ui.open_spinner("Calculating cache size..."):
+            entries = cache.entries()
+
+        groups = {}
+        for relpath, entry in entries.items():
+            group = groups.setdefault(_group(relpath), {'entries': 0, 'size': 0, 'accessed': 0})
+            group['entries'] += 1
+            group['size'] += entry['size']
+            group['accessed'] = max(group['accessed'], entry['accessed'])
+
+        total = sum(entry['size'] for entry in entries.values())
+        project.core.ui.echo(f"[primary]Cache Root[/]: {cache.root}, Total size: {format_size(total)}, "
+                             f"Max size: {format_size(max_size) if max_size else 'unlimited'}")
+        if groups:
+            project.core.ui.display_columns(
+                [[name, str(group['entries']), format_size(group['size']),
+                  time.strftime('%Y-%m-%d %H:%M', time.localtime(group['accessed']))]
+                 for name, group in sorted(groups.items())],
+                ['Kind', '>Entries', '>Size', 'Last used'],
+            )
+
+
+class PruneCommand(BaseCommand):
+    """Evict the least recently used entries until the cache fits its maximum size"""
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument("--max-size", help="Size to shrink the cache to, e.g. 2GB, default: win-packer.cache_max_size")
+
+    def handle(self, project: Project, options: argparse.Namespace) -> None:
+        if options.max_size is not None:
+            try:
+                max_size = parse_size(options.max_size)
+            except ValueError as e:
+                raise PdmUsageError(str(e)) from e
+        else:
+            max_size = PackedApp(project).cache_max_size
+            if not max_size:
+                raise PdmUsageError("win-packer.cache_max_size isn't set, pass --max-size")
+
+        with project.core.ui.open_spinner("Waiting for builds using the cache to finish..."):
+            evicted, freed = get_cache().prune(max_size)
+        project.core.ui.echo(f"Evicted {len(evicted)} cache entries, freeing {format_size(freed)}")
+
+
+class ClearCommand(BaseCommand):
+    """Remove everything from the cache"""
+
+    def handle(self, project: Project, options: argparse.Namespace) -> None:
+        with project.core.ui.open_spinner("Waiting for builds using the cache to finish..."):
+            removed, freed = get_cache().clear()
+        project.core.ui.echo(f"Removed {removed} cache entries, freeing {format_size(freed)}")
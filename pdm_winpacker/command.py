@@ -1,9 +1,15 @@
+import os
+from contextlib import nullcontext
 from pdm.cli.commands.base import BaseCommand
 from pdm.cli.hooks import HookManager
+from pdm.exceptions import PdmUsageError
 
 
+from . cache_command import CacheCommand
 from . winpacker import Bundler, PackedApp
-from . winpacker.packers import NSISPacker, ZipPacker
+from . winpacker.bundler.shared import SharedWork
+from . winpacker.packers import DEFAULT_FORMATS, pack, parse_formats
+from . winpacker.profile import CPROFILE_FILENAME, PROFILE_FILENAME, BuildProfile, ThreadedProfiler, measure
 
 class WinpackerCommand(BaseCommand):
     """Build NSIS installer for your project.
@@ -13,19 +19,65 @@ class WinpackerCommand(BaseCommand):
     name = "winpacker"
 
     def add_arguments(self, parser):
-        #parser.add_argument("-n", "--name", help="the person's name to whom you greet")
-        pass
+        parser.add_argument("--clean", action="store_true", help="Remove the build directory and rebuild everything")
+        parser.add_argument("--offline", action="store_true", help="Only use wheels from the cache and find-links directories, never the network")
+        parser.add_argument("--refresh", action="store_true", help="Look up every dependency in the index again, ignoring the resolution cache")
+        parser.add_argument("--formats", default=DEFAULT_FORMATS, help=f"Comma separated formats to pack, default: {DEFAULT_FORMATS}")
+        parser.add_argument("--delta-from", metavar="PATH",
+                            help="Also pack the files changed since a previous build, given its zip package or files manifest. "
+                                 "With win-packer.targets, {target} in PATH is replaced by each target's name")
+        parser.add_argument("--profile", action="store_true", help=f"Also profile the build with cProfile, saving the statistics to {CPROFILE_FILENAME}")
+        subparsers = parser.add_subparsers(title="Sub commands")
+        CacheCommand.register_to(subparsers, "cache")
 
-    def handle(self, project, options):
-        hooks = HookManager(project)
-
-        packed_app = PackedApp(project)
-        packed_app.clean_build_directry()
+    def _build(self, hooks, packed_app, options, formats, shared):
+        packed_app.refresh = options.refresh
+        packed_app.offline = options.offline
+        if options.delta_from:
+            packed_app.delta_from = options.delta_from.replace('{target}', packed_app.target or '')
+            if not os.path.isfile(packed_app.delta_from):
+                raise PdmUsageError(f"{packed_app.delta_from} doesn't exist, expected the zip package or files manifest of a previous build")
+        if options.clean:
+            packed_app.clean_build_directry()
+        else:
+            packed_app.prepare_build_directory()
 
         hooks.try_emit("pre_build", dest=packed_app.build_dir, config_settings={})
+        Bundler(packed_app, shared).build()
+        pack(packed_app, formats)
+        hooks.try_emit("post_build", artifacts=packed_app.artifacts, config_settings={})
+
+    def handle(self, project, options):
+        hooks = HookManager(project)
+        formats = parse_formats(options.formats)
 
-        Bundler(packed_app).build()
-        NSISPacker(packed_app).pack()
-        ZipPacker(packed_app).pack()
+        # With win-packer.targets, each target is built in turn, sharing the
+        # work which doesn't depend on the architecture
+        packed_apps = PackedApp.for_targets(project)
+        if options.delta_from and len(packed_apps) > 1 and '{target}' not in options.delta_from:
+            raise PdmUsageError("--delta-from needs {target} in it to build a delta of each target")
+        dist_dir = packed_apps[0].dist_dir
+        shared_work = SharedWork(packed_apps[0].build_root) if len(packed_apps) > 1 else nullcontext()
 
-        hooks.try_emit("post_build", artifacts=packed_app.artifacts, config_settings={})
\ No newline at end of file
+        profile = BuildProfile()
+        profiler = ThreadedProfiler() if options.profile else None
+        if profiler is not None:
+            profiler.start()
+        try:
+            with profile.activate(), shared_work as shared:
+                for packed_app in packed_apps:
+                    if packed_app.target:
+                        project.core.ui.echo(f"[primary]Building {packed_app.target}[/]: Python {packed_app.py_version}, "
+                                             f"{packed_app.py_bit} bit")
+                    with measure('target', packed_app.target) if packed_app.target else nullcontext():
+                        self._build(hooks, packed_app, options, formats, shared)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+            profile.write(os.path.join(dist_dir, PROFILE_FILENAME))
+            profile.display(project.core.ui)
+            if profiler is not None:
+                cprofile_path = os.path.join(dist_dir, CPROFILE_FILENAME)
+                profiler.dump(cprofile_path)
+                project.core.ui.echo(f"cProfile statistics saved to {cprofile_path}, "
+                                     f"view them with: python -m pstats {cprofile_path}")
@@ -0,0 +1,97 @@
+# Shipped inside each launcher as _winpacker_importtime and imported when the
+# WINPACKER_IMPORTTIME environment variable is set. The embeddable Python's
+# ._pth file puts it in isolated mode, which ignores PYTHONPROFILEIMPORTTIME,
+# so this reports the imports after the launcher starts in the same format as
+# ``python -X importtime``, and how long the command took to start.
+import sys
+import time
+
+_started = time.perf_counter()
+
+
+class _ImportTimer():
+    """Times running each module's code, by wrapping the ``exec_module`` of
+    the classes of the loaders other finders return. The specs and loaders
+    themselves aren't changed, so modules see the loaders they would have.
+    """
+
+    def __init__(self):
+        # Time spent in the imports nested in each running import
+        self._children = []
+        # Names of the modules being timed, so loaders which call their
+        # base class's exec_module aren't timed twice
+        self._running = set()
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None:
+            self._time_loader(spec.loader)
+        return spec
+
+    def _time_loader(self, loader):
+        # Built in and frozen modules' loaders are classes
+        cls = loader if isinstance(loader, type) else type(loader)
+        for owner in cls.__mro__:
+            if 'exec_module' in owner.__dict__:
+                break
+        else:
+            return
+        method = owner.__dict__['exec_module']
+        if isinstance(method, (staticmethod, classmethod)):
+            func, wrap = method.__func__, type(method)
+        else:
+            func, wrap = method, lambda func: func
+        if getattr(func, '_winpacker_timed', False):
+            return
+        try:
+            setattr(owner, 'exec_module', wrap(self._timed(func)))
+        except TypeError:
+            # Types defined in C can't be changed, their imports aren't timed
+            pass
+
+    def _timed(self, func):
+        def exec_module(*args):
+            module = args[-1]
+            spec = getattr(module, '__spec__', None)
+            name = spec.name if spec is not None else module.__name__
+            if name in self._running:
+                return func(*args)
+            self._running.add(name)
+            self.enter()
+            try:
+                return func(*args)
+            finally:
+                self.leave(name)
+                self._running.discard(name)
+        exec_module._winpacker_timed = True
+        return exec_module
+
+    def enter(self):
+        self._children.append((time.perf_counter(), 0.0))
+
+    def leave(self, name):
+        start, children = self._children.pop()
+        cumulative = time.perf_counter() - start
+        depth = len(self._children)
+        if self._children:
+            parent_start, parent_children = self._children[-1]
+            self._children[-1] = (parent_start, parent_children + cumulative)
+        sys.stderr.write('import time: {:>9} | {:>10} | {}{}\n'.format(
+            int((cumulative - children) * 1e6), int(cumulative * 1e6), '  ' * depth, name))
+
+
+def ready(entry_point):
+    """Report that the command's entry point has been imported"""
+    sys.stderr.write('startup time: {} us until {} was ready\n'.format(
+        int((time.perf_counter() - _started) * 1e6), entry_point))
+
+
+sys.stderr.write('import time: self [us] | cumulative | imported package\n')
+sys.meta_path.insert(0, _ImportTimer())
@@ -1,9 +1,14 @@
 import os
 import re
+import queue
 import zipfile
 import shutil
 import logging
+from contextlib import contextmanager
+from functools import cached_property
+import distlib
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable
 from pdm import termui
 from pdm.project import Project
@@ -14,43 +19,84 @@ from pdm.models.requirements import Requirement
 from pdm.exceptions import NoPythonVersion, PdmUsageError, ProjectError
 from pdm.cli.hooks import HookManager
 from unearth import PackageFinder, TargetPython
+from unearth.utils import url_to_path
+from pdm.utils import get_index_urls
+from installer.utils import parse_wheel_filename
+from packaging.utils import canonicalize_name
 from pathlib import Path
 
-from .wheelinstaller import extract_wheel
-from .command import CommandBuilder
-from ..utils import download, get_cache_dir
+from .wheelinstaller import ExcludeMatcher, extract_wheel
+from .bytecode import bytecode_path, compile_files, compile_tree, find_compiler, source_hashes, target_magic
+from .packagezip import PACKAGES_ZIP, restore_packages, zip_packages
+from .treeshake import shake, tree_size
+from .command import CommandBuilder, render_bootstrap
+from .stages import Stage, StageGraph, StageProgress
+from .resolutions import ResolutionCache
+from .shared import SharedWork
+from ..utils import cached_tree, download, file_sha256, link_or_copy, link_tree
+from ..cache import format_size, get_cache
 from ..packers import NSISPacker, ZipPacker
 from ..packedapp import PackedApp
+from ..manifest import fingerprint
+from ..profile import count, current_entry, inherit, note
 
 
 
 DEFAULT_PY_BIT = 64
 DEFAULT_PY_VERSION = '3.10.11'
 _PKGDIR = os.path.abspath(os.path.dirname(__file__))
+EXTRACTED_WHEELS_DIR = 'extracted-wheels'
+PYTHON_EMBED_DIR = 'python-embed'
+RESOLUTIONS_DIR = 'resolutions'
+PTH_EXTRA_LINES = b'\r\n..\\pkgs\r\nimport site\r\n'
+PTH_ZIP_EXTRA_LINES = b'\r\n..\\pkgs.zip\r\n..\\pkgs\r\nimport site\r\n'
 
 
 logger = logging.getLogger(__name__)
 
 
+def _wheel_key(wheel):
+    """Return the normalised ``(name, version)`` of a wheel from its filename"""
+    info = parse_wheel_filename(os.path.basename(wheel))
+    return canonicalize_name(info.distribution), info.version
+
+
 class Bundler():
-    def __init__(self, packed_app: PackedApp):
+    def __init__(self, packed_app: PackedApp, shared: SharedWork = None):
+        """``shared`` is the work shared between the targets of a build matrix"""
 
         self.project = packed_app.project
         self.packed_app = packed_app
         self._config = self.project.pyproject.settings.setdefault("win-packer", {})
         self._package_dir = os.path.join(self.project.root, self.project.pyproject.settings.get("build", {}).get("package-dir", "."))
+        self.exclude = ExcludeMatcher(self.packed_app.exclude)
+        self._fingerprints = {}
+        self._reused = []
+        # Stages which ran in this build rather than being skipped
+        self._ran = set()
+        self._progress = None
+        self._cache = get_cache()
+        self._shared = shared
 
     @property
     def _py_version_tuple(self):
         parts = self.packed_app.py_version.split('.')
         return int(parts[0]), int(parts[1])
 
-    @property
+    @cached_property
     def _dependencies(self):
-        """Return a list of dependencies for the project.
+        """Return a list of dependencies for the project, their names, and the
+        SHA-256 of each locked file keyed by filename.
+
+        The lockfile doesn't depend on the target, so it's only resolved once
+        for a build matrix.
         """
+        if self._shared is not None and self._shared.dependencies is not None:
+            return self._shared.dependencies
+
         dependencies = []
         just_names = []
+        hashes = {}
 
         requirements: dict[str, Requirement] = {}
         packages: Iterable[Requirement] | Iterable[Candidate]
@@ -66,7 +112,14 @@ class Bundler():
             dependencies.append(f"{package.name}=={package.version}")
             just_names.append(package.name)
 
-        return dependencies, just_names
+            for link, file_hash in (package.hashes or {}).items():
+                algorithm, _, value = file_hash.partition(':')
+                if algorithm == 'sha256':
+                    hashes[link.filename] = value
+
+        if self._shared is not None:
+            self._shared.dependencies = dependencies, just_names, hashes
+        return dependencies, just_names, hashes
 
     def _check_entry_point(self, ep: str):
         """Like ep.split(':'), but with extra checks and helpful errors"""
@@ -76,6 +129,10 @@ class Bundler():
 
         return False
 
+    def _pth_extra_lines(self):
+        """Lines added to the ``*._pth`` files of the embeddable Python"""
+        return PTH_ZIP_EXTRA_LINES if self.packed_app.zip_packages else PTH_EXTRA_LINES
+
     def _python_download_url_filename(self):
         version = self.packed_app.py_version
         bitness = self.packed_app.py_bit
@@ -84,30 +141,106 @@ class Bundler():
         version_minus_prerelease = re.sub(r'(a|b|rc)\d+$', '', self.packed_app.py_version)
         return 'https://www.python.org/ftp/python/{0}/{1}'.format(version_minus_prerelease, filename), filename
 
+    @contextmanager
+    def _spinner(self, title):
+        """Show the progress of a stage.
+
+        While the stage graph is running, all stages report to one shared
+        display, otherwise a spinner is opened as usual.
+        """
+        if self._progress is None:
+            with self.project.core.ui.open_spinner(title) as spin:
+                yield spin
+        else:
+            self._progress.update(title)
+            yield self._progress
+
+    def _fingerprint(self, stage, *inputs):
+        """Fingerprint the inputs of a build stage"""
+        self._fingerprints[stage] = fingerprint(*inputs)
+        return self._fingerprints[stage]
+
+    def _can_skip(self, stage, stage_fingerprint, after=(), moved=()):
+        """Whether a stage's inputs haven't changed since the last build, and
+        none of the stages ``after``, whose outputs it changes, ran again in
+        this build, e.g. to replace outputs which had gone.
+        """
+        if any(name in self._ran for name in after):
+            return False
+        return self.packed_app.manifest.is_fresh(stage, stage_fingerprint, moved)
+
+    def _is_fresh(self, stage, stage_fingerprint, after=(), moved=()):
+        """Check whether a stage can be skipped, see :meth:`_can_skip`.
+
+        If it can't, whatever it produced last time is removed so it can run
+        again from a clean slate.
+        """
+        manifest = self.packed_app.manifest
+        if self._can_skip(stage, stage_fingerprint, after, moved):
+            self._reused.append(stage)
+            note(reused=True)
+            return True
+
+        self._ran.add(stage)
+        outputs = manifest.outputs(stage)
+        manifest.invalidate(stage)
+        manifest.save()
+        for output in outputs:
+            path = os.path.join(self.packed_app.build_dir, output)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+
+        return False
+
+    def _hash_path(self, path):
+        """Hash a file or directory for a stage fingerprint"""
+        if os.path.isdir(path):
+            return self.packed_app.manifest.hash_tree(path)
+        return self.packed_app.manifest.hash_file(path)
+
+    @property
+    def _icons(self):
+        """The application icon and the icons of any shortcuts"""
+        icons = [self.packed_app.icon]
+        for shortcut in self._config.get("shortcuts", {}).values():
+            if "icon" in shortcut and shortcut["icon"] not in icons:
+                icons.append(shortcut["icon"])
+        return icons
+
     def prepare_icon(self):
-        """Copy the icon file to the build directory"""
-        with self.project.core.ui.open_spinner("Copying icon..."):
-            shutil.copy2(self.packed_app.icon, self.packed_app.build_dir)
+        """Copy the application and shortcut icons to the build directory"""
+        icons = self._icons
+        stage_fingerprint = self._fingerprint('icon', [(icon, self._hash_path(icon)) for icon in icons])
+        if self._is_fresh('icon', stage_fingerprint):
+            return
 
-    def prepare_python_embeddable(self):
-        """Fetch the embeddable Windows build for the specified Python version
+        with self._spinner("Copying icon..."):
+            for icon in icons:
+                shutil.copy2(icon, self.packed_app.build_dir)
 
-        It will be unpacked into the build directory.
+        self.packed_app.manifest.record('icon', stage_fingerprint, outputs=[os.path.basename(icon) for icon in icons])
 
-        In addition, any ``*._pth`` files found therein will have the pkgs path
-        appended to them.
+    def _unpack_python_embeddable(self, python_dir):
+        """Download (if it isn't cached) and unpack the embeddable Python build
+        into python_dir, and patch its ``*._pth`` files.
         """
         url, filename = self._python_download_url_filename()
-        cache_file = get_cache_dir(ensure_existence=True) / filename
-        if not cache_file.is_file():
-            with self.project.core.ui.open_spinner('Downloading embeddable Python build...'):
-                logger.info('Downloading embeddable Python build...')
-                logger.info('Getting %s', url)
-                download(url, cache_file)
-
-        with self.project.core.ui.open_spinner('Unpacking Python...'):
+        cache_file = self._cache.root / filename
+        with self._cache.lock(filename):
+            downloaded = not cache_file.is_file()
+            if downloaded:
+                if self.packed_app.offline:
+                    raise PdmUsageError(f"{filename} isn't in the cache, it can't be downloaded offline")
+                with self._spinner('Downloading embeddable Python build...'):
+                    logger.info('Downloading embeddable Python build...')
+                    logger.info('Getting %s', url)
+                    download(url, cache_file)
+        self._cache.record(cache_file, changed=downloaded)
+
+        with self._spinner('Unpacking Python...'):
             logger.info('Unpacking Python...')
-            python_dir = os.path.join(self.packed_app.build_dir, 'Python')
 
             with zipfile.ZipFile(str(cache_file)) as z:
                 z.extractall(python_dir)
@@ -121,10 +254,37 @@ class Bundler():
                         and f.endswith('._pth')]
             for pth in pth_files:
                 with open(os.path.join(python_dir, pth), 'a+b') as f:
-                    f.write(b'\r\n..\\pkgs\r\nimport site\r\n')
+                    f.write(self._pth_extra_lines())
+
+    def prepare_python_embeddable(self):
+        """Fetch the embeddable Windows build for the specified Python version
+
+        It will be unpacked into the build directory.
+
+        In addition, any ``*._pth`` files found therein will have the pkgs path
+        appended to them.
+
+        The unpacked and patched build is kept in the cache, keyed by version,
+        bitness and the ``._pth`` patch, and linked into the build directory.
+        It's created atomically, so concurrent builds can share it.
+        """
+        self.packed_app.install_dirs.append(('Python', '$INSTDIR'))
+        self.packed_app.extra_files.append((os.path.join(_PKGDIR, '_system_path.py'), '$INSTDIR'))
+
+        stage_fingerprint = self._fingerprint('python', self.packed_app.py_version, self.packed_app.py_bit, self._pth_extra_lines())
+        if self._is_fresh('python', stage_fingerprint):
+            return
+
+        _, filename = self._python_download_url_filename()
+        entry = self._cache.root / PYTHON_EMBED_DIR / '{}-{}'.format(
+            os.path.splitext(filename)[0], fingerprint(self._pth_extra_lines())[:8])
+        python_tree = cached_tree(entry, self._unpack_python_embeddable)
+        self._cache.record(python_tree)
+
+        with self._spinner('Copying Python...'):
+            link_tree(python_tree, os.path.join(self.packed_app.build_dir, 'Python'))
 
-            self.packed_app.install_dirs.append(('Python', '$INSTDIR'))
-            self.packed_app.extra_files.append((os.path.join(_PKGDIR, '_system_path.py'), '$INSTDIR'))
+        self.packed_app.manifest.record('python', stage_fingerprint, outputs=['Python'])
 
     def prepare_msvcrt(self):
         #TODO: Move to NSIS packer
@@ -133,30 +293,203 @@ class Bundler():
         dst = os.path.join(self.packed_app.build_dir, 'msvcrt')
         self.msvcrt_files = sorted(os.listdir(src))
 
-        with self.project.core.ui.open_spinner('Copying msvcrt files...'):
+        stage_fingerprint = self._fingerprint('msvcrt', arch, self.msvcrt_files)
+        if self._is_fresh('msvcrt', stage_fingerprint):
+            return
+
+        with self._spinner('Copying msvcrt files...'):
             shutil.copytree(src, dst)
 
+        self.packed_app.manifest.record('msvcrt', stage_fingerprint, outputs=['msvcrt'])
+
     def prepare_license(self):
         """
         If a license file has been specified, ensure it's copied into the
         install directory and added to the install_files list.
         """
-        if self.packed_app.license:
-            with self.project.core.ui.open_spinner('Copying license file...'):
-                shutil.copy2(self.packed_app.license, self.packed_app.build_dir)
-                license_file_name = os.path.basename(self.packed_app.license)
-                self.packed_app.install_files.append((license_file_name, '$INSTDIR'))
+        license_file = self.packed_app.license
+        stage_fingerprint = self._fingerprint('license', license_file, license_file and self._hash_path(license_file))
+        if license_file:
+            license_file_name = os.path.basename(license_file)
+            self.packed_app.install_files.append((license_file_name, '$INSTDIR'))
+
+        if self._is_fresh('license', stage_fingerprint):
+            return
+
+        if license_file:
+            with self._spinner('Copying license file...'):
+                shutil.copy2(license_file, self.packed_app.build_dir)
+
+        self.packed_app.manifest.record('license', stage_fingerprint, outputs=[license_file_name] if license_file else [])
+
+    def _plan_wheels(self, dependencies, just_names):
+        """Work out the complete set of wheels for the bundle.
+
+        Local wheels take priority over index wheels, so any locked dependency
+        with the same name as a local wheel is dropped before the index is
+        queried. Local wheels are deduplicated by name and version.
+
+        Returns the local wheel paths, the requirements to fetch from the index,
+        and the number of wheels skipped.
+        """
+        local_wheels = {}
+        skipped = 0
+        for dep in self.packed_app.config.get("local_wheels", []):
+            dep_filepath = os.path.join(self._package_dir, dep)
+            if not os.path.isfile(dep_filepath):
+                continue
+
+            key = _wheel_key(dep_filepath)
+            if key in local_wheels:
+                skipped += 1
+            else:
+                local_wheels[key] = dep_filepath
+
+        local_names = {name for name, _ in local_wheels}
+        index_dependencies = []
+        for dependency, name in zip(dependencies, just_names):
+            if canonicalize_name(name) in local_names:
+                skipped += 1
+            else:
+                index_dependencies.append(dependency)
+
+        return list(local_wheels.values()), index_dependencies, skipped
+
+    def _index_sources(self):
+        """Return the index URLs, find-links and trusted hosts to find wheels in.
+
+        These are the project's PDM sources plus any ``win-packer.find_links``
+        directories. Offline, only the find-links directories and the wheel
+        cache are searched.
+        """
+        find_links = [Path(self.project.root, d).absolute().as_uri() for d in self.packed_app.find_links]
+
+        if self.packed_app.offline:
+            return [], [self._cache.root.as_uri()] + find_links, []
+
+        index_urls, source_find_links, trusted_hosts = get_index_urls(self.project.sources)
+        return index_urls, source_find_links + find_links, trusted_hosts
+
+    def _fetch_wheel(self, finder, resolutions, dependency, hashes, extract_queue, stage_entry=None):
+        """Find and download the wheel for a single dependency.
+
+        The finder is only asked for the best link if it isn't already in the
+        resolution cache. Wheels are checked against the hashes in the lockfile, both when they
+        are downloaded and when they're found in the cache.
+
+        Runs on a worker thread; the outcome is handed over to the extraction
+        loop through ``extract_queue`` as a ``(dependency, wheel, sha256, error)``
+        tuple, with the wheel's hash if it was worked out on the way.
+        Its downloads are profiled as part of ``stage_entry``.
+        """
+        with inherit(stage_entry):
+            try:
+                resolved = resolutions.get(dependency)
+                if resolved is not None and urlparse(resolved[0]).scheme == 'file' and not url_to_path(resolved[0]).is_file():
+                    # The local wheel it found last time has gone
+                    resolved = None
+                if resolved is None:
+                    result = finder.find_best_match(dependency)
+                    if result.best is not None:
+                        resolved = resolutions.set(dependency, result.best.link.url, result.best.link.is_wheel)
+
+                if resolved is None:
+                    extract_queue.put((dependency, None, None, f"Skipping {dependency} as it's not found"))
+                elif not resolved[1]:
+                    #TODO: handle non-wheel dependencies
+                    extract_queue.put((dependency, None, None, f"Skipping {dependency} as it's not a wheel"))
+                elif urlparse(resolved[0]).scheme == 'file':
+                    # From a find-links directory or, offline, the wheel cache itself
+                    wheel = url_to_path(resolved[0])
+                    sha256 = hashes.get(wheel.name)
+                    if sha256 and file_sha256(wheel) != sha256:
+                        raise PdmUsageError(f"{wheel} does not match the hash in the lockfile")
+                    self._cache.record(wheel)
+                    extract_queue.put((dependency, wheel, sha256, None))
+                else:
+                    url = resolved[0]
+                    filename = os.path.basename(urlparse(url).path)
+
+                    sha256 = hashes.get(filename)
+
+                    cache_file = self._cache.root / filename
+                    # Another build may be downloading the same wheel
+                    with self._cache.lock(filename):
+                        if cache_file.is_file() and sha256 and file_sha256(cache_file) != sha256:
+                            logger.info('Cached %s does not match the lockfile, downloading it again', filename)
+                            cache_file.unlink()
+                        downloaded = not cache_file.is_file()
+                        if downloaded:
+                            count(cache_misses=1)
+                            sha256 = download(url, cache_file, sha256=sha256)
+                        else:
+                            count(cache_hits=1)
+                    self._cache.record(cache_file, changed=downloaded)
+
+                    extract_queue.put((dependency, cache_file, sha256, None))
+            except BaseException as e:
+                extract_queue.put((dependency, None, None, e))
+
+    def _dependencies_fingerprint(self):
+        local_wheel_paths = [os.path.join(self._package_dir, dep) for dep in self.packed_app.config.get("local_wheels", [])]
+        return self._fingerprint(
+            'dependencies',
+            self._hash_path(self.project.root / self.project.LOCKFILE_FILENAME),
+            self.packed_app.py_version,
+            self.packed_app.py_bit,
+            [(dep, self._hash_path(dep)) for dep in local_wheel_paths if os.path.isfile(dep)],
+            self._index_sources(),
+            self.exclude.patterns,
+            # Compiling bytecode changes pkgs, and sourceless and zipping
+            # packages remove files from it
+            self.packed_app.compile_bytecode,
+            self.packed_app.sourceless,
+            self.packed_app.zip_packages,
+            self.packed_app.zip_packages_exclude,
+            # Tree shaking removes modules the app may need once it changes
+            self._tree_shake_inputs(),
+        )
 
     def prepare_dependencies(self):
-        """Copy any dependencies into the build directory."""
+        """Copy any dependencies into the build directory.
+
+        The full set of wheels is planned up front (see :meth:`_plan_wheels`) so
+        each wheel is extracted exactly once. Index lookups and downloads run
+        concurrently on a pool of ``win-packer.workers`` threads, while wheels
+        are extracted one at a time as soon as they arrive. The queue between
+        the two is bounded, so the downloaders can't get too far ahead of the
+        extraction.
+        """
+
+        stage_fingerprint = self._dependencies_fingerprint()
+        if self._is_fresh('dependencies', stage_fingerprint):
+            return
 
         #TODO: a better way? Maybe install them into a virtualenv and copy from there? or install pip in to embeddable python and use that?
         target_platform = 'win_amd64' if int(self.packed_app.py_bit) == 64 else 'win32'
-        dependencies, just_names = self._dependencies
-
-        with self.project.core.ui.open_spinner(title="Preparing dependencies...") as spin:
-            target_python = TargetPython(self._py_version_tuple, [f"cp{self._py_version_tuple[0]}{self._py_version_tuple[1]}", "none"], "cp", [target_platform, "any"])
-            finder = PackageFinder(index_urls=["https://pypi.org/simple/"], target_python=target_python, prefer_binary=just_names)
+        dependencies, just_names, hashes = self._dependencies
+        workers = self.packed_app.workers
+
+        with self._spinner("Preparing dependencies...") as spin:
+            index_urls, find_links, trusted_hosts = self._index_sources()
+            abis = [f"cp{self._py_version_tuple[0]}{self._py_version_tuple[1]}", "none"]
+            target_python = TargetPython(self._py_version_tuple, abis, "cp", [target_platform, "any"])
+            finder = PackageFinder(
+                index_urls=index_urls,
+                find_links=find_links,
+                trusted_hosts=trusted_hosts,
+                target_python=target_python,
+                prefer_binary=just_names,
+            )
+
+            resolutions_key = fingerprint(self._py_version_tuple, abis, target_platform, index_urls, find_links)[:16]
+            resolutions = ResolutionCache(
+                self._cache.root / RESOLUTIONS_DIR / f"{resolutions_key}.json",
+                ttl=self.packed_app.resolution_cache_ttl,
+                refresh=self.packed_app.refresh,
+                source_urls=index_urls + find_links,
+            )
+            resolutions.load()
 
             build_pkg_dir = os.path.join(self.packed_app.build_dir, 'pkgs')
             try:
@@ -164,41 +497,93 @@ class Bundler():
             except FileExistsError:
                 pass
 
-            for dependency in dependencies:
-                spin.update(f"Preparing dependencies: {dependency}...")
-                result = finder.find_best_match(dependency)
-
-                if result.best is not None:
-                    if result.best.link.is_wheel:
-
-                        url = result.best.link.url
-                        filename = os.path.basename(urlparse(url).path)
-
-                        cache_file = get_cache_dir(ensure_existence=True) / filename
-                        if not cache_file.is_file():
-                            download(url, cache_file)
-
-                        extract_wheel(cache_file, build_pkg_dir)
-                    else:
-                        #TODO: handle non-wheel dependencies
-                        #TODO:Set as warning
-                        self.project.core.ui.echo(f"Skipping {dependency} as it's not a wheel", style="warning")
-                else:
-                    self.project.core.ui.echo(f"Skipping {dependency} as it's not found", style="warning")
-
-                #install local dependencies(wheels)
-                for dep in self.packed_app.config.get("local_wheels", []):
-                    dep_filepath = os.path.join(self._package_dir, dep)
-                    if os.path.isfile(dep_filepath):
-                        #TODO: get name and version from wheel
-                        extract_wheel(dep_filepath, build_pkg_dir)
+            local_wheels, dependencies, skipped = self._plan_wheels(dependencies, just_names)
+            extracted_cache = self._cache.root / EXTRACTED_WHEELS_DIR
+            extracted = set()
+
+            #install local dependencies(wheels)
+            for dep_filepath in local_wheels:
+                spin.update(f"Preparing dependencies: {os.path.basename(dep_filepath)}...")
+                self._cache.record(extract_wheel(dep_filepath, build_pkg_dir, exclude=self.exclude, cache_dir=extracted_cache))
+                extracted.add(_wheel_key(dep_filepath))
+
+            extract_queue = queue.Queue(maxsize=workers)
+            stage_entry = current_entry()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._fetch_wheel, finder, resolutions, dependency, hashes, extract_queue, stage_entry)
+                           for dependency in dependencies]
+
+                try:
+                    for n in range(1, len(dependencies) + 1):
+                        dependency, wheel, sha256, error = extract_queue.get()
+                        spin.update(f"Preparing dependencies ({n}/{len(dependencies)}): {dependency}...")
+
+                        if isinstance(error, BaseException):
+                            raise error
+                        elif error is not None:
+                            #TODO:Set as warning
+                            self.project.core.ui.echo(error, style="warning")
+                        elif _wheel_key(wheel) in extracted:
+                            skipped += 1
+                        else:
+                            self._cache.record(extract_wheel(wheel, build_pkg_dir, exclude=self.exclude,
+                                                             cache_dir=extracted_cache, sha256=sha256))
+                            extracted.add(_wheel_key(wheel))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    # Keep draining so workers blocked on a full queue can finish
+                    while not all(future.done() for future in futures):
+                        try:
+                            extract_queue.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+                    raise
+                finally:
+                    resolutions.save()
+                    self._cache.record(resolutions.path)
+
+        self.project.core.ui.echo(f"Extracted {len(extracted)} wheels, skipped {skipped} duplicate wheels, "
+                                  f"{resolutions.hits} of {resolutions.hits + resolutions.misses} links from the resolution cache")
+        self.packed_app.manifest.record('dependencies', stage_fingerprint, outputs=['pkgs'])
 
     def prepare_commands(self):
-        with self.project.core.ui.open_spinner("Preparing creating excutables"):
-            command_dir = Path(self.packed_app.build_dir) / 'bin'
-            command_dir.mkdir()
+        """Build a launcher executable for each command.
 
-            commands = self._config.setdefault("commands", {})
+        With ``win-packer.frozen_bootstrap``, the launchers don't set up
+        sys.path with site at run time; it's worked out from pkgs now, so this
+        waits for everything which changes pkgs.
+        """
+        command_dir = Path(self.packed_app.build_dir) / 'bin'
+        commands = self._config.setdefault("commands", {})
+        self.packed_app.install_dirs.append((command_dir.name, '$INSTDIR'))
+
+        bootstrap = None
+        if self.packed_app.frozen_bootstrap:
+            bootstrap = render_bootstrap(os.path.join(self.packed_app.build_dir, 'pkgs'), self.packed_app.zip_packages)
+
+        preambles = [cmd["extra_preamble"] for cmd in commands.values() if isinstance(cmd.get("extra_preamble"), str)]
+        stage_fingerprint = self._fingerprint(
+            'commands',
+            commands,
+            self.packed_app.py_bit,
+            distlib.__version__,
+            [(preamble, self._hash_path(preamble)) for preamble in preambles],
+            self.packed_app.zip_packages,
+            bootstrap,
+            self._hash_path(os.path.join(_PKGDIR, '_importtime.py')),
+        )
+        # Launchers built last time, so only the ones which changed are rewritten
+        built = self.packed_app.manifest.get('commands', 'launchers', {})
+        exes_exist = all((command_dir / f'{name}.exe').is_file() for name in commands)
+        if exes_exist and self._is_fresh('commands', stage_fingerprint):
+            return
+
+        with self._spinner("Preparing creating excutables"):
+            command_dir.mkdir(exist_ok=True)
+
+            launchers = {}
+            rewritten = 0
             for name, cmd_options in commands.items():
                 if not "entry_point" in cmd_options:
                     raise ProjectError(f"Command {name} has no entry_point")
@@ -219,32 +604,278 @@ class Bundler():
                 else:
                     env = {}
 
-                CommandBuilder(
+                builder = CommandBuilder(
                     name,
                     cmd_options["entry_point"],
                     cmd_options["console"],
                     command_dir,
                     self.packed_app.py_bit,
                     extra_preamble,
-                    env
-                ).build()
+                    env,
+                    self.packed_app.zip_packages,
+                    bootstrap,
+                )
+                launchers[name] = builder.key
+                if built.get(name) != launchers[name] or not (command_dir / f'{name}.exe').is_file():
+                    builder.build()
+                    rewritten += 1
+
+            # Commands which have been removed from the config
+            for exe in command_dir.glob('*.exe'):
+                if exe.stem not in launchers:
+                    exe.unlink()
+
+        note(launchers_rewritten=rewritten, launchers_reused=len(launchers) - rewritten)
+        self.project.core.ui.echo(f"Rewrote {rewritten} of {len(launchers)} command launchers")
+        # bin isn't an output, so it's kept for the unchanged launchers when
+        # the stage runs again
+        self.packed_app.manifest.record('commands', stage_fingerprint, launchers=launchers)
 
-            self.packed_app.install_dirs.append((command_dir.name, '$INSTDIR'))
+    @property
+    def _packages(self):
+        """The packages in the package directory"""
+        return [file for file in sorted(os.listdir(self._package_dir))
+                if os.path.isfile(os.path.join(self._package_dir, file, '__init__.py'))]
 
     def prepare_packages(self):
-        """Copy any packages into the build directory."""
-        with self.project.core.ui.open_spinner("Copying packages..."):
+        """Copy any packages into the build directory.
+
+        In a build matrix, the packages copied for the first target are
+        linked into the others.
+        """
+        packages = self._packages
+        package_hashes = [(file, self._hash_path(os.path.join(self._package_dir, file))) for file in packages]
+
+        # pkgs is recreated whenever the dependencies change, so they're an input too
+        stage_fingerprint = self._fingerprint(
+            'packages',
+            self._fingerprints.get('dependencies'),
+            package_hashes,
+        )
+        if self._is_fresh('packages', stage_fingerprint, after=['dependencies'], moved=self._zipped_outputs('packages')):
+            return
+
+        shared_dir = None
+        if self._shared is not None:
+            shared_key = fingerprint(package_hashes, self.exclude.patterns)
+            shared_dir = self._shared.packages.get(shared_key)
+
+        outputs = []
+        with self._spinner("Copying packages..."):
+
+            for file in packages:
+                dst = os.path.join(self.packed_app.build_dir, 'pkgs', file)
+                if shared_dir is not None:
+                    link_tree(os.path.join(shared_dir, file), dst)
+                else:
+                    package_dir = os.path.join(self._package_dir, file)
+                    ignore = self.exclude.copytree_ignore(package_dir, f'pkgs/{file}') if self.exclude else None
+                    shutil.copytree(package_dir, dst, ignore=ignore)
+                outputs.append(os.path.join('pkgs', file))
 
-            for file in os.listdir(self._package_dir):
-                package_dir = os.path.join(self._package_dir, file)
-                if os.path.isdir(os.path.join(self._package_dir, file)):
-                    if os.path.isfile(os.path.join(self._package_dir, file, '__init__.py')):
-                        shutil.copytree(package_dir, os.path.join(self.packed_app.build_dir, 'pkgs', file))
+            if self._shared is not None and shared_dir is None:
+                shared_dir = self._shared.path('packages', shared_key[:16])
+                for file in packages:
+                    link_tree(os.path.join(self.packed_app.build_dir, 'pkgs', file), os.path.join(shared_dir, file))
+                self._shared.packages[shared_key] = shared_dir
+
+        self.packed_app.manifest.record('packages', stage_fingerprint, outputs=outputs)
 
             #include_packages = self.packed_app.config.get("include_packages", [])
             #TODO: check if package is valid
             #TODO: Include packages
 
+    def _tree_shake_roots(self):
+        """The modules the commands start from, and the code of their preambles"""
+        commands = self._config.get("commands", {})
+        roots = [cmd["entry_point"].split(':')[0] for cmd in commands.values() if "entry_point" in cmd]
+        preambles = [cmd["extra_preamble"] for cmd in commands.values() if isinstance(cmd.get("extra_preamble"), str)]
+        return roots, preambles
+
+    def _tree_shake_inputs(self):
+        """Everything which decides what tree shaking keeps, or None if it's off"""
+        if not self.packed_app.tree_shake:
+            return None
+        roots, preambles = self._tree_shake_roots()
+        return (
+            roots,
+            self.packed_app.tree_shake_keep,
+            [(preamble, self._hash_path(preamble)) for preamble in preambles],
+            [(file, self._hash_path(os.path.join(self._package_dir, file))) for file in self._packages],
+        )
+
+    def prepare_tree_shake(self):
+        """Remove the modules in pkgs which the commands can't import.
+
+        Imports are found by reading the source of each module reached from
+        the commands' entry points; ``win-packer.tree_shake_keep`` lists any
+        modules which are imported dynamically. Anything tree shaking depends
+        on is part of the dependencies fingerprint, so pkgs is always complete
+        when this runs.
+        """
+        if not self.packed_app.tree_shake:
+            return
+
+        pkgs_dir = os.path.join(self.packed_app.build_dir, 'pkgs')
+        stage_fingerprint = self._fingerprint(
+            'tree_shake',
+            self._fingerprints.get('dependencies'),
+            self._fingerprints.get('packages'),
+        )
+        if self._is_fresh('tree_shake', stage_fingerprint, after=['dependencies', 'packages']) or not os.path.isdir(pkgs_dir):
+            return
+
+        roots, preambles = self._tree_shake_roots()
+        if not roots and not self.packed_app.tree_shake_keep:
+            raise ProjectError("Tree shaking needs a command entry point or win-packer.tree_shake_keep to start from")
+
+        with self._spinner('Tree shaking...'):
+            sources = []
+            for preamble in preambles:
+                with open(preamble, encoding='utf-8') as f:
+                    sources.append(f.read())
+            # .pth files in pkgs can run imports
+            for name in os.listdir(pkgs_dir):
+                if name.endswith('.pth'):
+                    with open(os.path.join(pkgs_dir, name), encoding='utf-8', errors='replace') as f:
+                        sources.extend(line for line in f if line.startswith('import'))
+
+            before = tree_size(pkgs_dir)
+            shake(pkgs_dir, roots, self.packed_app.tree_shake_keep, sources)
+            after = tree_size(pkgs_dir)
+
+        self.project.core.ui.echo(
+            f"Tree shaking: pkgs was {before[0]} files, {before[1] / 1024 / 1024:.1f} MiB, "
+            f"now {after[0]} files, {after[1] / 1024 / 1024:.1f} MiB "
+            f"({before[0] - after[0]} files, {(before[1] - after[1]) / 1024 / 1024:.1f} MiB removed)"
+        )
+        self.packed_app.manifest.record('tree_shake', stage_fingerprint)
+
+    def prepare_bytecode(self):
+        """Compile everything in pkgs to bytecode for the target Python.
+
+        The embeddable Python can't write bytecode into a read-only install
+        directory, so without this every import is compiled again on each
+        start. The compiling interpreter must write bytecode with the same
+        magic number as the target Python.
+        """
+        if not self.packed_app.compile_bytecode:
+            return
+
+        pkgs_dir = os.path.join(self.packed_app.build_dir, 'pkgs')
+        magic = target_magic(os.path.join(self.packed_app.build_dir, 'Python'), self.packed_app.py_version)
+        stage_fingerprint = self._fingerprint(
+            'bytecode',
+            self._fingerprints.get('dependencies'),
+            self._fingerprints.get('packages'),
+            magic.hex(),
+        )
+        if (self._is_fresh('bytecode', stage_fingerprint, after=['dependencies', 'packages', 'tree_shake'])
+                or not os.path.isdir(pkgs_dir)):
+            return
+
+        with self._spinner('Compiling bytecode...'):
+            candidates = [self.packed_app.bytecode_python, str(self.project.python.executable)]
+            python = find_compiler(self.packed_app.py_version, magic, candidates)
+            if self._shared is None:
+                errors = compile_tree(python, pkgs_dir, ddir='pkgs', workers=self.packed_app.workers,
+                                      sourceless=self.packed_app.sourceless)
+            else:
+                errors = self._compile_shared(python, pkgs_dir, magic)
+
+        if errors:
+            self.project.core.ui.echo(f"Some modules couldn't be compiled and were left as source:\n{errors}",
+                                      err=True, style="warning")
+        self.packed_app.manifest.record('bytecode', stage_fingerprint)
+
+    def _compile_shared(self, python, pkgs_dir, magic):
+        """Compile pkgs, linking in the bytecode another target of the build
+        matrix compiled from the same source, and sharing the rest in turn.
+
+        Bytecode only depends on the source, its path and the magic number,
+        so most of it is the same for every architecture.
+        """
+        major, minor = self.packed_app.py_version.split('.')[:2]
+        cache_tag = f'cpython-{major}{minor}'
+        sourceless = self.packed_app.sourceless
+        shared_dir = self._shared.path('bytecode', magic.hex())
+        compiled = self._shared.bytecode.setdefault(magic, {})
+
+        sources = source_hashes(pkgs_dir)
+        reused = [path for path, sha256 in sources.items() if compiled.get(path) == sha256]
+        for path in reused:
+            target = bytecode_path(os.path.join(pkgs_dir, path), cache_tag, sourceless)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_or_copy(os.path.join(shared_dir, path + 'c'), target)
+
+        remaining = [path for path in sources if compiled.get(path) != sources[path]]
+        errors = compile_files(python, pkgs_dir, remaining, ddir='pkgs', workers=self.packed_app.workers,
+                               sourceless=sourceless)
+        for path in remaining:
+            pyc = bytecode_path(os.path.join(pkgs_dir, path), cache_tag, sourceless)
+            if os.path.isfile(pyc):
+                os.makedirs(os.path.dirname(os.path.join(shared_dir, path)), exist_ok=True)
+                link_or_copy(pyc, os.path.join(shared_dir, path + 'c'))
+                compiled[path] = sources[path]
+
+        note(bytecode_reused=len(reused), bytecode_compiled=len(remaining))
+        return errors
+
+    def _zipped_outputs(self, stage):
+        """The outputs of a stage which were moved into pkgs.zip, and are
+        still there as long as it's kept.
+        """
+        if not self.packed_app.zip_packages or not os.path.isfile(os.path.join(self.packed_app.build_dir, PACKAGES_ZIP)):
+            return []
+        zipped = self.packed_app.manifest.get('zip_packages', 'zipped', {})
+        return [os.path.join('pkgs', name) for name, zipped_by in zipped.items() if zipped_by == stage]
+
+    def prepare_zip_packages(self):
+        """Move pure Python packages from pkgs into pkgs.zip.
+
+        Importing from one zip saves Windows looking up thousands of small
+        files. Packages with native extensions or data files stay in pkgs.
+        The packages zipped last time are put back first if the stage which
+        made them was skipped, so the zip can be made again from a full pkgs.
+        """
+        if not self.packed_app.zip_packages:
+            # Remove the zip from a previous build
+            self._is_fresh('zip_packages', None)
+            return
+
+        manifest = self.packed_app.manifest
+        pkgs_dir = os.path.join(self.packed_app.build_dir, 'pkgs')
+        zip_path = os.path.join(self.packed_app.build_dir, PACKAGES_ZIP)
+        stage_fingerprint = self._fingerprint(
+            'zip_packages',
+            self._fingerprints.get('dependencies'),
+            self._fingerprints.get('packages'),
+            self._fingerprints.get('bytecode'),
+        )
+        after = ['dependencies', 'packages', 'tree_shake', 'bytecode']
+        if not self._can_skip('zip_packages', stage_fingerprint, after) and os.path.isfile(zip_path):
+            zipped = manifest.get('zip_packages', 'zipped', {})
+            restore = [name for name, stage in zipped.items() if stage in self._reused]
+            if restore and os.path.isdir(pkgs_dir):
+                restore_packages(zip_path, pkgs_dir, restore)
+
+        if self._is_fresh('zip_packages', stage_fingerprint, after):
+            if os.path.isfile(zip_path):
+                self.packed_app.install_files.append((PACKAGES_ZIP, '$INSTDIR'))
+            return
+        if not os.path.isdir(pkgs_dir):
+            return
+
+        with self._spinner('Zipping packages...'):
+            major, minor = self.packed_app.py_version.split('.')[:2]
+            names = zip_packages(pkgs_dir, zip_path, f'cpython-{major}{minor}', self.packed_app.zip_packages_exclude)
+
+        packages = {os.path.basename(output) for output in manifest.outputs('packages')}
+        zipped = {name: 'packages' if name in packages else 'dependencies' for name in names}
+        if names:
+            self.packed_app.install_files.append((PACKAGES_ZIP, '$INSTDIR'))
+        manifest.record('zip_packages', stage_fingerprint, outputs=[PACKAGES_ZIP] if names else [], zipped=zipped)
+
     def prepare_extra_files(self):
         """Copy a list of files into the build directory, and add them to
         install_files or install_dirs as appropriate.
@@ -254,7 +885,21 @@ class Bundler():
         # in the build directory should already be in place.
         #Path(self.nsi_file).touch()
 
-        with self.project.core.ui.open_spinner(title='Copying extra files...') as spin:
+        stage_fingerprint = self._fingerprint(
+            'extra_files',
+            [(file, destination, self._hash_path(file.rstrip('/\\'))) for file, destination in self.packed_app.extra_files],
+            self.exclude.patterns,
+        )
+        if self._is_fresh('extra_files', stage_fingerprint):
+            for name, destination, is_dir in self.packed_app.manifest.get('extra_files', 'installed', []):
+                if is_dir:
+                    self.packed_app.install_dirs.append((name, destination))
+                else:
+                    self.packed_app.install_files.append((name, destination))
+            return
+
+        installed = []
+        with self._spinner('Copying extra files...') as spin:
             for file, destination in self.packed_app.extra_files:
                 file = file.rstrip('/\\')
                 in_build_dir = Path(self.packed_app.build_dir, os.path.basename(file))
@@ -278,24 +923,93 @@ class Bundler():
                 if os.path.isdir(file):
                     if self.exclude:
                         shutil.copytree(file, str(in_build_dir),
-                            ignore=self.copytree_ignore_callback)
+                            ignore=self.exclude.copytree_ignore(file, in_build_dir.name))
                     else:
                         # Don't use our exclude callback if we don't need to,
                         # as it slows things down.
                         shutil.copytree(file, str(in_build_dir))
                     self.packed_app.install_dirs.append((in_build_dir.name, destination))
+                    installed.append((in_build_dir.name, destination, True))
                 else:
                     shutil.copy2(file, str(in_build_dir))
                     self.packed_app.install_files.append((in_build_dir.name, destination))
+                    installed.append((in_build_dir.name, destination, False))
+
+        self.packed_app.manifest.record(
+            'extra_files',
+            stage_fingerprint,
+            outputs=[name for name, _, _ in installed],
+            installed=installed,
+        )
+
+    def _stages(self):
+        """Declare the build stages, the stages each one needs to wait for and
+        the paths in the build directory they read and write.
+        """
+        stages = [
+            Stage('icon', self.prepare_icon, outputs=[os.path.basename(icon) for icon in self._icons]),
+            Stage('license', self.prepare_license,
+                  outputs=[os.path.basename(self.packed_app.license)] if self.packed_app.license else []),
+            Stage('python', self.prepare_python_embeddable, outputs=['Python']),
+            Stage('msvcrt', self.prepare_msvcrt, outputs=['msvcrt']),
+            Stage('dependencies', self.prepare_dependencies, outputs=['pkgs']),
+            Stage('packages', self.prepare_packages, requires=['dependencies'], outputs=['pkgs']),
+            Stage('tree_shake', self.prepare_tree_shake, requires=['dependencies', 'packages'], outputs=['pkgs']),
+            Stage('bytecode', self.prepare_bytecode, requires=['python', 'dependencies', 'packages', 'tree_shake'],
+                  inputs=['Python'], outputs=['pkgs']),
+            Stage('zip_packages', self.prepare_zip_packages, requires=['dependencies', 'packages', 'bytecode'],
+                  outputs=['pkgs', PACKAGES_ZIP]),
+        ]
+        if self.packed_app.frozen_bootstrap:
+            stages.append(Stage('commands', self.prepare_commands, requires=[stage.name for stage in stages if 'pkgs' in stage.outputs],
+                                inputs=['pkgs'], outputs=['bin']))
+        else:
+            stages.append(Stage('commands', self.prepare_commands, outputs=['bin']))
+        # Extra files are renamed to avoid anything already in the build
+        # directory, and python adds to the list of them, so they go last
+        stages.append(Stage('extra_files', self.prepare_extra_files,
+                            requires=[stage.name for stage in stages], inputs=['.']))
+        return stages
+
+    def _prune_cache(self):
+        """Evict the least recently used cache entries if the cache is over
+        ``win-packer.cache_max_size``, if it's set. It's left for later if
+        other builds are using the cache.
+        """
+        if not self.packed_app.cache_max_size:
+            return
+        pruned = self._cache.prune(self.packed_app.cache_max_size, blocking=False)
+        if pruned and pruned[0]:
+            evicted, freed = pruned
+            self.project.core.ui.echo(f"Evicted {len(evicted)} cache entries, freeing {format_size(freed)}")
 
     def build(self):
-        """Build the bundle."""
-        self.prepare_icon()
-        self.prepare_python_embeddable()
-        self.prepare_msvcrt()
-        self.prepare_dependencies()
-        self.prepare_packages()
-        self.prepare_commands()
-        self.prepare_extra_files()
+        """Build the bundle.
+
+        Independent stages run concurrently, and stages whose inputs haven't
+        changed since the last build are skipped.
+        """
+        stages = self._stages()
 
+        if not self.packed_app.manifest.is_fresh('dependencies', self._dependencies_fingerprint()):
+            # pdm opens its own spinner to resolve the lockfile and only one can
+            # be shown at a time, so resolve before any of the stages start
+            self._dependencies
+
+        with self._cache.using(), self.project.core.ui.open_spinner("Building bundle...") as spin:
+            self._progress = StageProgress(spin, len(stages))
+            try:
+                StageGraph(stages).run(progress=self._progress)
+            finally:
+                self._progress = None
+                self._cache.save()
+        self._prune_cache()
+
+        # Stages register files concurrently, so put them in a stable order
+        self.packed_app.install_dirs.sort()
+        self.packed_app.install_files.sort()
+
+        self.packed_app.bundle_fingerprint = fingerprint(sorted(self._fingerprints.items()))
+        if self._reused:
+            self.project.core.ui.echo(f"Reused up to date stages: {', '.join(sorted(self._reused))}")
         self.project.core.ui.echo(f"[success]{termui.Emoji.SUCC}[/] Bundle built", style="success")
@@ -0,0 +1,207 @@
+import os
+import sys
+import glob
+import shutil
+import zipfile
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+from pdm.exceptions import ProjectError
+
+from ..utils import file_sha256
+
+
+# Magic numbers of the final releases, for when the embeddable build can't be
+# read. See Lib/importlib/_bootstrap_external.py in CPython.
+BYTECODE_MAGIC = {
+    (3, 7): 3394,
+    (3, 8): 3413,
+    (3, 9): 3425,
+    (3, 10): 3439,
+    (3, 11): 3495,
+    (3, 12): 3531,
+    (3, 13): 3571,
+}
+
+
+# Run by the compiling interpreter to compile the files listed on stdin, like
+# ``compileall -f --invalidation-mode unchecked-hash`` does
+_COMPILE_FILES_SCRIPT = """\
+import os, sys, py_compile, importlib.util
+root, ddir, legacy = sys.argv[1], sys.argv[2], sys.argv[3] == '1'
+failed = False
+for path in sys.stdin.read().splitlines():
+    source = os.path.join(root, path)
+    cfile = source + 'c' if legacy else importlib.util.cache_from_source(source)
+    try:
+        py_compile.compile(source, cfile, os.path.join(ddir, path) if ddir else source, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    except py_compile.PyCompileError as e:
+        failed = True
+        print(e.msg)
+sys.exit(1 if failed else 0)
+"""
+
+
+def _magic_bytes(number):
+    return number.to_bytes(2, 'little') + b'\r\n'
+
+
+def target_magic(python_dir, py_version):
+    """Return the bytecode magic number of the target Python.
+
+    It's read from a ``.pyc`` in the standard library zip of the embeddable
+    build, so it's exact even for pre-releases, falling back to the magic
+    number of the final release of the target version.
+    """
+    for stdlib_zip in sorted(glob.glob(os.path.join(python_dir, 'python*.zip'))):
+        try:
+            with zipfile.ZipFile(stdlib_zip) as zf:
+                for name in zf.namelist():
+                    if name.endswith('.pyc'):
+                        with zf.open(name) as f:
+                            return f.read(4)
+        except (OSError, zipfile.BadZipFile):
+            continue
+
+    version = tuple(int(part) for part in py_version.split('.')[:2])
+    if version not in BYTECODE_MAGIC:
+        raise ProjectError(f"Don't know the bytecode magic number of Python {py_version}")
+    return _magic_bytes(BYTECODE_MAGIC[version])
+
+
+def interpreter_magic(python):
+    """Return the bytecode magic number of the interpreter run by the command
+    ``python``, or None if it can't be run.
+    """
+    if python == [sys.executable]:
+        return importlib.util.MAGIC_NUMBER
+    try:
+        result = subprocess.run(
+            python + ['-c', 'import importlib.util; print(importlib.util.MAGIC_NUMBER.hex())'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        return bytes.fromhex(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def find_compiler(py_version, magic, candidates=()):
+    """Find an interpreter which writes bytecode with the target magic number.
+
+    ``candidates`` are tried first, then this interpreter, then
+    ``pythonX.Y`` on the PATH and the ``py`` launcher on Windows. Returns the
+    command to run the interpreter, as a list.
+    """
+    major_minor = '.'.join(py_version.split('.')[:2])
+    commands = [[c] for c in candidates if c]
+    commands.append([sys.executable])
+    for name in [f'python{major_minor}', f'python{major_minor.replace(".", "")}']:
+        path = shutil.which(name)
+        if path:
+            commands.append([path])
+    if shutil.which('py'):
+        commands.append([shutil.which('py'), f'-{major_minor}'])
+
+    seen = set()
+    for command in commands:
+        if tuple(command) in seen:
+            continue
+        seen.add(tuple(command))
+        if interpreter_magic(command) == magic:
+            return command
+
+    raise ProjectError(
+        f"No Python {major_minor} interpreter was found to compile bytecode with, "
+        "set win-packer.bytecode_python to one")
+
+
+def compile_tree(python, path, ddir=None, workers=1, sourceless=False):
+    """Compile every module under path with the interpreter run by the
+    command ``python``.
+
+    Bytecode is written as unchecked hash-based ``.pyc`` files, so it stays
+    valid however the installer sets the files' modification times. With
+    ``sourceless`` the ``.pyc`` files are written next to the sources, which
+    are then removed. ``ddir`` replaces path in the filenames shown in
+    tracebacks, rather than the build directory. Returns the output of any modules which failed to
+    compile; they are left as source.
+    """
+    command = python + [
+        '-m', 'compileall', '-q', '-f',
+        '-j', str(workers),
+        '--invalidation-mode', 'unchecked-hash',
+    ]
+    if ddir:
+        command.extend(['-d', ddir])
+    if sourceless:
+        command.append('-b')
+    command.append(path)
+
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+    if sourceless:
+        remove_sources(path)
+    return result.stdout.strip() if result.returncode != 0 else ''
+
+
+def compile_files(python, path, files, ddir=None, workers=1, sourceless=False):
+    """Compile some of the modules under path, given relative to it, like
+    :func:`compile_tree`.
+
+    The files are shared between up to ``workers`` interpreters running at
+    once. Returns the output of any modules which failed to compile.
+    """
+    files = list(files)
+    chunks = [files[i::workers] for i in range(min(workers, len(files)))]
+
+    def run(chunk):
+        command = python + ['-c', _COMPILE_FILES_SCRIPT, path, ddir or '', '1' if sourceless else '0']
+        result = subprocess.run(command, input='\n'.join(chunk), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors='replace')
+        return result.stdout.strip() if result.returncode != 0 else ''
+
+    errors = []
+    if chunks:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            errors = [output for output in executor.map(run, chunks) if output]
+    if sourceless:
+        remove_sources(path)
+    return '\n'.join(errors)
+
+
+def source_hashes(path):
+    """Return the SHA-256 of every module under path, keyed by its path
+    relative to path.
+    """
+    hashes = {}
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            if filename.endswith('.py'):
+                source = os.path.join(root, filename)
+                hashes[os.path.relpath(source, path)] = file_sha256(source)
+    return hashes
+
+
+def bytecode_path(source, cache_tag, sourceless=False):
+    """Where the bytecode of source is written, with the cache tag of the
+    compiling interpreter, e.g. ``cpython-310``.
+    """
+    if sourceless:
+        return source + 'c'
+    directory, filename = os.path.split(source)
+    return os.path.join(directory, '__pycache__', f'{os.path.splitext(filename)[0]}.{cache_tag}.pyc')
+
+
+def remove_sources(path):
+    """Remove each ``.py`` file which has a ``.pyc`` next to it"""
+    for root, dirs, files in os.walk(path):
+        compiled = {f for f in files if f.endswith('.pyc')}
+        for filename in files:
+            if filename.endswith('.py') and filename + 'c' in compiled:
+                os.remove(os.path.join(root, filename))
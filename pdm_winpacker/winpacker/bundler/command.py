@@ -1,12 +1,35 @@
 import os
 import io
+import ntpath
+import hashlib
 import distlib.scripts
-from zipfile import ZipFile
+from functools import cached_property, lru_cache
+from zipfile import ZipFile, ZipInfo
+
+
+BOOTSTRAP_MODULE = '_winpacker_bootstrap'
+IMPORTTIME_MODULE = '_winpacker_importtime'
+IMPORTTIME_ENV_VAR = 'WINPACKER_IMPORTTIME'
+_IMPORTTIME_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_importtime.py')
+# Fixed timestamps, so the same script always gives the same launcher
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+@lru_cache(maxsize=None)
+def _read_file(path):
+    """Read a launcher stub or a module for the launchers, only once however
+    many commands use it.
+    """
+    with open(path, 'rb') as f:
+        return f.read()
+
 
 class CommandBuilder():
 
     SCRIPT_TEMPLATE = u"""# -*- coding: utf-8 -*-
 import sys, os
+if os.environ.get('WINPACKER_IMPORTTIME'):
+    import _winpacker_importtime
 import site
 installdir = os.path.dirname(os.path.dirname(sys.executable))
 pkgdir = os.path.join(installdir, 'pkgs')
@@ -14,6 +37,7 @@ sys.path.insert(0, pkgdir)
 # Ensure .pth files in pkgdir are handled properly
 site.addsitedir(pkgdir)
 os.environ['PYTHONPATH'] = pkgdir + os.pathsep + os.environ.get('PYTHONPATH', '')
+{packages_zip}
 
 # Allowing .dll files in Python directory to be found
 os.environ['PATH'] += ';' + os.path.dirname(sys.executable)
@@ -24,10 +48,36 @@ os.environ['PATH'] += ';' + os.path.dirname(sys.executable)
 
 if __name__ == '__main__':
     from {module} import {func}
+    if os.environ.get('WINPACKER_IMPORTTIME'):
+        _winpacker_importtime.ready('{module}:{func}')
     sys.exit({func}())
 """
 
-    def __init__(self, name, entry_point, console, target, bit=64, extra_preamble=None, env={}):
+    # sys.path and the .pth files in pkgs were worked out when the launcher
+    # was built, see render_bootstrap()
+    FROZEN_SCRIPT_TEMPLATE = u"""# -*- coding: utf-8 -*-
+import sys, os
+if os.environ.get('WINPACKER_IMPORTTIME'):
+    import _winpacker_importtime
+import _winpacker_bootstrap
+
+{script_env}
+
+{extra_preamble}
+
+if __name__ == '__main__':
+    from {module} import {func}
+    if os.environ.get('WINPACKER_IMPORTTIME'):
+        _winpacker_importtime.ready('{module}:{func}')
+    sys.exit({func}())
+"""
+
+    PACKAGES_ZIP_TEMPLATE = u"""pkgzip = os.path.join(installdir, 'pkgs.zip')
+sys.path.insert(0, pkgzip)
+os.environ['PYTHONPATH'] = pkgzip + os.pathsep + os.environ['PYTHONPATH']
+"""
+
+    def __init__(self, name, entry_point, console, target, bit=64, extra_preamble=None, env={}, zip_packages=False, bootstrap=None):
         self.name = name
         self.entry_point = entry_point
         self.console = console
@@ -35,24 +85,24 @@ if __name__ == '__main__':
         self.bit = bit
         self.extra_preamble = extra_preamble
         self.env = env
+        self.zip_packages = zip_packages
+        self.bootstrap = bootstrap
 
     def _find_exe(self):
         distlib_dir = os.path.dirname(distlib.scripts.__file__)
         name = 't' if self.console else 'w'
         return os.path.join(distlib_dir, f"{name}{self.bit}.exe")
 
-    def _prepare_bin_directory(self):
-        exe_path = self.target / (self.name + '.exe')
-        console = self.console
-
+    @cached_property
+    def _parts(self):
+        """The launcher stub, the shebang and the files to put in its zip"""
         # 1. Get the base launcher exe from distlib
-        with open(self._find_exe(), 'rb') as f:
-            launcher_b = f.read()
+        launcher_b = _read_file(self._find_exe())
 
         # 2. Shebang: Python executable to run with
         # shebangs relative to launcher location, according to
         # https://bitbucket.org/vinay.sajip/simple_launcher/wiki/Launching%20an%20interpreter%20in%20a%20location%20relative%20to%20the%20launcher%20executable
-        if console:
+        if self.console:
             shebang = b"#!<launcher_dir>\\..\\Python\\python.exe\r\n"
         else:
             shebang = b"#!<launcher_dir>\\..\\Python\\pythonw.exe\r\n"
@@ -60,29 +110,131 @@ if __name__ == '__main__':
         # 3. The script to run, inside a zip file
         if isinstance(self.extra_preamble, str):
             # Filename
-            extra_preamble = io.open(self.extra_preamble, encoding='utf-8')
+            with io.open(self.extra_preamble, encoding='utf-8') as f:
+                extra_preamble = f.read()
         elif self.extra_preamble is None:
-            extra_preamble = io.StringIO()  # Empty
+            extra_preamble = ''  # Empty
         else:
             # Passed a StringIO or similar object
-            extra_preamble = self.extra_preamble
+            extra_preamble = self.extra_preamble.read()
         module, func = self.entry_point.split(':')
         script_env = "\r\n".join(f"os.environ['{k}'] = '{v}'" for k, v in self.env.items())
-        script = self.SCRIPT_TEMPLATE.format(
-            module=module, func=func,
-            extra_preamble=extra_preamble.read().rstrip(),
-            script_env=script_env,
-        )
+        if self.bootstrap is None:
+            script = self.SCRIPT_TEMPLATE.format(
+                module=module, func=func,
+                extra_preamble=extra_preamble.rstrip(),
+                script_env=script_env,
+                packages_zip=self.PACKAGES_ZIP_TEMPLATE if self.zip_packages else '',
+            )
+        else:
+            script = self.FROZEN_SCRIPT_TEMPLATE.format(
+                module=module, func=func,
+                extra_preamble=extra_preamble.rstrip(),
+                script_env=script_env,
+            )
+
+        files = {
+            '__main__.py': script.encode('utf-8'),
+            f'{IMPORTTIME_MODULE}.py': _read_file(_IMPORTTIME_SOURCE),
+        }
+        if self.bootstrap is not None:
+            files[f'{BOOTSTRAP_MODULE}.py'] = self.bootstrap.encode('utf-8')
+        return launcher_b, shebang, files
+
+    @property
+    def key(self):
+        """A hash of everything that goes into the launcher; launchers with
+        the same key are identical.
+        """
+        launcher_b, shebang, files = self._parts
+        h = hashlib.sha256(launcher_b)
+        h.update(shebang)
+        for name, data in sorted(files.items()):
+            h.update(f'\0{name}\0{len(data)}\0'.encode('utf-8'))
+            h.update(data)
+        return h.hexdigest()
+
+    def _prepare_bin_directory(self):
+        exe_path = self.target / (self.name + '.exe')
+        launcher_b, shebang, files = self._parts
 
         zip_bio = io.BytesIO()
         with ZipFile(zip_bio, 'w') as zf:
-            zf.writestr('__main__.py', script.encode('utf-8'))
+            for name, data in files.items():
+                zf.writestr(ZipInfo(name, date_time=_ZIP_DATE_TIME), data)
 
         # Put the pieces together
-        with exe_path.open('wb') as f:
+        tmp_path = exe_path.with_name(exe_path.name + '.tmp')
+        with tmp_path.open('wb') as f:
             f.write(launcher_b)
             f.write(shebang)
             f.write(zip_bio.getvalue())
+        os.replace(tmp_path, exe_path)
 
     def build(self):
-        self._prepare_bin_directory()
\ No newline at end of file
+        self._prepare_bin_directory()
+
+
+BOOTSTRAP_TEMPLATE = u"""# -*- coding: utf-8 -*-
+# Generated when the launcher was built. It has the same effect on sys.path as
+# adding pkgs to it and calling site.addsitedir() on it, without scanning pkgs
+# for .pth files or parsing them.
+import sys, os
+
+installdir = os.path.dirname(os.path.dirname(sys.executable))
+_prepend = [os.path.join(installdir, p) for p in {prepend!r}]
+sys.path[1:] = _prepend + [p for p in sys.path[1:] if p not in _prepend] + \\
+    [os.path.join(installdir, p) for p in {append!r}]
+
+for _line in {pth_imports!r}:
+    try:
+        exec(_line, {{}})
+    except Exception:
+        import traceback
+        sys.stderr.write('Error processing a .pth file in pkgs:\\n')
+        traceback.print_exc()
+
+# Allowing .dll files in Python directory to be found
+os.environ['PATH'] += ';' + os.path.dirname(sys.executable)
+"""
+
+
+def pth_effects(pkgs_dir):
+    """Work out what ``site.addsitedir()`` would do with the .pth files in a
+    pkgs directory.
+
+    Returns the directories it would add to sys.path, relative to the install
+    directory and in order, and the ``import`` lines it would run. Like site,
+    directories which don't exist are left out; so are absolute paths, which
+    won't be the same on the machine the application is installed on.
+    """
+    append = []
+    imports = []
+    if not os.path.isdir(pkgs_dir):
+        return append, imports
+    for name in sorted(os.listdir(pkgs_dir)):
+        if not name.endswith('.pth') or name.startswith('.'):
+            continue
+        with open(os.path.join(pkgs_dir, name), encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                if line.startswith(('import ', 'import\t')):
+                    imports.append(line.rstrip())
+                    continue
+                line = line.rstrip()
+                if os.path.isabs(line) or ntpath.isabs(line):
+                    continue
+                if not os.path.exists(os.path.join(pkgs_dir, line)):
+                    continue
+                path = ntpath.normpath(ntpath.join('pkgs', line))
+                if path not in append and path != 'pkgs':
+                    append.append(path)
+    return append, imports
+
+
+def render_bootstrap(pkgs_dir, zip_packages=False):
+    """Render the frozen bootstrap module shared by every launcher"""
+    append, imports = pth_effects(pkgs_dir)
+    prepend = ['pkgs.zip', 'pkgs'] if zip_packages else ['pkgs']
+    return BOOTSTRAP_TEMPLATE.format(prepend=prepend, append=append, pth_imports=imports)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import zipfile
+from zipfile import ZipFile, ZipInfo
+
+
+PACKAGES_ZIP = 'pkgs.zip'
+# Files which can be imported from a zip
+_MODULE_SUFFIXES = ('.py', '.pyc', '.pyi')
+_MODULE_FILES = {'py.typed'}
+
+
+def _module_files(path):
+    """List the files of a top level package or module in pkgs, relative to
+    pkgs, or None if it can't be imported from a zip.
+
+    Anything with native extensions or data files has to stay on disk, as
+    does anything which refers to ``__file__``, since it's probably using it
+    to find files next to it. Namespace packages stay on disk too.
+    """
+    name = os.path.basename(path)
+    if os.path.isfile(path):
+        paths = [(path, name)]
+    elif os.path.isfile(os.path.join(path, '__init__.py')) or os.path.isfile(os.path.join(path, '__init__.pyc')):
+        paths = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                paths.append((file_path, os.path.relpath(file_path, os.path.dirname(path)).replace(os.sep, '/')))
+    else:
+        return None
+
+    for file_path, arcname in paths:
+        if '/__pycache__/' in '/' + arcname:
+            continue
+        if not arcname.endswith(_MODULE_SUFFIXES) and os.path.basename(arcname) not in _MODULE_FILES:
+            return None
+        with open(file_path, 'rb') as f:
+            if b'__file__' in f.read():
+                return None
+
+    return paths
+
+
+def _archive_name(arcname, cache_tag):
+    """Where a file goes in the zip, or None to leave it out.
+
+    zipimport doesn't look in ``__pycache__``, so the target's bytecode is
+    moved next to its source, e.g. ``a/__pycache__/b.cpython-310.pyc`` to
+    ``a/b.pyc``, and any other bytecode there is dropped.
+    """
+    parent, _, filename = arcname.rpartition('/')
+    if not parent.endswith('__pycache__') and parent != '__pycache__':
+        return arcname
+
+    suffix = f'.{cache_tag}.pyc'
+    if not filename.endswith(suffix):
+        return None
+    grandparent = parent.rpartition('/')[0]
+    name = filename[:-len(suffix)] + '.pyc'
+    return f'{grandparent}/{name}' if grandparent else name
+
+
+def zip_packages(pkgs_dir, zip_path, cache_tag, exclude=()):
+    """Move the pure Python packages and modules in pkgs_dir into a zip.
+
+    Members are stored rather than compressed, so importing them doesn't
+    need to decompress anything; installers compress them anyway. Returns the
+    names of the top level packages and modules which were moved.
+    """
+    zipped = {}
+    for name in sorted(os.listdir(pkgs_dir)):
+        module = name[:-len('.pyc')] if name.endswith('.pyc') else os.path.splitext(name)[0]
+        if module in exclude or name == '__pycache__' or '.' in module:
+            # Leaves out .dist-info, .data, .pth and the like
+            continue
+        path = os.path.join(pkgs_dir, name)
+        if os.path.isfile(path) and not name.endswith(('.py', '.pyc')):
+            continue
+        paths = _module_files(path)
+        if paths is not None:
+            zipped[name] = paths
+
+    if not zipped:
+        return []
+
+    # A top level module's bytecode is in pkgs/__pycache__
+    pycache = os.path.join(pkgs_dir, '__pycache__')
+    for name, paths in zipped.items():
+        if os.path.isfile(os.path.join(pkgs_dir, name)) and name.endswith('.py'):
+            cached = os.path.join(pycache, f'{name[:-3]}.{cache_tag}.pyc')
+            if os.path.isfile(cached):
+                paths.append((cached, f'__pycache__/{name[:-3]}.{cache_tag}.pyc'))
+
+    tmp_path = zip_path + '.tmp'
+    with ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zf:
+        for name in sorted(zipped):
+            for file_path, arcname in zipped[name]:
+                arcname = _archive_name(arcname, cache_tag)
+                if arcname is not None:
+                    zf.write(file_path, arcname)
+    os.replace(tmp_path, zip_path)
+
+    for name, paths in zipped.items():
+        path = os.path.join(pkgs_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            for file_path, _ in paths:
+                os.remove(file_path)
+    if os.path.isdir(pycache) and not os.listdir(pycache):
+        os.rmdir(pycache)
+
+    return sorted(zipped)
+
+
+def restore_packages(zip_path, pkgs_dir, names):
+    """Extract some top level packages and modules from a zip made by
+    :func:`zip_packages` back into pkgs_dir, so it can be made again.
+    """
+    names = set(names)
+    with ZipFile(zip_path) as zf:
+        for zinfo in zf.infolist():
+            top = zinfo.filename.split('/', 1)[0]
+            if top in names or (top.endswith('.pyc') and top[:-1] in names):
+                zf.extract(zinfo, pkgs_dir)
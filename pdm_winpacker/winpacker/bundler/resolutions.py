@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+from unearth.utils import split_auth_from_netloc, split_auth_from_url
+
+from ..profile import count
+
+
+class ResolutionCache():
+    """On-disk cache of the best link the package finder found for each
+    pinned requirement.
+
+    Requirements in the lockfile are pinned, so for a given target Python,
+    platform and set of indexes the best link doesn't change. One file is kept
+    per target, so a rebuild with an unchanged lockfile doesn't need to query
+    the index at all. Entries older than ``ttl`` seconds are ignored, and with
+    ``refresh`` every entry is looked up again.
+
+    The cache is shared by every project, so links are stored without the
+    credentials of their index. They're added back from ``source_urls``, the
+    project's index and find-links URLs, for links on the same host.
+    """
+
+    def __init__(self, path, ttl=None, refresh=False, source_urls=()):
+        self.path = str(path)
+        self.ttl = ttl
+        self.refresh = refresh
+        self._netlocs = {}
+        for url in source_urls:
+            netloc = urlparse(url).netloc
+            auth, host = split_auth_from_netloc(netloc)
+            if auth is not None:
+                self._netlocs.setdefault(host, netloc)
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        if self.refresh:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+            return
+        # Entries written before credentials were left out
+        for entry in self._entries.values():
+            auth, url = split_auth_from_url(entry['url'])
+            if auth is not None:
+                entry['url'] = url
+                self._changed = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._changed:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._changed = False
+
+    def get(self, requirement):
+        """Return the cached ``(url, is_wheel)`` for a requirement, or None"""
+        with self._lock:
+            entry = self._entries.get(requirement)
+            if entry is None or (self.ttl and time.time() - entry['time'] > self.ttl):
+                self.misses += 1
+                count(cache_misses=1)
+                return None
+            self.hits += 1
+            count(cache_hits=1)
+            return self._with_auth(entry['url']), entry['is_wheel']
+
+    def _with_auth(self, url):
+        parsed = urlparse(url)
+        netloc = self._netlocs.get(parsed.netloc)
+        return url if netloc is None else parsed._replace(netloc=netloc).geturl()
+
+    def set(self, requirement, url, is_wheel):
+        with self._lock:
+            self._entries[requirement] = {'url': split_auth_from_url(url)[1], 'is_wheel': is_wheel, 'time': time.time()}
+            self._changed = True
+        return url, is_wheel
@@ -0,0 +1,36 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+
+class SharedWork():
+    """Work which doesn't depend on the target architecture, done by the first
+    of ``win-packer.targets`` to need it and reused by the others.
+
+    The stages which make these files go on to change pkgs, by tree shaking,
+    removing sources and zipping packages, so they're linked into a
+    directory of their own next to the targets' build directories, which is
+    removed once every target is built.
+    """
+
+    def __init__(self, build_root):
+        self.build_root = build_root
+        self.directory = None
+        # The locked dependencies, see Bundler._dependencies
+        self.dependencies = None
+        # Directories holding the copied packages, keyed by their fingerprint
+        self.packages = {}
+        # SHA-256 of the source of each compiled module, by bytecode magic
+        self.bytecode = {}
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def __enter__(self):
+        os.makedirs(self.build_root, exist_ok=True)
+        self.directory = mkdtemp(prefix='.shared-', dir=self.build_root)
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
@@ -0,0 +1,149 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pdm.exceptions import ProjectError
+
+from ..profile import current_entry, inherit, measure
+
+
+_current = threading.local()
+
+
+def _overlaps(a, b):
+    """Whether two paths relative to the build directory overlap"""
+    if a == '.' or b == '.':
+        return True
+    return a == b or a.startswith(b + '/') or b.startswith(a + '/')
+
+
+class Stage():
+    """A step of the bundle build.
+
+    ``requires`` names the stages which must finish first. ``inputs`` and
+    ``outputs`` are the paths, relative to the build directory, which the stage
+    reads and writes; they are used to check that stages touching the same
+    paths are ordered.
+    """
+
+    def __init__(self, name, run, requires=(), inputs=(), outputs=()):
+        self.name = name
+        self.run = run
+        self.requires = tuple(requires)
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+
+class StageProgress():
+    """One progress display shared by every running stage"""
+
+    def __init__(self, spinner, total, title="Building bundle"):
+        self.spinner = spinner
+        self.total = total
+        self.title = title
+        self.done = 0
+        self._messages = {}
+        self._lock = threading.Lock()
+
+    def start(self, stage):
+        with self._lock:
+            self._messages[stage] = stage
+            self._refresh()
+
+    def finish(self, stage):
+        with self._lock:
+            self._messages.pop(stage, None)
+            self.done += 1
+            self._refresh()
+
+    def update(self, message):
+        """Set the status message of the stage running on this thread"""
+        with self._lock:
+            self._messages[_current.stage] = message.rstrip('.')
+            self._refresh()
+
+    def _refresh(self):
+        running = '; '.join(self._messages[stage] for stage in sorted(self._messages))
+        if running:
+            self.spinner.update(f"{self.title} ({self.done}/{self.total}): {running}...")
+        else:
+            self.spinner.update(f"{self.title} ({self.done}/{self.total})...")
+
+
+class StageGraph():
+    """Runs stages concurrently, each as soon as the stages it requires are done.
+
+    Each stage is measured in the build profile as an entry of ``kind``,
+    inside whatever was being measured when the graph was run.
+    """
+
+    def __init__(self, stages, kind='stage'):
+        self.stages = {stage.name: stage for stage in stages}
+        self.kind = kind
+        self._ancestors = {}
+        for stage in self.stages.values():
+            self._collect_ancestors(stage.name, ())
+        self._check_paths()
+
+    def _collect_ancestors(self, name, chain):
+        if name in chain:
+            raise ProjectError(f"Build stages have a dependency cycle: {' -> '.join(chain + (name,))}")
+        if name not in self.stages:
+            raise ProjectError(f"Build stage {chain[-1]} requires unknown stage {name}")
+        if name not in self._ancestors:
+            ancestors = set()
+            for required in self.stages[name].requires:
+                ancestors.add(required)
+                ancestors.update(self._collect_ancestors(required, chain + (name,)))
+            self._ancestors[name] = ancestors
+        return self._ancestors[name]
+
+    def _ordered(self, a, b):
+        return a in self._ancestors[b] or b in self._ancestors[a]
+
+    def _check_paths(self):
+        """Make sure no two unordered stages write, or read and write, the same paths"""
+        for a in self.stages.values():
+            for b in self.stages.values():
+                if a.name == b.name or self._ordered(a.name, b.name):
+                    continue
+                for output in a.outputs:
+                    for path in b.outputs + b.inputs:
+                        if _overlaps(output, path):
+                            raise ProjectError(
+                                f"Build stages {a.name} and {b.name} both use {path} but aren't ordered")
+
+    def _run_stage(self, stage, progress, parent):
+        _current.stage = stage.name
+        if progress is not None:
+            progress.start(stage.name)
+        try:
+            with inherit(parent), measure(self.kind, stage.name):
+                stage.run()
+        finally:
+            if progress is not None:
+                progress.finish(stage.name)
+            _current.stage = None
+
+    def run(self, workers=None, progress=None):
+        """Run every stage, raising the first error any of them raises.
+
+        Stages which are already running are allowed to finish, but nothing
+        new is started after a failure.
+        """
+        pending = dict(self.stages)
+        done = set()
+        running = {}
+        parent = current_entry()
+
+        with ThreadPoolExecutor(max_workers=workers or len(self.stages) or 1) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(required in done for required in stage.requires):
+                        running[executor.submit(self._run_stage, stage, progress, parent)] = name
+                        del pending[name]
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    future.result()
+                    done.add(name)
@@ -0,0 +1,263 @@
+import os
+import ast
+import shutil
+
+
+# Directories which are removed from packages unless a module in them is used
+UNUSED_DIRECTORIES = {'test', 'tests', 'testing', 'doc', 'docs', 'example', 'examples'}
+# Files which are only used by type checkers
+TYPING_SUFFIXES = ('.pyi',)
+TYPING_FILES = {'py.typed'}
+# Parts of .dist-info directories which nothing needs at run time
+DIST_INFO_EXTRAS = {'RECORD', 'INSTALLER', 'REQUESTED', 'WHEEL', 'direct_url.json', 'top_level.txt'}
+EXTENSION_SUFFIXES = ('.pyd', '.so')
+
+
+def _is_metadata_dir(name):
+    return name.endswith(('.dist-info', '.data', '.egg-info'))
+
+
+def tree_size(path):
+    """Return the number of files and total bytes under path"""
+    files = size = 0
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            files += 1
+            size += os.lstat(os.path.join(root, filename)).st_size
+    return files, size
+
+
+class ModuleIndex():
+    """The modules in a pkgs directory, by dotted name"""
+
+    def __init__(self, pkgs_dir):
+        self.pkgs_dir = pkgs_dir
+        # name -> path of the module's source or extension
+        self.modules = {}
+        self.packages = set()
+        # top level names with native extension modules in them
+        self.extensions = set()
+
+        for root, dirs, files in os.walk(pkgs_dir):
+            rel_root = os.path.relpath(root, pkgs_dir)
+            parts = [] if rel_root == '.' else rel_root.split(os.sep)
+            dirs[:] = [d for d in dirs if d != '__pycache__' and not (not parts and _is_metadata_dir(d))]
+            for filename in files:
+                if filename.endswith('.py'):
+                    stem = filename[:-3]
+                elif filename.endswith(EXTENSION_SUFFIXES):
+                    # e.g. _speedups.cp310-win_amd64.pyd
+                    stem = filename.split('.', 1)[0]
+                    self.extensions.add(parts[0] if parts else stem)
+                else:
+                    continue
+
+                if stem == '__init__':
+                    if not parts:
+                        continue
+                    name = '.'.join(parts)
+                    self.packages.add(name)
+                else:
+                    name = '.'.join(parts + [stem])
+                self.modules[name] = os.path.join(root, filename)
+
+    def __contains__(self, name):
+        return name in self.modules
+
+    def submodules(self, name):
+        prefix = name + '.'
+        return [module for module in self.modules if module.startswith(prefix)]
+
+
+def _imports(index, name):
+    """Names of the modules in the index which a module may import"""
+    path = index.modules[name]
+    if not path.endswith('.py'):
+        return set()
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (SyntaxError, ValueError):
+        return set()
+
+    package = name if name in index.packages else name.rpartition('.')[0]
+    found = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            found.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package.split('.') if package else []
+                base = base[:len(base) - node.level + 1]
+                module = '.'.join(base + ([node.module] if node.module else []))
+            else:
+                module = node.module
+            if not module:
+                continue
+            found.add(module)
+            for alias in node.names:
+                if alias.name == '*':
+                    found.update(_star_submodules(index, module))
+                else:
+                    found.add(f'{module}.{alias.name}')
+        elif isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Constant) \
+                and isinstance(node.args[0].value, str):
+            # __import__('x') and importlib.import_module('x')
+            func = node.func
+            func_name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            if func_name in ('__import__', 'import_module'):
+                found.add(node.args[0].value)
+
+    return {module for module in found if module in index}
+
+
+def _star_submodules(index, package):
+    """Submodules named in a package's ``__all__``, which ``import *`` loads"""
+    path = index.modules.get(package)
+    if package not in index.packages or not path.endswith('.py'):
+        return []
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (SyntaxError, ValueError):
+        return []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == '__all__' for t in node.targets):
+            try:
+                names = ast.literal_eval(node.value)
+            except ValueError:
+                return []
+            return [f'{package}.{n}' for n in names if isinstance(n, str)]
+    return []
+
+
+def reachable_modules(index, roots, keep=(), sources=()):
+    """Find the modules which can be imported starting from some modules.
+
+    ``keep`` names modules which are imported dynamically; they and their
+    submodules are always kept. ``sources`` is extra code to look for
+    imports in, such as launcher preambles. Importing a module imports its
+    parent packages, and a package with native extensions keeps all of its
+    modules, since there's no telling what they import.
+    """
+    pending = [name for name in roots if name in index]
+    for name in keep:
+        pending.extend(module for module in [name] + index.submodules(name) if module in index)
+    for source in sources:
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names if alias.name in index)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.extend(m for m in [node.module] + [f'{node.module}.{a.name}' for a in node.names]
+                               if m in index)
+
+    reached = set()
+    expanded = set()
+    while pending:
+        name = pending.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+
+        parent = name.rpartition('.')[0]
+        if parent and parent in index:
+            pending.append(parent)
+        top = name.split('.', 1)[0]
+        if top in index.extensions and top not in expanded:
+            expanded.add(top)
+            pending.extend(module for module in [top] + index.submodules(top) if module in index)
+        pending.extend(_imports(index, name) - reached)
+
+    return reached
+
+
+def _dist_info_top_levels(dist_info):
+    """The top level names in pkgs which a .dist-info directory describes"""
+    top_level = os.path.join(dist_info, 'top_level.txt')
+    if os.path.isfile(top_level):
+        with open(top_level, encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    record = os.path.join(dist_info, 'RECORD')
+    if not os.path.isfile(record):
+        return None
+    names = set()
+    with open(record, encoding='utf-8') as f:
+        for line in f:
+            top = line.split(',', 1)[0].split('/', 1)[0]
+            if top and top != '..' and not _is_metadata_dir(top):
+                names.add(top)
+    return names
+
+
+def _exists(pkgs_dir, top):
+    """Whether a top level name from top_level.txt or RECORD is still in pkgs"""
+    if os.path.exists(os.path.join(pkgs_dir, top)):
+        return True
+    return any(name.split('.', 1)[0] == top and not _is_metadata_dir(name) for name in os.listdir(pkgs_dir))
+
+
+def shake(pkgs_dir, roots, keep=(), sources=()):
+    """Remove what can't be imported from roots from a pkgs directory.
+
+    Unreachable modules are removed, along with top level packages, tests,
+    docs and examples which are left without any modules, files which are
+    only for type checkers, and .dist-info directories of distributions
+    which were removed entirely. Other .dist-info directories keep their
+    metadata, entry points and licenses. Top level directories which never
+    had any modules in them, such as the DLLs in ``numpy.libs``, are left
+    alone. Returns the number of files removed.
+    """
+    index = ModuleIndex(pkgs_dir)
+    reached = reachable_modules(index, roots, keep, sources)
+    # Top level directories which are packages, or hold modules
+    packages = {name.split('.', 1)[0] for name in index.modules}
+
+    dist_infos = {name: _dist_info_top_levels(os.path.join(pkgs_dir, name))
+                  for name in os.listdir(pkgs_dir) if name.endswith('.dist-info')}
+
+    removed = 0
+    for name, path in index.modules.items():
+        if name not in reached:
+            os.remove(path)
+            removed += 1
+
+    # Bottom up, so whether a directory has any modules left is known from
+    # its files and subdirectories
+    has_modules = {}
+    for root, dirs, files in os.walk(pkgs_dir, topdown=False):
+        rel_root = os.path.relpath(root, pkgs_dir)
+        if rel_root == '.':
+            continue
+        parts = rel_root.split(os.sep)
+        if _is_metadata_dir(parts[0]) or parts[0] not in packages:
+            continue
+
+        for filename in files:
+            if filename.endswith(TYPING_SUFFIXES) or filename in TYPING_FILES:
+                os.remove(os.path.join(root, filename))
+                removed += 1
+
+        has_modules[root] = any(f.endswith(('.py',) + EXTENSION_SUFFIXES) for f in files) \
+            or any(has_modules.get(os.path.join(root, d), False) for d in dirs)
+        if not has_modules[root] and (len(parts) == 1 or parts[-1] in UNUSED_DIRECTORIES or parts[-1] == '__pycache__'):
+            removed += tree_size(root)[0]
+            shutil.rmtree(root)
+
+    for name, top_levels in dist_infos.items():
+        dist_info = os.path.join(pkgs_dir, name)
+        if top_levels and not any(_exists(pkgs_dir, top) for top in top_levels):
+            removed += tree_size(dist_info)[0]
+            shutil.rmtree(dist_info)
+            continue
+        for extra in DIST_INFO_EXTRAS:
+            path = os.path.join(dist_info, extra)
+            if os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+
+    return removed
@@ -4,45 +4,15 @@ import re
 import fnmatch
 import os
 from pathlib import Path
-from tempfile import mkdtemp
 
+from ..profile import count, measure
+from ..utils import cached_tree, file_sha256, link_tree
 
 
 def normalize_path(path):
     """Normalize paths to contain "/" only"""
     return os.path.normpath(path).replace('\\', '/')
 
-def is_excluded(path, exclude_regexen):
-    """Return True if path matches an exclude pattern"""
-    path = normalize_path(path)
-    for re_pattern in exclude_regexen:
-        if re_pattern.match(path):
-            return True
-    return False
-
-def merge_dir_to(src, dst):
-    """Merge all files from one directory into another.
-
-    Subdirectories will be merged recursively. If filenames are the same, those
-    from src will overwrite those in dst. If a regular file clashes with a
-    directory, an error will occur.
-    """
-    for p in src.iterdir():
-        if p.is_dir():
-            dst_p = dst / p.name
-            if dst_p.is_dir():
-                merge_dir_to(p, dst_p)
-            elif dst_p.is_file():
-                raise RuntimeError('Directory {} clashes with file {}'.format(p, dst_p))
-            else:
-                shutil.copytree(str(p), str(dst_p))
-        else:
-            # Copy regular file
-            dst_p = dst / p.name
-            if dst_p.is_dir():
-                raise RuntimeError('File {} clashes with directory {}'.format(p, dst_p))
-            shutil.copy2(str(p), str(dst_p))
-
 def make_exclude_regexen(exclude_patterns):
     """Translate exclude glob patterns to regex pattern objects.
 
@@ -59,64 +29,170 @@ def make_exclude_regexen(exclude_patterns):
 
     return [re.compile(p) for p in sorted(re_pats)]
 
-def extract_wheel(whl_file, target_dir, exclude=None):
+class ExcludeMatcher():
+    """Exclude glob patterns, compiled into one regex for files and one for
+    directories.
+
+    Paths are relative to the build directory, e.g. ``pkgs/numpy/tests``. A
+    directory matches if it's named by a pattern, in which case everything
+    under it is excluded, so walks can skip it without looking inside.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = sorted(set(patterns))
+        self._file_regex = self._combine(p.pattern for p in make_exclude_regexen(self.patterns))
+        self._dir_regex = self._combine(fnmatch.translate(p) for p in self.patterns)
+
+    @staticmethod
+    def _combine(regexen):
+        regexen = list(regexen)
+        if not regexen:
+            return None
+        return re.compile('|'.join('(?:{})'.format(r) for r in regexen))
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def match(self, path) -> bool:
+        """Whether a file is excluded"""
+        return self._file_regex is not None and self._file_regex.match(normalize_path(path)) is not None
+
+    def match_dir(self, path) -> bool:
+        """Whether a directory and everything in it is excluded"""
+        return self._dir_regex is not None and self._dir_regex.match(normalize_path(path)) is not None
+
+    def copytree_ignore(self, src, prefix):
+        """Make an ``ignore`` callback for :func:`shutil.copytree` copying src
+        to ``prefix`` in the build directory.
+        """
+        def ignore(directory, names):
+            rel_dir = os.path.relpath(directory, src)
+            base = prefix if rel_dir == '.' else '{}/{}'.format(prefix, normalize_path(rel_dir))
+            ignored = set()
+            for name in names:
+                path = '{}/{}'.format(base, name)
+                if os.path.isdir(os.path.join(directory, name)):
+                    if self.match_dir(path):
+                        ignored.add(name)
+                elif self.match(path):
+                    ignored.add(name)
+            return ignored
+        return ignore
+
+
+def _wheel_member_target(zpath):
+    """Map a wheel member to its path relative to the target directory.
+
+    Files in ``.data/purelib`` and ``.data/platlib`` are moved up to the top
+    level; any other ``.data`` files aren't importable, so None is returned.
+    """
+    parts = zpath.split('/')
+    if not parts[0].endswith('.data'):
+        return zpath
+
+    if len(parts) > 2 and parts[1] in ('purelib', 'platlib'):
+        return '/'.join(parts[2:])
+
+    # HACK: Some wheels from Christoph Gohlke's page have extra package
+    # files added in data/Lib/site-packages. This is a trick that relies
+    # on the default installation layout. It doesn't look like it will
+    # change, so in the best tradition of packaging, we'll work around
+    # the workaround.
+    # https://github.com/takluyver/pynsist/issues/171
+    # This is especially ugly because we do a case-insensitive match,
+    # regardless of the filesystem.
+    if len(parts) > 4 and parts[1] == 'data' and parts[2].lower() == 'lib' \
+            and parts[3].lower() == 'site-packages':
+        return '/'.join(parts[4:])
+
+    return None
+
+def _extracted_wheel(whl_file, cache_dir, sha256=None):
+    """Return the cached extracted tree of a wheel, creating it if needed.
+
+    Entries are keyed by wheel filename and content hash, which is only
+    worked out here if ``sha256`` isn't given.
+    """
+    whl_file = Path(whl_file)
+    key = '{}-{}'.format(whl_file.name, (sha256 or file_sha256(whl_file))[:16])
+    return cached_tree(Path(cache_dir) / key, lambda td: _extract_wheel(whl_file, td))
+
+def extract_wheel(whl_file, target_dir, exclude=None, cache_dir=None, sha256=None):
     """Extract importable modules from a wheel to the target directory
+
+    With ``cache_dir``, the wheel is extracted once into a cache shared between
+    builds and the target directory is filled from there with hardlinks,
+    reflinks or copies, and the cache entry is returned. Otherwise it's
+    extracted directly. ``exclude`` is an :class:`ExcludeMatcher` or a list of
+    patterns, relative to the build directory. ``sha256`` is the wheel's hash,
+    if it has already been checked, so it isn't read again to find its entry.
     """
-    # Extract to temporary directory
-    td = Path(mkdtemp())
-    with zipfile.ZipFile(str(whl_file), mode='r') as zf:
+    if exclude and not isinstance(exclude, ExcludeMatcher):
+        exclude = ExcludeMatcher(exclude)
+
+    with measure('extract', os.path.basename(whl_file)):
+        if cache_dir is None:
+            _extract_wheel(whl_file, target_dir, exclude)
+            return None
+
+        ignore = ignore_dir = None
         if exclude:
-            exclude_regexen = make_exclude_regexen(exclude)
-            for zpath in zf.namelist():
-                if is_excluded('pkgs/' + zpath, exclude_regexen):
-                    continue  # Skip excluded paths
-                zf.extract(zpath, path=str(td))
-        else:
-            zf.extractall(str(td))
-
-    # Move extra lib files out of the .data subdirectory
-    for p in td.iterdir():
-        if p.suffix == '.data':
-            if (p / 'purelib').is_dir():
-                merge_dir_to(p / 'purelib', td)
-            if (p / 'platlib').is_dir():
-                merge_dir_to(p / 'platlib', td)
-
-            # HACK: Some wheels from Christoph Gohlke's page have extra package
-            # files added in data/Lib/site-packages. This is a trick that relies
-            # on the default installation layout. It doesn't look like it will
-            # change, so in the best tradition of packaging, we'll work around
-            # the workaround.
-            # https://github.com/takluyver/pynsist/issues/171
-            # This is especially ugly because we do a case-insensitive match,
-            # regardless of the filesystem.
-            if (p / 'data').is_dir():
-                for sd in (p / 'data').iterdir():
-                    if sd.name.lower() == 'lib' and sd.is_dir():
-                        for sd2 in sd.iterdir():
-                            if sd2.name.lower() == 'site-packages' and sd2.is_dir():
-                                merge_dir_to(sd2, td)
-
-    # Copy to target directory
-    target = Path(target_dir)
+            ignore = lambda rel_path: exclude.match('pkgs/' + rel_path)
+            ignore_dir = lambda rel_path: exclude.match_dir('pkgs/' + rel_path)
+        entry = _extracted_wheel(whl_file, cache_dir, sha256)
+        link_tree(entry, target_dir, ignore, ignore_dir)
+        return entry
+
+def _extract_wheel(whl_file, target_dir, exclude=None):
+    """Stream every importable member of a wheel straight to its final
+    location in one pass, with the ``.data`` layouts remapped on the way.
+    """
+    if exclude and not isinstance(exclude, ExcludeMatcher):
+        exclude = ExcludeMatcher(exclude)
+    target = os.path.abspath(target_dir)
     copied_something = False
-    for p in td.iterdir():
-        if p.suffix not in {'.data'}:
-            if p.is_dir():
-                # If the dst directory already exists, this will combine them.
-                # shutil.copytree will not combine them.
-                try:
-                    target.joinpath(p.name).mkdir()
-                except OSError:
-                    if not target.joinpath(p.name).is_dir():
-                        raise
-                merge_dir_to(p, target / p.name)
-            else:
-                shutil.copy2(str(p), str(target))
+    # Whether each directory seen so far is excluded, with everything in it
+    excluded_dirs = {'': False}
+
+    def in_excluded_dir(rel_path):
+        parent = rel_path.rstrip('/').rpartition('/')[0]
+        if parent not in excluded_dirs:
+            excluded_dirs[parent] = in_excluded_dir(parent) or exclude.match_dir('pkgs/' + parent)
+        return excluded_dirs[parent]
+
+    with zipfile.ZipFile(str(whl_file), mode='r') as zf:
+        for info in zf.infolist():
+            rel_path = _wheel_member_target(info.filename)
+            if not rel_path:
+                continue
+            if exclude and (in_excluded_dir(rel_path) or exclude.match('pkgs/' + rel_path)):
+                continue  # Skip excluded paths
+
+            dst = os.path.normpath(os.path.join(target, rel_path))
+            if os.path.commonpath([target, dst]) != target:
+                raise RuntimeError('Wheel {} has a file outside the target directory: {}'.format(whl_file, info.filename))
+
+            if info.is_dir():
+                if os.path.isfile(dst):
+                    raise RuntimeError('Directory {} clashes with file {}'.format(info.filename, dst))
+                os.makedirs(dst, exist_ok=True)
+                continue
+
+            if os.path.isdir(dst):
+                raise RuntimeError('File {} clashes with directory {}'.format(info.filename, dst))
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+            except FileExistsError:
+                raise RuntimeError('Directory for {} clashes with a file in {}'.format(info.filename, target))
+
+            if os.path.lexists(dst):
+                # Never write through a hardlink into the extracted-wheel cache
+                os.remove(dst)
+            with zf.open(info) as src, open(dst, 'wb') as f:
+                shutil.copyfileobj(src, f, 1024 * 1024)
+            count(bytes_written=info.file_size, files=1)
             copied_something = True
 
+    count(bytes_read=os.path.getsize(whl_file))
     if not copied_something:
         raise RuntimeError("Did not find any files to extract from wheel {}".format(whl_file))
-
-    # Clean up temporary directory
-    shutil.rmtree(str(td))
\ No newline at end of file
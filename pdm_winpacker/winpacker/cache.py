@@ -0,0 +1,328 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import get_cache_dir
+
+
+INDEX_FILENAME = 'index.json'
+LOCK_FILENAME = '.lock'
+LOCKS_DIR = '.locks'
+_SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# Files being written by a build, which aren't entries yet
+_PARTIAL = re.compile(r'(\.part|\.tmp)$|\.tmp-')
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+if os.name == 'nt':
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+
+    _LOCKFILE_FAIL_IMMEDIATELY = 0x1
+    _LOCKFILE_EXCLUSIVE_LOCK = 0x2
+
+    class _Overlapped(ctypes.Structure):
+        _fields_ = [
+            ('Internal', ctypes.c_void_p),
+            ('InternalHigh', ctypes.c_void_p),
+            ('Offset', wintypes.DWORD),
+            ('OffsetHigh', wintypes.DWORD),
+            ('hEvent', wintypes.HANDLE),
+        ]
+
+    def _lock_file(f, shared, blocking):
+        flags = (0 if shared else _LOCKFILE_EXCLUSIVE_LOCK) | (0 if blocking else _LOCKFILE_FAIL_IMMEDIATELY)
+        handle = wintypes.HANDLE(msvcrt.get_osfhandle(f.fileno()))
+        if ctypes.windll.kernel32.LockFileEx(handle, flags, 0, 1, 0, ctypes.byref(_Overlapped())):
+            return True
+        if blocking:
+            raise ctypes.WinError()
+        return False
+
+    def _unlock_file(f):
+        handle = wintypes.HANDLE(msvcrt.get_osfhandle(f.fileno()))
+        ctypes.windll.kernel32.UnlockFileEx(handle, 0, 1, 0, ctypes.byref(_Overlapped()))
+else:
+    import fcntl
+
+    def _lock_file(f, shared, blocking):
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock():
+    """A lock on a file, shared with other processes.
+
+    Any number of processes can hold a shared lock at once, but an exclusive
+    lock is only held by one process, while nothing holds a shared lock.
+    Each instance is a separate lock, even within one process.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = str(path)
+        self.shared = shared
+        self._file = None
+
+    def acquire(self, blocking=True):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, 'a+b')
+        try:
+            locked = _lock_file(f, self.shared, blocking)
+        except BaseException:
+            f.close()
+            raise
+        if not locked:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is not None:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def parse_size(value):
+    """Parse a size in bytes, such as ``1048576``, ``500MB`` or ``5 GiB``.
+    Units are powers of 1024.
+    """
+    if isinstance(value, int):
+        return value
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*', str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def _entry_size(path):
+    if not path.is_dir():
+        return path.stat().st_size
+    size = 0
+    for root, dirs, files in os.walk(path):
+        size += sum(os.lstat(os.path.join(root, f)).st_size for f in files)
+    return size
+
+
+class Cache():
+    """The cache of downloads, unpacked Python builds, extracted wheels and
+    index lookups, shared by every build on the machine.
+
+    Files at the top level of the cache and the children of its
+    subdirectories are its entries. An index records their sizes and when
+    each was last used, so the least recently used can be evicted once the
+    cache is larger than its maximum size.
+
+    Builds hold a shared lock on the cache while they run, and take a lock
+    on an entry while they write it, so parallel builds don't download the
+    same file over each other. Evicting entries needs an exclusive lock, so
+    it never removes anything from under a running build.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def _relpath(self, path):
+        try:
+            rel = Path(path).absolute().relative_to(self.root.absolute())
+        except ValueError:
+            return None
+        parts = rel.parts
+        if not parts or parts[0] in (INDEX_FILENAME, LOCK_FILENAME, LOCKS_DIR):
+            return None
+        # An entry is a top level file or a child of a subdirectory
+        return '/'.join(parts[:2]) if len(parts) > 1 or not (self.root / parts[0]).is_dir() else None
+
+    @contextmanager
+    def using(self):
+        """Hold a shared lock on the cache, so entries aren't evicted from it"""
+        with FileLock(self.root / LOCK_FILENAME, shared=True):
+            yield self
+
+    def lock(self, name):
+        """An exclusive lock for writing an entry"""
+        return FileLock(self.root / LOCKS_DIR / f'{name.replace("/", "_")}.lock')
+
+    def record(self, path, changed=False):
+        """Note that an entry was used, or with ``changed`` that it was
+        written, to be saved in the index by :meth:`save`.
+        """
+        relpath = self._relpath(path)
+        if relpath is None:
+            return
+        with self._lock:
+            self._used[relpath] = self._used.get(relpath, (False, 0))[0] or changed, time.time()
+
+    def _load_index(self):
+        try:
+            with open(self.root / INDEX_FILENAME, encoding='utf-8') as f:
+                return json.load(f)['entries']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _save_index(self, entries):
+        tmp_path = self.root / f'{INDEX_FILENAME}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.root / INDEX_FILENAME)
+
+    @contextmanager
+    def _index(self):
+        """Load the index to change it, saving it afterwards"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.root / LOCKS_DIR / f'{INDEX_FILENAME}.lock'):
+            entries = self._load_index()
+            yield entries
+            self._save_index(entries)
+
+    def save(self):
+        """Add the entries used since the last save to the index"""
+        with self._lock:
+            used, self._used = self._used, {}
+        if not used:
+            return
+        with self._index() as entries:
+            for relpath, (changed, accessed) in used.items():
+                path = self.root / relpath
+                if not path.exists():
+                    entries.pop(relpath, None)
+                    continue
+                entry = entries.get(relpath)
+                if entry is None or changed:
+                    entry = entries[relpath] = {'size': _entry_size(path), 'created': accessed}
+                entry['accessed'] = max(accessed, entry.get('accessed', 0))
+
+    def _scan(self):
+        """Return the entries on disk"""
+        found = []
+        if not self.root.is_dir():
+            return found
+        for child in self.root.iterdir():
+            if child.name in (INDEX_FILENAME, LOCK_FILENAME, LOCKS_DIR) or _PARTIAL.search(child.name):
+                continue
+            if child.is_dir():
+                found.extend(f'{child.name}/{grandchild.name}' for grandchild in child.iterdir()
+                             if not _PARTIAL.search(grandchild.name))
+            else:
+                found.append(child.name)
+        return found
+
+    def entries(self):
+        """Bring the index up to date with what's on disk and return it.
+
+        Entries which aren't in the index yet, e.g. from before it existed,
+        count as last used when they were modified.
+        """
+        self.save()
+        with self._index() as entries:
+            on_disk = set(self._scan())
+            for relpath in set(entries) - on_disk:
+                del entries[relpath]
+            for relpath in on_disk - set(entries):
+                path = self.root / relpath
+                mtime = path.stat().st_mtime
+                entries[relpath] = {'size': _entry_size(path), 'created': mtime, 'accessed': mtime}
+            return dict(entries)
+
+    def _remove(self, relpath):
+        path = self.root / relpath
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+    def _remove_partial(self):
+        """Remove what interrupted builds left behind; only safe with the
+        exclusive lock held.
+        """
+        for child in list(self.root.iterdir()):
+            if child.is_dir() and child.name != LOCKS_DIR and not _PARTIAL.search(child.name):
+                partial = [grandchild for grandchild in child.iterdir() if _PARTIAL.search(grandchild.name)]
+            else:
+                partial = [child] if _PARTIAL.search(child.name) else []
+            for path in partial:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink()
+
+    def prune(self, max_size, blocking=True):
+        """Evict the least recently used entries until the cache is no larger
+        than max_size.
+
+        Returns the evicted entries and the bytes freed, or None if it didn't
+        wait for the builds using the cache to finish.
+        """
+        lock = FileLock(self.root / LOCK_FILENAME)
+        if not lock.acquire(blocking):
+            return None
+        try:
+            entries = self.entries()
+            total = sum(entry['size'] for entry in entries.values())
+            evicted = []
+            freed = 0
+            for relpath, entry in sorted(entries.items(), key=lambda item: item[1]['accessed']):
+                if total - freed <= max_size:
+                    break
+                self._remove(relpath)
+                evicted.append(relpath)
+                freed += entry['size']
+            self._remove_partial()
+            with self._index() as index:
+                for relpath in evicted:
+                    index.pop(relpath, None)
+            return evicted, freed
+        finally:
+            lock.release()
+
+    def clear(self):
+        """Remove every entry, returning how many there were and their size"""
+        with FileLock(self.root / LOCK_FILENAME):
+            entries = self.entries()
+            for relpath in entries:
+                self._remove(relpath)
+            self._remove_partial()
+            with self._index() as index:
+                index.clear()
+            return len(entries), sum(entry['size'] for entry in entries.values())
+
+
+def get_cache():
+    """The cache in the directory from :func:`get_cache_dir`"""
+    root = get_cache_dir(ensure_existence=True).absolute()
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = Cache(root)
+        return _caches[root]
+
+
+def format_size(size):
+    for unit in ['bytes', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            return f"{size:.0f} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+        size /= 1024
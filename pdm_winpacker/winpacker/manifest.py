@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import threading
+
+from .utils import file_sha256, normalize_path
+
+
+MANIFEST_FILENAME = '.winpacker-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def fingerprint(*inputs):
+    """Return a stable hash of some JSON-serialisable build inputs"""
+    data = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest():
+    """Record of the inputs each build stage was last run with.
+
+    Each stage is stored with the fingerprint of its inputs, the paths it
+    produced and any extra data it needs to be skipped later. File hashes are
+    cached by size and mtime, so only files which have changed on disk are
+    read again.
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self.path = os.path.join(build_dir, MANIFEST_FILENAME)
+        self.stages = {}
+        self.file_hashes = {}
+        self._lock = threading.RLock()
+
+    def load(self) -> bool:
+        """Load the manifest from the build directory.
+
+        Returns False if there isn't one or it was written by an incompatible
+        version, in which case the build directory can't be trusted.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get('version') != MANIFEST_VERSION:
+            return False
+
+        self.stages = data.get('stages', {})
+        self.file_hashes = data.get('file_hashes', {})
+        return True
+
+    def save(self) -> None:
+        with self._lock:
+            data = {
+                'version': MANIFEST_VERSION,
+                'stages': self.stages,
+                'file_hashes': self.file_hashes,
+            }
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.stages = {}
+
+    def is_fresh(self, stage, fingerprint, moved=()) -> bool:
+        """Whether a stage last ran with the same inputs and its outputs still
+        exist, apart from those in ``moved``, which a later stage has moved
+        somewhere else.
+        """
+        with self._lock:
+            entry = self.stages.get(stage)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+
+        return all(p in moved or os.path.exists(os.path.join(self.build_dir, p)) for p in entry['outputs'])
+
+    def outputs(self, stage):
+        """Paths a stage produced last time it ran"""
+        with self._lock:
+            return list(self.stages.get(stage, {}).get('outputs', []))
+
+    def get(self, stage, key, default=None):
+        """Get extra data recorded for a stage"""
+        with self._lock:
+            return self.stages.get(stage, {}).get('data', {}).get(key, default)
+
+    def record(self, stage, fingerprint, outputs=(), **data) -> None:
+        """Record that a stage has run successfully, and save the manifest"""
+        with self._lock:
+            self.stages[stage] = {
+                'fingerprint': fingerprint,
+                'outputs': list(outputs),
+                'data': data,
+            }
+            self.save()
+
+    def invalidate(self, stage) -> None:
+        with self._lock:
+            self.stages.pop(stage, None)
+
+    def hash_file(self, path) -> str:
+        """Return the SHA-256 of a file, reusing the cached hash if its size and
+        mtime haven't changed.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            cached = self.file_hashes.get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        digest = file_sha256(path)
+        with self._lock:
+            self.file_hashes[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def hash_tree(self, path) -> str:
+        """Return a hash of the names and contents of every file under path"""
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                rel_path = normalize_path(os.path.relpath(file_path, path))
+                entries.append((rel_path, self.hash_file(file_path)))
+
+        return fingerprint(entries)
@@ -1,27 +1,59 @@
 import os
 import shutil
+from pdm.exceptions import PdmUsageError
 from pdm.project import Project
 
+from .cache import parse_size
+from .manifest import BuildManifest
+
 
 DEFAULT_PY_BIT = 64
 DEFAULT_PY_VERSION = '3.10.11'
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Settings which each of win-packer.targets can have
+TARGET_SETTINGS = {"name", "py_version", "py_bit"}
 _PKGDIR = os.path.abspath(os.path.dirname(__file__))
 
 
 class PackedApp():
-    def __init__(self, project: Project):
+    def __init__(self, project: Project, target=None):
+        """``target`` is one of ``win-packer.targets``, whose settings replace
+        the top level ones; each target is built in its own directory.
+        """
+        target = target or {}
         self._config = project.pyproject.settings.setdefault("win-packer", {})
         self.config = self._config
         self._package_dir = os.path.join(project.root, project.pyproject.settings.get("build", {}).get("package-dir", "."))
         self.app_name = self._config.get("app_name", project.pyproject.metadata.get("name"))
         self.app_version = project.pyproject.metadata.get("version", "0.0.0")
-        self.py_version = self._config.get("py_version", DEFAULT_PY_VERSION)
-        self.py_bit = int(self._config.get("py_bit", DEFAULT_PY_BIT))
+        self.target = target.get("name")
+        self.py_version = target.get("py_version", self._config.get("py_version", DEFAULT_PY_VERSION))
+        self.py_bit = int(target.get("py_bit", self._config.get("py_bit", DEFAULT_PY_BIT)))
         self.include_msvcrt = self._config.get("include_msvcrt", True)
+        self.sourceless = self._config.get("sourceless", False)
+        self.zip_packages = self._config.get("zip_packages", False)
+        self.zip_packages_exclude = self._config.get("zip_packages_exclude", [])
+        self.tree_shake = self._config.get("tree_shake", False)
+        self.tree_shake_keep = self._config.get("tree_shake_keep", [])
+        self.compile_bytecode = self._config.get("compile_bytecode", False) or self.sourceless or self.zip_packages
+        self.bytecode_python = self._config.get("bytecode_python", None)
+        self.frozen_bootstrap = self._config.get("frozen_bootstrap", False)
+        self.workers = max(1, int(self._config.get("workers", DEFAULT_WORKERS)))
+        self.resolution_cache_ttl = self._config.get("resolution_cache_ttl", None)
+        # The cache is shared by every project, so it's only pruned after a
+        # build if the project asks for it
+        cache_max_size = self._config.get("cache_max_size", None)
+        self.cache_max_size = parse_size(cache_max_size) if cache_max_size is not None else None
+        self.refresh = False
+        self.offline = False
+        self.delta_from = None
+        self.find_links = self._config.get("find_links", [])
+        self.exclude = self._config.get("exclude", [])
         self.license = self._config.get("license", None)
         self.icon = self._config.get("icon", os.path.join(_PKGDIR, 'glossyorb.ico'))
         self.project = project
-        self.build_dir = self._config.get("build_directory", os.path.join('build', 'winpacker'))
+        self.build_root = self._config.get("build_directory", os.path.join('build', 'winpacker'))
+        self.build_dir = os.path.join(self.build_root, self.target) if self.target else self.build_root
         self.dist_dir = self._config.get("dist_directory", os.path.join('dist',))
 
         self.install_files = []
@@ -29,11 +61,60 @@ class PackedApp():
         self.msvcrt_files = []
         self.extra_files = []
         self.artifacts = []
+        self.manifest = BuildManifest(self.build_dir)
+        self.bundle_fingerprint = None
+        self.duplicates = None
+
+    @classmethod
+    def for_targets(cls, project: Project):
+        """One PackedApp for each of ``win-packer.targets``, or just one for the
+        top level settings if there aren't any.
+
+        Targets are named after their architecture unless they're given a
+        name, which is used for their build directory and artifacts.
+        """
+        config = project.pyproject.settings.get("win-packer", {})
+        targets = config.get("targets", [])
+        if not targets:
+            return [cls(project)]
+
+        named = []
+        for target in targets:
+            unknown = set(target) - TARGET_SETTINGS
+            if unknown:
+                raise PdmUsageError(f"Unknown settings in win-packer.targets: {', '.join(sorted(unknown))}, "
+                                    f"expected: {', '.join(sorted(TARGET_SETTINGS))}")
+            target = dict(target)
+            py_bit = int(target.get("py_bit", config.get("py_bit", DEFAULT_PY_BIT)))
+            target.setdefault("name", 'amd64' if py_bit == 64 else 'win32')
+            if target["name"] in [other["name"] for other in named]:
+                raise PdmUsageError(f"More than one of win-packer.targets is named {target['name']}, "
+                                    "give them each a name")
+            named.append(target)
+        return [cls(project, target) for target in named]
+
+    @property
+    def artifact_name(self):
+        """The name of the artifacts without their extension, e.g. My_App_1.0"""
+        s = f"{self.app_name}_{self.app_version}"
+        if self.target:
+            s += f"_{self.target}"
+        return s.replace(' ', '_')
 
     def clean_build_directry(self) -> None:
         if os.path.exists(self.build_dir):
             shutil.rmtree(self.build_dir)
         os.makedirs(self.build_dir)
+        self.manifest.clear()
 
         if not os.path.exists(self.dist_dir):
             os.makedirs(self.dist_dir)
+
+    def prepare_build_directory(self) -> None:
+        """Reuse the build directory from a previous build if it has a manifest,
+        otherwise start from a clean one.
+        """
+        if not self.manifest.load():
+            self.clean_build_directry()
+        elif not os.path.exists(self.dist_dir):
+            os.makedirs(self.dist_dir)
@@ -1,4 +1,7 @@
+from . base import Packer
 from . nsispacker import NSISPacker
 from . zippacker import ZipPacker
+from . deltapacker import DeltaPacker
+from . packing import DEFAULT_FORMATS, PACKERS, PackResult, pack, parse_formats
 
-__ALL__ = ['NSISPacker', 'ZipPacker']
\ No newline at end of file
+__ALL__ = ['Packer', 'NSISPacker', 'ZipPacker', 'DeltaPacker', 'PACKERS', 'PackResult', 'pack', 'parse_formats']
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+
+
+class Packer():
+    """Turns the bundle in the build directory into something to distribute.
+
+    Packers only read the build directory, so several can run at once. While
+    they do, ``progress`` is the display they share.
+    """
+
+    name = None
+
+    def __init__(self, packed_app) -> None:
+        self.packed_app = packed_app
+        self.project = packed_app.project
+        self.progress = None
+
+    @contextmanager
+    def _spinner(self, title):
+        """Show the progress of the packer"""
+        if self.progress is None:
+            with self.project.core.ui.open_spinner(title) as spin:
+                yield spin
+        else:
+            self.progress.update(title)
+            yield self.progress
+
+    @property
+    def outputs(self):
+        """The paths of the files the packer writes"""
+        return []
+
+    def pack(self) -> str:
+        """Build the artifact and return its path"""
+        raise NotImplementedError
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+from pdm import termui
+from pdm.exceptions import PdmUsageError
+
+from ..cache import format_size
+from ..manifest import fingerprint
+from ..profile import count, note
+from ..utils import file_sha256
+from .zippacker import ZipPacker
+
+
+DELTA_MANIFEST = 'winpacker-delta.json'
+DELTA_VERSION = 1
+
+
+def _zip_hashes(path):
+    """The SHA-256 of each file in a zip package"""
+    hashes = {}
+    with ZipFile(path) as zf:
+        if DELTA_MANIFEST in zf.namelist():
+            raise PdmUsageError(f"{path} is a delta package, deltas need a full zip package or a files manifest")
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            h = hashlib.sha256()
+            with zf.open(info) as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            hashes[info.filename] = h.hexdigest()
+            count(bytes_read=info.file_size)
+    return hashes
+
+
+def read_file_hashes(path):
+    """Read the SHA-256 of each file in a previous build, from the files
+    manifest written with its delta package or from its zip package.
+    """
+    if not os.path.isfile(path):
+        raise PdmUsageError(f"{path} doesn't exist, expected the zip package or files manifest of a previous build")
+    if zipfile.is_zipfile(path):
+        return _zip_hashes(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['files']
+    except (ValueError, KeyError) as e:
+        raise PdmUsageError(f"{path} isn't a zip package or files manifest") from e
+
+
+class DeltaPacker(ZipPacker):
+    """Packs the files which have been added or changed since a previous
+    build, with a list of the files to delete, into a zip to unpack over the
+    installed application.
+
+    Paths are those of the zip package, relative to the install directory.
+    A files manifest of the build is written next to it, for the delta of
+    the next release.
+    """
+
+    name = 'delta'
+
+    @property
+    def zip_name(self):
+        return f"{self.packed_app.artifact_name}_delta.zip"
+
+    @property
+    def files_manifest_name(self):
+        return f"{self.packed_app.artifact_name}.files.json"
+
+    @property
+    def outputs(self):
+        return [os.path.abspath(os.path.join(self.packed_app.dist_dir, name))
+                for name in [self.zip_name, self.files_manifest_name]]
+
+    def check_previous(self, packers):
+        """Refuse a previous build which is one of the files this build is
+        about to write, as the delta would be read from it while it's
+        rewritten, and be made against this build the next time.
+        """
+        previous_path = os.path.realpath(self.packed_app.delta_from)
+        for packer in packers + [self]:
+            if any(os.path.realpath(output) == previous_path for output in packer.outputs):
+                raise PdmUsageError(f"{self.packed_app.delta_from} is written by this build's {packer.name} packer, "
+                                    "copy the previous build's package somewhere else to make a delta from it")
+
+    def _file_hashes(self):
+        files = list(self._iter_files())
+        with ThreadPoolExecutor(max_workers=self.packed_app.workers) as executor:
+            hashes = list(executor.map(file_sha256, [path for path, file in files]))
+        count(files=len(files), bytes_read=sum(os.path.getsize(path) for path, file in files))
+        return {file: sha256 for (path, file), sha256 in zip(files, hashes)}
+
+    def pack(self):
+        """Build the delta package from ``packed_app.delta_from``, the zip
+        package or files manifest of the previous build.
+        """
+        previous_path = self.packed_app.delta_from
+        output, files_output = self.outputs
+        manifest = self.packed_app.manifest
+
+        stage_fingerprint = fingerprint(self.packed_app.bundle_fingerprint, self._config, output,
+                                        previous_path, file_sha256(previous_path) if os.path.isfile(previous_path) else None)
+        if manifest.is_fresh('delta', stage_fingerprint) and os.path.isfile(files_output):
+            self.project.core.ui.echo(f"Delta package is up to date: {output}")
+            note(reused=True)
+            return output
+        manifest.invalidate('delta')
+
+        with self._spinner("Creating delta package..."):
+            previous = read_file_hashes(previous_path)
+            current = self._file_hashes()
+
+            added = sorted(set(current) - set(previous))
+            changed = sorted(file for file in set(current) & set(previous) if current[file] != previous[file])
+            deleted = sorted(set(previous) - set(current))
+
+            if os.path.exists(output):
+                os.remove(output)
+            build_dir = os.path.abspath(self.packed_app.build_dir)
+            with ZipFile(output, "w") as zf:
+                for file in added + changed:
+                    zf.write(os.path.join(build_dir, *file.split('/')), file,
+                             compress_type=self._compress_type(file), compresslevel=self.compresslevel)
+                zf.writestr(DELTA_MANIFEST, json.dumps({
+                    'version': DELTA_VERSION,
+                    'app_name': self.packed_app.app_name,
+                    'app_version': self.packed_app.app_version,
+                    'from': os.path.basename(previous_path),
+                    'added': added,
+                    'changed': changed,
+                    'deleted': deleted,
+                }, indent=1), compress_type=zipfile.ZIP_DEFLATED)
+
+            tmp_path = files_output + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': DELTA_VERSION,
+                    'app_name': self.packed_app.app_name,
+                    'app_version': self.packed_app.app_version,
+                    'files': current,
+                }, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, files_output)
+
+        count(bytes_written=os.path.getsize(output))
+        note(added=len(added), changed=len(changed), deleted=len(deleted))
+        manifest.record('delta', stage_fingerprint, outputs=[output])
+        self.project.core.ui.echo(
+            f"[success]{termui.Emoji.SUCC}[/] Delta package built: {output} ({format_size(os.path.getsize(output))}), "
+            f"{len(added)} added, {len(changed)} changed and {len(deleted)} deleted files since {os.path.basename(previous_path)}",
+            style="success")
+        return output
@@ -0,0 +1,85 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from ..profile import count, measure
+from ..utils import file_sha256
+
+
+class Duplicates():
+    """Groups of files in the build directory with the same content.
+
+    Each group is ``(size, paths)``, with the paths relative to the build
+    directory, separated by "/" and sorted; the first is the one to keep
+    when the others can be stored as references to it.
+    """
+
+    def __init__(self, groups=()):
+        self.groups = [(size, list(paths)) for size, paths in groups]
+
+    @property
+    def files(self):
+        """The number of files which are a copy of another one"""
+        return sum(len(paths) - 1 for size, paths in self.groups)
+
+    @property
+    def saving(self):
+        """The bytes which storing each content once would save"""
+        return sum(size * (len(paths) - 1) for size, paths in self.groups)
+
+    def originals(self):
+        """Map each file in a group to the first file of the group"""
+        return {path: paths[0] for size, paths in self.groups for path in paths}
+
+
+def _iter_files(directory, excluded, prefix=''):
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not prefix and entry.name in excluded:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path, excluded, prefix + entry.name + '/')
+            elif entry.is_file():
+                yield entry, prefix + entry.name
+
+
+def find_duplicates(packed_app, excluded=()):
+    """Find the files in the build directory which have the same content.
+
+    Only files of the same size are hashed, and files hardlinked to each
+    other, e.g. from the cache, are hashed once. The groups are kept in the
+    build manifest until the bundle changes. ``excluded`` are names at the
+    top of the build directory which aren't part of the application.
+    """
+    manifest = packed_app.manifest
+    bundle_fingerprint = packed_app.bundle_fingerprint
+    if bundle_fingerprint is not None and manifest.is_fresh('duplicates', bundle_fingerprint):
+        return Duplicates(manifest.get('duplicates', 'groups', []))
+
+    with measure('scan', 'duplicates'):
+        by_size = defaultdict(list)
+        for entry, relpath in _iter_files(os.path.abspath(packed_app.build_dir), excluded):
+            st = entry.stat()
+            if st.st_size:
+                by_size[st.st_size].append((relpath, entry.path, (st.st_dev, st.st_ino)))
+
+        # Hardlinks of one file have the same content, so each inode is hashed once
+        inodes = {}
+        for files in by_size.values():
+            if len(files) > 1:
+                for relpath, path, inode in files:
+                    inodes.setdefault(inode, path)
+        with ThreadPoolExecutor(max_workers=packed_app.workers) as executor:
+            digests = dict(zip(inodes, executor.map(file_sha256, inodes.values())))
+        count(files=len(inodes), bytes_read=sum(os.path.getsize(path) for path in inodes.values()))
+
+        by_content = defaultdict(list)
+        for size, files in by_size.items():
+            if len(files) > 1:
+                for relpath, path, inode in files:
+                    by_content[size, digests[inode]].append(relpath)
+        groups = sorted((size, sorted(paths)) for (size, digest), paths in by_content.items() if len(paths) > 1)
+
+    if bundle_fingerprint is not None:
+        manifest.record('duplicates', bundle_fingerprint, groups=groups)
+    return Duplicates(groups)
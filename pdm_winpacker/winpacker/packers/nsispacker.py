@@ -1,22 +1,25 @@
 import os
-import winreg
 import operator
 import subprocess
 import jinja2
 import ntpath
 import itertools
-import shutil
 from operator import itemgetter
 from pdm import termui
 from pdm.exceptions import NoPythonVersion, PdmUsageError, ProjectError
 
+from ..manifest import fingerprint
+from ..profile import count, note
+from .base import Packer
+
 _PKGDIR = os.path.abspath(os.path.dirname(__file__))
 
 
-class NSISPacker():
+class NSISPacker(Packer):
+    name = 'nsis'
+
     def __init__(self, packed_app) -> None:
-        self.packed_app = packed_app
-        self.project = packed_app.project
+        super().__init__(packed_app)
         self._config = self.packed_app.config
 
         # Sort by destination directory, so we can group them effectively
@@ -32,6 +35,8 @@ class NSISPacker():
     @property
     def _makensis_win(self):
         """Locate makensis.exe on Windows by querying the registry"""
+        # Only on Windows, the rest of the packer works anywhere
+        import winreg
         try:
             nsis_install_dir = winreg.QueryValue(winreg.HKEY_LOCAL_MACHINE, 'SOFTWARE\\NSIS')
         except OSError:
@@ -53,8 +58,11 @@ class NSISPacker():
 
         e.g. My_App_1.0.exe
         """
-        s = f"{self.packed_app.app_name}_{self.packed_app.app_version}.exe"
-        return s.replace(' ', '_')
+        return f"{self.packed_app.artifact_name}.exe"
+
+    @property
+    def outputs(self):
+        return [os.path.abspath(os.path.join(self.packed_app.dist_dir, self.installer_name))]
 
     def _write_nsi(self):
         """Write the NSI file to define the NSIS installer.
@@ -91,7 +99,7 @@ class NSISPacker():
         if self.packed_app.license:
             license_file = os.path.basename(self.packed_app.license)
 
-        # Copy icons to build directory
+        # Shortcut icons are copied to the build directory by the bundler
         config_shortcuts = self._config.get("shortcuts", {})
         shortcuts = {}
         for key in config_shortcuts.keys():
@@ -100,12 +108,9 @@ class NSISPacker():
                 #TODO: Should be a warning skip this shortcut?
                 raise ProjectError(f"Shortcut '{key}' must have a target")
 
-            shortcuts[key] = sc
+            shortcuts[key] = dict(sc)
 
             if "icon" in shortcuts[key]:
-                if not os.path.exists(os.path.join(self.packed_app.build_dir, os.path.basename(shortcuts[key]["icon"]))):
-                    shutil.copy2(shortcuts[key]["icon"], self.packed_app.build_dir)
-
                 shortcuts[key]["icon"] = os.path.basename(shortcuts[key]["icon"])
             else:
                 shortcuts[key]["icon"] = os.path.basename(self.packed_app.icon)
@@ -134,17 +139,39 @@ class NSISPacker():
             'msvcrt_files': self.packed_app.msvcrt_files,
         }
 
+        nsi = template.render(namespace)
         with open(self.nsi_file, 'w') as f:
-            f.write(template.render(namespace))
+            f.write(nsi)
 
-    def pack(self):
-        """Build the installer using NSIS"""
-        with self.project.core.ui.open_spinner("Compiling NSIS installer..."):
-            self._write_nsi()
+        return nsi
 
-            output = os.path.abspath(os.path.join(self.packed_app.dist_dir, self.installer_name))
-            subprocess.call([self._makensis_win, f"/XOutFile {output}", self.nsi_file], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    def pack(self):
+        """Build the installer using NSIS
 
+        makensis is skipped if neither the bundle nor the installer script have
+        changed since the installer was last built.
+        """
+        output = self.outputs[0]
+        manifest = self.packed_app.manifest
+
+        with self._spinner("Compiling NSIS installer..."):
+            nsi = self._write_nsi()
+
+            stage_fingerprint = fingerprint(self.packed_app.bundle_fingerprint, nsi, output)
+            if manifest.is_fresh('nsis', stage_fingerprint):
+                self.project.core.ui.echo(f"NSIS Installer is up to date: {output}")
+                note(reused=True)
+                return output
+
+            manifest.invalidate('nsis')
+            result = subprocess.run([self._makensis_win, f"/XOutFile {output}", self.nsi_file],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+            if result.returncode != 0:
+                # makensis reports the problem at the end of its output
+                details = '\n'.join(result.stdout.strip().splitlines()[-10:])
+                raise ProjectError(f"makensis failed with exit code {result.returncode}:\n{details}")
+
+        count(bytes_written=os.path.getsize(output))
+        manifest.record('nsis', stage_fingerprint, outputs=[output])
         self.project.core.ui.echo(f"[success]{termui.Emoji.SUCC}[/] NSIS Installer built: {output}", style="success")
-        self.packed_app.artifacts.append(output)
         return output
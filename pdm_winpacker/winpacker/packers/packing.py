@@ -0,0 +1,107 @@
+import time
+from typing import List
+
+from pdm import termui
+from pdm.exceptions import PdmUsageError, ProjectError
+
+from ..bundler.stages import Stage, StageGraph, StageProgress
+from ..cache import format_size
+from .deltapacker import DeltaPacker
+from .duplicates import find_duplicates
+from .nsispacker import NSISPacker
+from .zippacker import EXCLUDED_FILES, ZipPacker
+
+
+PACKERS = {packer.name: packer for packer in [NSISPacker, ZipPacker]}
+DEFAULT_FORMATS = ','.join(PACKERS)
+
+
+class PackResult():
+    """The outcome of running one packer"""
+
+    def __init__(self, name, artifact=None, duration=0.0, error=None):
+        self.name = name
+        self.artifact = artifact
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def parse_formats(value) -> List[str]:
+    """Parse a comma separated list of packer names, e.g. ``nsis,zip``"""
+    formats = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in PACKERS:
+            raise PdmUsageError(f"Unknown format '{name}', expected one of: {', '.join(PACKERS)}")
+        if name not in formats:
+            formats.append(name)
+
+    if not formats:
+        raise PdmUsageError("No formats to pack")
+    return formats
+
+
+def pack(packed_app, formats) -> List[PackResult]:
+    """Run the packers for each format concurrently.
+
+    The build directory is first searched for duplicate files, which the
+    packers store once where their format allows it. With
+    ``packed_app.delta_from``, a delta package is made as well, unless
+    delta_from is one of the files the packers are about to write.
+
+    Every packer is run to the end even if another one fails. The artifacts
+    which were built are added to ``packed_app.artifacts`` in the order of
+    ``formats``, then the result of each packer is reported, and a
+    ProjectError is raised if any of them failed.
+    """
+    ui = packed_app.project.core.ui
+    formats = list(formats)
+    packers = [PACKERS[name](packed_app) for name in formats]
+    if packed_app.delta_from:
+        delta_packer = DeltaPacker(packed_app)
+        delta_packer.check_previous(packers)
+        formats.append(DeltaPacker.name)
+        packers.append(delta_packer)
+    results = {}
+
+    with ui.open_spinner("Finding duplicate files..."):
+        packed_app.duplicates = find_duplicates(packed_app, EXCLUDED_FILES)
+    if packed_app.duplicates.files:
+        ui.echo(f"Found {packed_app.duplicates.files} duplicate files in the bundle, "
+                f"{format_size(packed_app.duplicates.saving)} could be saved by storing them once")
+
+    def run(packer):
+        start = time.perf_counter()
+        try:
+            artifact = packer.pack()
+        except Exception as e:
+            results[packer.name] = PackResult(packer.name, duration=time.perf_counter() - start, error=e)
+        else:
+            results[packer.name] = PackResult(packer.name, artifact, time.perf_counter() - start)
+
+    stages = [Stage(packer.name, lambda packer=packer: run(packer)) for packer in packers]
+    with ui.open_spinner("Packing...") as spin:
+        progress = StageProgress(spin, len(stages), title="Packing")
+        for packer in packers:
+            packer.progress = progress
+        StageGraph(stages, kind='packer').run(progress=progress)
+
+    results = [results[name] for name in formats]
+    for result in results:
+        if result.ok:
+            packed_app.artifacts.append(result.artifact)
+            ui.echo(f"  {result.name}: {result.artifact} ({result.duration:.1f}s)")
+        else:
+            ui.echo(f"[error]{termui.Emoji.FAIL}[/] {result.name} failed after {result.duration:.1f}s: {result.error}",
+                    err=True, style="error")
+
+    failed = [result.name for result in results if not result.ok]
+    if failed:
+        raise ProjectError(f"Packing failed: {', '.join(failed)}")
+    return results
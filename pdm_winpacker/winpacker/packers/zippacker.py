@@ -1,12 +1,73 @@
 import os
-from zipfile import ZipFile
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pdm import termui
+from pdm.exceptions import ProjectError
+
+from ..manifest import MANIFEST_FILENAME, fingerprint
+from ..profile import count, note
+from .base import Packer
+from .duplicates import find_duplicates
+from .zipwriter import ZipWriter, compress
+
+
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+DEFAULT_COMPRESSION = 'deflate'
+# Files which are already compressed aren't worth compressing again
+DEFAULT_METHODS = {suffix: 'stored' for suffix in ['.pyd', '.zip', '.whl', '.gz', '.bz2', '.xz', '.png', '.jpg', '.jpeg']}
+# Files in the build directory which aren't part of the application
+EXCLUDED_FILES = ["_system_path.py", "installer.nsi", MANIFEST_FILENAME, MANIFEST_FILENAME + '.tmp']
+# Files bigger than this are streamed into the archive rather than read into memory
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+
+def _compress(path, compress_type, compresslevel):
+    """Read and compress one file, returning its CRC, size, compression
+    method and compressed data.
+
+    Runs on a worker thread; zlib, bz2 and lzma release the GIL while they
+    compress. Large files are left for the writer to stream, and files which
+    don't get any smaller are stored.
+    """
+    if os.path.getsize(path) > LARGE_FILE_SIZE:
+        return None
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    crc, file_size = zlib.crc32(data), len(data)
+    if compress_type != zipfile.ZIP_STORED:
+        compressed = compress(data, compress_type, compresslevel)
+        if len(compressed) < len(data):
+            return crc, file_size, compress_type, compressed
+    return crc, file_size, zipfile.ZIP_STORED, data
+
+
+class ZipPacker(Packer):
+    name = 'zip'
 
-class ZipPacker:
     def __init__(self, packed_app) -> None:
-        self.packed_app = packed_app
-        self.project = packed_app.project
-        self.file_paths = []
+        super().__init__(packed_app)
+        self._config = self.packed_app.config.get("zip", {})
+
+        self.compression = self._method(self._config.get("compression", DEFAULT_COMPRESSION))
+        self.compresslevel = self._config.get("compresslevel", None)
+        self.methods = {suffix.lower(): self._method(method) for suffix, method in DEFAULT_METHODS.items()}
+        self.methods.update((suffix.lower(), self._method(method)) for suffix, method in self._config.get("methods", {}).items())
+
+    @staticmethod
+    def _method(name):
+        try:
+            return COMPRESSION_METHODS[name]
+        except KeyError:
+            raise ProjectError(f"Unknown zip compression method '{name}', expected one of: {', '.join(COMPRESSION_METHODS)}")
 
     @property
     def zip_name(self):
@@ -14,36 +75,113 @@ class ZipPacker:
 
         e.g. My_App_1.0.exe
         """
-        s = f"{self.packed_app.app_name}_{self.packed_app.app_version}.zip"
-        return s.replace(' ', '_')
+        return f"{self.packed_app.artifact_name}.zip"
+
+    @property
+    def outputs(self):
+        return [os.path.abspath(os.path.join(self.packed_app.dist_dir, self.zip_name))]
+
+    def _iter_files(self, directory=None, prefix=''):
+        """Yield ``(path, arcname)`` for every file in the build directory.
+
+        The tree is walked with os.scandir in sorted order, so the archive is
+        the same from one build to the next, and without changing the working
+        directory, so other work can carry on in the same process.
+        """
+        if directory is None:
+            directory = os.path.abspath(self.packed_app.build_dir)
 
-    def _get_all_file_paths(self):
-        cwd = os.getcwd()
-        os.chdir(self.packed_app.build_dir)
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
 
-        for root, directories, files in os.walk("."):
-            for filename in files:
-                if not filename in ["_system_path.py", "installer.nsi"]:
-                    filepath = os.path.join(root, filename)
-                    self.file_paths.append(filepath)
+        for entry in entries:
+            if not prefix and entry.name in EXCLUDED_FILES:
+                continue
+            arcname = prefix + entry.name
+            if entry.is_dir():
+                yield from self._iter_files(entry.path, arcname + '/')
+            else:
+                yield entry.path, arcname
 
-        os.chdir(cwd)
+    def _compress_type(self, filename):
+        """The compression method for a file, chosen by its suffix"""
+        return self.methods.get(os.path.splitext(filename)[1].lower(), self.compression)
 
     def pack(self):
-        with self.project.core.ui.open_spinner("Creating zip package..."):
-            self._get_all_file_paths()
-            output = os.path.abspath(os.path.join(self.packed_app.dist_dir, self.zip_name))
+        """Build the zip package.
+
+        Files are compressed in parallel on ``win-packer.workers`` threads and
+        written to the archive in order. Only a bounded number of compressed
+        files are held in memory at once.
+
+        Each zip member has its own copy of its data, but duplicate files are
+        only compressed once, and the compressed data is written for each of
+        them.
+        """
+        output = self.outputs[0]
+        manifest = self.packed_app.manifest
+
+        stage_fingerprint = fingerprint(self.packed_app.bundle_fingerprint, self._config, output)
+        if manifest.is_fresh('zip', stage_fingerprint):
+            self.project.core.ui.echo(f"Zip package is up to date: {output}")
+            note(reused=True)
+            return output
+        manifest.invalidate('zip')
+
+        duplicates = self.packed_app.duplicates
+        if duplicates is None:
+            duplicates = find_duplicates(self.packed_app, EXCLUDED_FILES)
+        originals = duplicates.originals()
+        # How many files of each group are still to be written, so the
+        # compressed data isn't kept after the last one
+        left = {paths[0]: len(paths) for size, paths in duplicates.groups}
+        compressed = {}
+
+        workers = self.packed_app.workers
+        with self._spinner("Creating zip package..."):
             if os.path.exists(output):
                 os.remove(output)
 
-            cwd = os.getcwd()
-            os.chdir(self.packed_app.build_dir)
-            with ZipFile(output,"w") as zip:
-                for file in self.file_paths:
-                    zip.write(file)
-            os.chdir(cwd)
+            with ZipWriter(output) as writer, ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+
+                def write_next():
+                    file, path, compress_type, future, original = pending.popleft()
+                    result = future.result()
+                    if result is None:
+                        writer.add_file(path, file, compress_type, self.compresslevel)
+                    else:
+                        # The data may have been compressed for a file with the same content
+                        crc, file_size, method, data = result
+                        writer.add(path, file, data, crc, file_size, method)
+
+                    if original is not None:
+                        left[original] -= 1
+                        if not left[original]:
+                            compressed.pop(original, None)
 
+                reused = 0
+                for path, file in self._iter_files():
+                    count(files=1)
+                    compress_type = self._compress_type(file)
+                    original = originals.get(file)
+                    if original in compressed and compressed[original][0] == compress_type:
+                        future = compressed[original][1]
+                        reused += 1
+                    else:
+                        count(bytes_read=os.path.getsize(path))
+                        future = executor.submit(_compress, path, compress_type, self.compresslevel)
+                        if original is not None and original not in compressed:
+                            compressed[original] = compress_type, future
+                    pending.append((file, path, compress_type, future, original))
+                    if len(pending) >= workers * 4:
+                        write_next()
+
+                while pending:
+                    write_next()
+
+        count(bytes_written=os.path.getsize(output))
+        note(duplicates_compressed_once=reused)
+        manifest.record('zip', stage_fingerprint, outputs=[output])
         self.project.core.ui.echo(f"[success]{termui.Emoji.SUCC}[/] Zip package built: {output}", style="success")
-        self.packed_app.artifacts.append(output)
         return output
-
@@ -0,0 +1,226 @@
+import os
+import bz2
+import sys
+import lzma
+import stat
+import time
+import zlib
+import struct
+import zipfile
+
+
+# Sizes and offsets above these need the zip64 extensions
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_LOCAL_HEADER = struct.Struct('<4s3H2H3L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4H2H3L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+_END_LOCATOR64 = struct.Struct('<4sLQL')
+_ZIP64_EXTRA = 0x0001
+_FLAG_LZMA_EOS = 0x02
+_FLAG_UTF8 = 0x800
+_CREATE_SYSTEM = 0 if sys.platform == 'win32' else 3
+_VERSION_NEEDED = {
+    zipfile.ZIP_STORED: 20,
+    zipfile.ZIP_DEFLATED: 20,
+    zipfile.ZIP_BZIP2: 46,
+    zipfile.ZIP_LZMA: 63,
+}
+_VERSION_ZIP64 = 45
+# The LZMA1 filter, and its properties as the zip format stores them: the
+# lc, lp and pb byte followed by the dictionary size
+_LZMA_FILTER = {'id': lzma.FILTER_LZMA1, 'dict_size': 1 << 23, 'lc': 3, 'lp': 0, 'pb': 2}
+_LZMA_PROPERTIES = struct.pack('<BL', (2 * 5 + 0) * 9 + 3, 1 << 23)
+
+
+class _LZMACompressor():
+    """Writes the LZMA header zip needs before the raw LZMA1 stream"""
+
+    def __init__(self):
+        self._compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[_LZMA_FILTER])
+        self._header = struct.pack('<BBH', 9, 4, len(_LZMA_PROPERTIES)) + _LZMA_PROPERTIES
+
+    def compress(self, data):
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+
+class _StoredCompressor():
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def get_compressor(compress_type, compresslevel=None):
+    """Make a compressor for a zip compression method"""
+    if compress_type == zipfile.ZIP_STORED:
+        return _StoredCompressor()
+    if compress_type == zipfile.ZIP_DEFLATED:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel,
+                                zlib.DEFLATED, -15)
+    if compress_type == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Compressor(9 if compresslevel is None else compresslevel)
+    if compress_type == zipfile.ZIP_LZMA:
+        return _LZMACompressor()
+    raise ValueError(f"Unsupported zip compression method {compress_type}")
+
+
+def compress(data, compress_type, compresslevel=None):
+    compressor = get_compressor(compress_type, compresslevel)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _dos_date_time(mtime):
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+class _Member():
+    def __init__(self, arcname, st, compress_type):
+        self.name = arcname.encode('utf-8')
+        self.flags = 0 if arcname.isascii() else _FLAG_UTF8
+        if compress_type == zipfile.ZIP_LZMA:
+            # The compressed data ends with an end-of-stream marker
+            self.flags |= _FLAG_LZMA_EOS
+        self.compress_type = compress_type
+        self.date, self.time = _dos_date_time(st.st_mtime)
+        self.external_attr = (stat.S_IMODE(st.st_mode) | stat.S_IFREG) << 16
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.header_offset = 0
+        self.zip64 = False
+
+    @property
+    def version_needed(self):
+        return max(_VERSION_NEEDED[self.compress_type], _VERSION_ZIP64 if self.zip64 else 0)
+
+    def local_header(self):
+        if self.zip64:
+            extra = struct.pack('<2H2Q', _ZIP64_EXTRA, 16, self.file_size, self.compress_size)
+            file_size = compress_size = 0xFFFFFFFF
+        else:
+            extra = b''
+            file_size, compress_size = self.file_size, self.compress_size
+        return _LOCAL_HEADER.pack(
+            b'PK\x03\x04', self.version_needed, self.flags, self.compress_type, self.time, self.date,
+            self.crc, compress_size, file_size, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def central_header(self):
+        fields = []
+        file_size, compress_size, header_offset = self.file_size, self.compress_size, self.header_offset
+        if file_size > ZIP64_LIMIT:
+            fields.append(file_size)
+            file_size = 0xFFFFFFFF
+        if compress_size > ZIP64_LIMIT:
+            fields.append(compress_size)
+            compress_size = 0xFFFFFFFF
+        if header_offset > ZIP64_LIMIT:
+            fields.append(header_offset)
+            header_offset = 0xFFFFFFFF
+        extra = struct.pack(f'<2H{len(fields)}Q', _ZIP64_EXTRA, 8 * len(fields), *fields) if fields else b''
+        version_needed = max(self.version_needed, _VERSION_ZIP64 if fields else 0)
+        return _CENTRAL_HEADER.pack(
+            b'PK\x01\x02', _CREATE_SYSTEM << 8 | version_needed, version_needed, self.flags, self.compress_type,
+            self.time, self.date, self.crc, compress_size, file_size, len(self.name), len(extra), 0, 0, 0,
+            self.external_attr, header_offset,
+        ) + self.name + extra
+
+
+class ZipWriter():
+    """Writes a zip file whose members may have been compressed beforehand,
+    e.g. on other threads, or once for several members with the same content.
+
+    zipfile can only compress members as it writes them, so this writes the
+    headers itself, with the zip64 extensions where they're needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._members = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def add(self, path, arcname, data, crc, file_size, compress_type):
+        """Add a member with data already compressed with compress_type.
+        The file at path is where its modification time and mode come from.
+        """
+        member = _Member(arcname, os.stat(path), compress_type)
+        member.crc = crc
+        member.file_size = file_size
+        member.compress_size = len(data)
+        member.zip64 = file_size > ZIP64_LIMIT or len(data) > ZIP64_LIMIT
+        member.header_offset = self._file.tell()
+        self._file.write(member.local_header())
+        self._file.write(data)
+        self._members.append(member)
+
+    def add_file(self, path, arcname, compress_type, compresslevel=None):
+        """Add a file, compressing it as it's read, so it's never all in
+        memory at once.
+        """
+        st = os.stat(path)
+        member = _Member(arcname, st, compress_type)
+        # Compressed data can be a little bigger than the file
+        member.zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+        member.header_offset = self._file.tell()
+        self._file.write(member.local_header())
+
+        compressor = get_compressor(compress_type, compresslevel)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                member.crc = zlib.crc32(chunk, member.crc)
+                member.file_size += len(chunk)
+                data = compressor.compress(chunk)
+                member.compress_size += len(data)
+                self._file.write(data)
+        data = compressor.flush()
+        member.compress_size += len(data)
+        self._file.write(data)
+
+        if not member.zip64 and (member.file_size > ZIP64_LIMIT or member.compress_size > ZIP64_LIMIT):
+            raise RuntimeError(f"{path} grew while it was added to the zip file")
+        # Now the sizes and CRC are known, write the header again
+        end = self._file.tell()
+        self._file.seek(member.header_offset)
+        self._file.write(member.local_header())
+        self._file.seek(end)
+        self._members.append(member)
+
+    def close(self):
+        """Write the central directory and close the file"""
+        start = self._file.tell()
+        for member in self._members:
+            self._file.write(member.central_header())
+        end = self._file.tell()
+
+        count, size, offset = len(self._members), end - start, start
+        if count > ZIP_FILECOUNT_LIMIT or size > ZIP64_LIMIT or offset > ZIP64_LIMIT:
+            self._file.write(_END_RECORD64.pack(
+                b'PK\x06\x06', _END_RECORD64.size - 12, _CREATE_SYSTEM << 8 | _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, count, count, size, offset,
+            ))
+            self._file.write(_END_LOCATOR64.pack(b'PK\x06\x07', 0, end, 1))
+            count, size, offset = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+        self._file.write(_END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, size, offset, 0))
+        self._file.close()
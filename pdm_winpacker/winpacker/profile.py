@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+
+PROFILE_FILENAME = 'winpacker-profile.json'
+CPROFILE_FILENAME = 'winpacker.prof'
+PROFILE_VERSION = 1
+COUNTERS = ('bytes_read', 'bytes_written', 'files', 'cache_hits', 'cache_misses')
+
+_active = None
+_local = threading.local()
+
+
+class ProfileEntry():
+    """Measurements of one target, stage, packer or operation such as a download"""
+
+    def __init__(self, kind, name, parent=None):
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.thread = threading.get_ident()
+        self.start = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.notes = {}
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def to_dict(self):
+        data = {
+            'kind': self.kind,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+        }
+        data.update(self.counters)
+        data.update(self.notes)
+        return data
+
+
+class BuildProfile():
+    """Wall time, CPU time, I/O and cache use of each part of a build.
+
+    While a profile is active, :func:`measure` records an entry for each
+    block it wraps, and :func:`count` adds to the innermost entry on the
+    current thread. When an entry finishes, its counters are added to the
+    entry it ran inside, and so is its CPU time if it ran on another thread,
+    so a stage's totals include the work it handed to a thread pool.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        global _active
+        _active = self
+        try:
+            yield self
+        finally:
+            _active = None
+            self.wall = time.perf_counter() - self._start
+            self.cpu = time.process_time() - self._start_cpu
+
+    def _finish(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+        if entry.parent is not None:
+            entry.parent.add(**entry.counters)
+            if entry.parent.thread != entry.thread:
+                with entry.parent._lock:
+                    entry.parent.cpu += entry.cpu
+
+    def totals(self, kind):
+        """Sum the entries of one kind"""
+        entries = [entry for entry in self.entries if entry.kind == kind]
+        total = {'count': len(entries), 'wall': 0.0, 'cpu': 0.0}
+        total.update(dict.fromkeys(COUNTERS, 0))
+        for entry in entries:
+            total['wall'] += entry.wall
+            total['cpu'] += entry.cpu
+            for key in COUNTERS:
+                total[key] += entry.counters[key]
+        return total
+
+    def to_dict(self):
+        entries = sorted(self.entries, key=lambda entry: entry.start)
+        return {
+            'version': PROFILE_VERSION,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'totals': {kind: self.totals(kind) for kind in sorted({entry.kind for entry in entries})},
+            'entries': [entry.to_dict() for entry in entries],
+        }
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    def summary_rows(self):
+        """Rows of the summary table: each target, stage and packer, then the
+        total of each kind of operation.
+        """
+        def row(name, wall, cpu, counters):
+            return [
+                name,
+                f"{wall:.2f}s",
+                f"{cpu:.2f}s",
+                _format_size(counters['bytes_read']),
+                _format_size(counters['bytes_written']),
+                str(counters['files']),
+                f"{counters['cache_hits']}/{counters['cache_misses']}",
+            ]
+
+        rows = []
+        for entry in sorted(self.entries, key=lambda entry: entry.start):
+            if entry.kind in ('target', 'stage', 'packer'):
+                name = entry.name + (' (reused)' if entry.notes.get('reused') else '')
+                rows.append(row(f"{entry.kind} {name}", entry.wall, entry.cpu, entry.counters))
+        for kind in sorted({entry.kind for entry in self.entries} - {'target', 'stage', 'packer'}):
+            total = self.totals(kind)
+            rows.append(row(f"{kind} x{total['count']}", total['wall'], total['cpu'], total))
+        rows.append(['total', f"{self.wall:.2f}s", f"{self.cpu:.2f}s", '', '', '', ''])
+        return rows
+
+    def display(self, ui):
+        ui.display_columns(
+            self.summary_rows(),
+            header=['Step', '>Wall', '>CPU', '>Read', '>Written', '>Files', '>Cache hits/misses'],
+        )
+
+
+def _format_size(size):
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_entry():
+    """The innermost entry being measured on this thread, if any"""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def measure(kind, name):
+    """Measure a block as an entry of the active profile, if there is one"""
+    profile = _active
+    if profile is None:
+        yield None
+        return
+
+    stack = _stack()
+    entry = ProfileEntry(kind, name, stack[-1] if stack else None)
+    stack.append(entry)
+    entry.start = time.perf_counter() - profile._start
+    start_cpu = time.thread_time()
+    try:
+        yield entry
+    finally:
+        entry.cpu += time.thread_time() - start_cpu
+        entry.wall = time.perf_counter() - profile._start - entry.start
+        stack.pop()
+        profile._finish(entry)
+
+
+@contextmanager
+def inherit(entry):
+    """Make entries measured on this thread part of an entry from another
+    thread, for work handed to a thread pool.
+    """
+    if entry is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(entry)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def count(**counters):
+    """Add to the counters of the innermost entry on this thread"""
+    entry = current_entry()
+    if entry is not None:
+        entry.add(**counters)
+
+
+def note(**data):
+    """Record extra data on the innermost entry on this thread"""
+    entry = current_entry()
+    if entry is not None:
+        entry.notes.update(data)
+
+
+class ThreadedProfiler():
+    """cProfile for every thread of the build.
+
+    cProfile only profiles the thread which enables it, so each thread
+    started while this is running gets its own profiler, and the statistics
+    are merged at the end.
+    """
+
+    def __init__(self):
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        sys.setprofile(None)
+        profiler.enable()
+
+    def start(self):
+        threading.setprofile(self._start_thread)
+        self._main = cProfile.Profile()
+        self._main.enable()
+
+    def stop(self):
+        self._main.disable()
+        threading.setprofile(None)
+
+    def dump(self, path):
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for profiler in self._profilers:
+                profiler.create_stats()
+                stats.add(profiler)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        stats.dump_stats(path)
+        return stats
@@ -1,27 +1,123 @@
 import os
+import time
+import shutil
+import hashlib
 import logging
+import threading
+from tempfile import mkdtemp
 from pathlib import Path
 import requests
+import requests.adapters
 import sys
 
+from .profile import count, measure
+
 logger = logging.getLogger(__name__)
 
-def download(url, target):
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 0.5
+DOWNLOAD_TIMEOUT = 30
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+def get_session():
+    """Return the requests session shared by all downloads, so connections are
+    pooled and reused.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['user-agent'] = 'win-packer'
+            _session = session
+    return _session
+
+
+def _download_part(session, url, part, hasher):
+    """Download url into part, resuming from what's already in it."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    # Compressed responses can't be resumed part way through
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+
+    with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        if r.status_code == 416:
+            # The partial file is no good for this resource; start again
+            os.remove(part)
+            raise DownloadError('Could not resume download of {}'.format(url))
+        r.raise_for_status()
+
+        if offset and r.status_code == 206:
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    count(bytes_written=len(chunk))
+                    hasher.update(chunk)
+
+
+def download(url, target, sha256=None, session=None, retries=DOWNLOAD_RETRIES):
     """Download a file using requests.
 
     This is like urllib.request.urlretrieve, but requests validates SSL
     certificates by default.
+
+    The file is written to ``target.part`` and renamed into place once it's
+    complete, so target never holds a partial download. Interrupted downloads
+    are resumed with HTTP Range requests and failures are retried with
+    exponential backoff. If ``sha256`` is given, the download is checked
+    against it while it streams. The SHA-256 of the file is returned.
     """
     if isinstance(target, Path):
         target = str(target)
 
-    headers = {'user-agent': 'win-packer'}
-    r = requests.get(url, headers=headers, stream=True)
-    r.raise_for_status()
-    with open(target, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
+    session = session or get_session()
+    part = target + '.part'
+
+    with measure('download', os.path.basename(target)):
+        for attempt in range(retries + 1):
+            hasher = hashlib.sha256()
+            try:
+                _download_part(session, url, part, hasher)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, DownloadError) as e:
+                error = e
+            except requests.HTTPError as e:
+                if e.response is None or (e.response.status_code < 500 and e.response.status_code != 429):
+                    raise
+                error = e
+
+            if attempt < retries:
+                logger.info('Retrying download of %s after error: %s', url, error)
+                time.sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+        else:
+            raise error
+
+        if sha256 and hasher.hexdigest() != sha256:
+            os.remove(part)
+            raise DownloadError('Hash mismatch for {}: expected {}, got {}'.format(url, sha256, hasher.hexdigest()))
+
+        os.replace(part, target)
+        count(files=1)
+    return hasher.hexdigest()
 
 CACHE_ENV_VAR = 'PYNSIST_CACHE_DIR'
 
@@ -55,6 +151,120 @@ def get_cache_dir(ensure_existence=False):
     return p
 
 
+def cached_tree(entry, fill):
+    """Return ``entry``, a directory in the cache, creating it first with
+    ``fill(directory)`` if it doesn't exist.
+
+    The tree is filled in a temporary directory next to entry and renamed into
+    place, so a partly written tree is never visible to other builds. If
+    another build creates the same entry first, its tree is used.
+    """
+    entry = Path(entry)
+    if entry.is_dir():
+        count(cache_hits=1)
+        return entry
+
+    count(cache_misses=1)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    td = mkdtemp(prefix=entry.name + '.tmp-', dir=str(entry.parent))
+    try:
+        fill(td)
+        try:
+            os.rename(td, str(entry))
+        except OSError:
+            if not entry.is_dir():
+                raise
+    finally:
+        if os.path.isdir(td):
+            shutil.rmtree(td)
+
+    return entry
+
+
 def normalize_path(path):
     """Normalize paths to contain "/" only"""
-    return os.path.normpath(path).replace('\\', '/')
\ No newline at end of file
+    return os.path.normpath(path).replace('\\', '/')
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+            count(bytes_read=len(chunk))
+    return h.hexdigest()
+
+
+# Linux ioctl to share the extents of one file with another (copy-on-write)
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    """Make dst a copy-on-write clone of src, where the filesystem supports it"""
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflinks are not supported on this platform')
+
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst):
+    """Materialise src at dst as cheaply as possible.
+
+    Tries a hardlink first, then a reflink, and falls back to a plain copy. An
+    existing dst is removed rather than written to, so a file which is
+    hardlinked from a cache is never modified in place. Returns how it was
+    done: ``'hardlink'``, ``'reflink'`` or ``'copy'``.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    try:
+        _reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+
+    shutil.copy2(src, dst)
+    count(bytes_read=os.path.getsize(dst), bytes_written=os.path.getsize(dst))
+    return 'copy'
+
+
+def link_tree(src, dst, ignore=None, ignore_dir=None):
+    """Materialise every file under src into dst with :func:`link_or_copy`.
+
+    Existing directories in dst are merged into. ``ignore`` is an optional
+    callable which is given each file path relative to src (with "/"
+    separators) and returns True to leave that file out. ``ignore_dir`` is
+    the same for directories, which are then not walked at all.
+    """
+    src = str(src)
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        if ignore_dir is not None:
+            dirs[:] = [d for d in dirs if not ignore_dir(normalize_path(os.path.join(rel_root, d)))]
+        dst_root = os.path.normpath(os.path.join(dst, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+
+        for filename in files:
+            rel_path = normalize_path(os.path.join(rel_root, filename))
+            if ignore is not None and ignore(rel_path):
+                continue
+            dst_path = os.path.join(dst_root, filename)
+            if os.path.isdir(dst_path):
+                raise RuntimeError('File {} clashes with directory {}'.format(rel_path, dst_path))
+            link_or_copy(os.path.join(root, filename), dst_path)
+            count(files=1)
@@ -0,0 +1,101 @@
+import importlib.util
+import io
+import sys
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pdm.core import Core
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.headers)
+        respond = self.server.responses.pop(0)
+        respond(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        # Each request is answered by the next of these, called with the handler
+        self.responses = []
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://{}:{}/file.bin'.format(*self.server_address)
+
+
+@pytest.fixture
+def http_server():
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_project(tmp_path):
+    """Make a project with ``settings`` as its ``tool.pdm.win-packer`` table"""
+    def make(settings=''):
+        root = tmp_path / 'project'
+        root.mkdir(exist_ok=True)
+        (root / 'pyproject.toml').write_text(
+            '[project]\nname = "demo"\nversion = "1.0"\ndependencies = []\n\n'
+            '[tool.pdm.win-packer]\napp_name = "Demo"\n' + settings
+        )
+        return Core().create_project(root)
+    return make
+
+
+@pytest.fixture
+def python_cache(tmp_path, monkeypatch):
+    """A cache holding a stand-in for the embeddable build of this Python,
+    with a standard library zip to read the bytecode magic number from.
+    Returns the Python version.
+    """
+    version = '{}.{}.{}'.format(*sys.version_info[:3])
+    tag = '{}{}'.format(*sys.version_info[:2])
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    monkeypatch.setenv('PYNSIST_CACHE_DIR', str(cache_dir))
+
+    stdlib = io.BytesIO()
+    with zipfile.ZipFile(stdlib, 'w') as zf:
+        zf.writestr('os.pyc', importlib.util.MAGIC_NUMBER + bytes(12))
+    with zipfile.ZipFile(cache_dir / f'python-{version}-embed-amd64.zip', 'w') as zf:
+        zf.writestr(f'python{tag}._pth', f'python{tag}.zip\r\n.\r\n')
+        zf.writestr(f'python{tag}.zip', stdlib.getvalue())
+        zf.writestr('python.exe', b'')
+    return version
+
+
+@pytest.fixture
+def app_project(tmp_path, monkeypatch, make_project, python_cache):
+    """Make a project with an ``app`` package, no dependencies and a
+    ``demo`` command, which can be built offline. Builds run in its root.
+    """
+    root = tmp_path / 'project'
+    (root / 'app').mkdir(parents=True)
+    (root / 'app' / '__init__.py').write_text('from . import cli\n')
+    (root / 'app' / 'cli.py').write_text('def main():\n    print("hello")\n')
+    (root / 'pdm.lock').write_text('[metadata]\nlock_version = "4.1"\ncontent_hash = "sha256:0"\n')
+    monkeypatch.chdir(root)
+
+    def make(settings=''):
+        return make_project(
+            f'py_version = "{python_cache}"\n{settings}\n'
+            '[tool.pdm.win-packer.commands.demo]\nentry_point = "app.cli:main"\n'
+        )
+    return make
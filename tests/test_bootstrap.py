@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from pdm_winpacker.winpacker.bundler.command import CommandBuilder, pth_effects, render_bootstrap
+
+
+APP = '''\
+import os, sys
+
+def main():
+    installdir = os.path.dirname(os.path.dirname(sys.executable))
+    for path in sys.path:
+        if path.startswith(installdir):
+            # The bootstrap joins Windows paths
+            print('path', os.path.relpath(path, installdir).replace(os.sep, '/').replace('\\\\', '/'))
+    print('pth', os.environ.get('PTH_RAN'))
+    print('timer', any(type(finder).__name__ == '_ImportTimer' for finder in sys.meta_path))
+'''
+
+
+@pytest.fixture
+def install_dir(tmp_path):
+    """An installed application with a .pth file in pkgs"""
+    pkgs = tmp_path / 'pkgs'
+    (pkgs / 'app').mkdir(parents=True)
+    (pkgs / 'app' / '__init__.py').write_text('')
+    (pkgs / 'app' / 'cli.py').write_text(APP)
+    (pkgs / 'win32').mkdir()
+    (pkgs / 'extra.pth').write_text(
+        '# a comment\n'
+        'win32\n'
+        'missing\n'
+        'import os; os.environ["PTH_RAN"] = "yes"\n'
+    )
+    (tmp_path / 'bin').mkdir()
+    return tmp_path
+
+
+def test_pth_effects(install_dir):
+    append, imports = pth_effects(str(install_dir / 'pkgs'))
+    assert append == ['pkgs\\win32']
+    assert imports == ['import os; os.environ["PTH_RAN"] = "yes"']
+
+
+def _run_launcher(install_dir, **env):
+    """Run the launcher's script as if the Python in the install directory
+    was running it.
+    """
+    builder = CommandBuilder('demo', 'app.cli:main', True, install_dir / 'bin',
+                             bootstrap=render_bootstrap(str(install_dir / 'pkgs')))
+    builder.build()
+    script = textwrap.dedent('''
+        import os, sys, runpy
+        sys.executable = os.path.join(sys.argv[1], 'Python', 'python.exe')
+        runpy.run_path(sys.argv[2], run_name='__main__')
+    ''')
+    env = {**{k: v for k, v in os.environ.items() if k != 'WINPACKER_IMPORTTIME'}, **env,
+           'PYTHONDONTWRITEBYTECODE': '1'}
+    return subprocess.run([sys.executable, '-c', script, str(install_dir), str(install_dir / 'bin' / 'demo.exe')],
+                          capture_output=True, text=True, check=True, env=env)
+
+
+def test_frozen_bootstrap(install_dir):
+    result = _run_launcher(install_dir)
+    lines = result.stdout.splitlines()
+    # The launcher runs its own zip, then pkgs and the directories from .pth files
+    assert [line for line in lines if line.startswith('path')] == ['path bin/demo.exe', 'path pkgs', 'path pkgs/win32']
+    assert 'pth yes' in lines
+    assert 'timer False' in lines
+    assert 'import time:' not in result.stderr
+
+
+def test_frozen_bootstrap_with_import_time(install_dir):
+    result = _run_launcher(install_dir, WINPACKER_IMPORTTIME='1')
+    assert 'pth yes' in result.stdout.splitlines()
+    assert 'timer True' in result.stdout.splitlines()
+    assert 'import time: self [us] | cumulative | imported package' in result.stderr
+    assert ' app.cli' in result.stderr
@@ -0,0 +1,111 @@
+import os
+import zipfile
+
+from pdm_winpacker.winpacker import Bundler, PackedApp
+
+
+def build(project):
+    packed_app = PackedApp(project)
+    packed_app.offline = True
+    packed_app.prepare_build_directory()
+    bundler = Bundler(packed_app)
+    bundler.build()
+    return bundler
+
+
+def test_zipped_packages_stay_zipped_on_rebuild(app_project):
+    project = app_project('zip_packages = true\nsourceless = true\n')
+    pkgs = os.path.join('build', 'winpacker', 'pkgs')
+
+    for _ in range(2):
+        bundler = build(project)
+
+        assert not os.path.exists(os.path.join(pkgs, 'app'))
+        with zipfile.ZipFile(os.path.join('build', 'winpacker', 'pkgs.zip')) as zf:
+            assert sorted(zf.namelist()) == ['app/__init__.pyc', 'app/cli.pyc']
+    assert {'packages', 'bytecode', 'zip_packages'} <= set(bundler._reused)
+
+
+def test_changed_zipped_package_is_zipped_again(app_project):
+    project = app_project('zip_packages = true\n')
+    build(project)
+
+    with open(os.path.join('app', 'cli.py'), 'a') as f:
+        f.write('VERSION = 2\n')
+    bundler = build(project)
+
+    assert not {'packages', 'bytecode', 'zip_packages'} & set(bundler._reused)
+    assert not os.path.exists(os.path.join('build', 'winpacker', 'pkgs', 'app'))
+    with zipfile.ZipFile(os.path.join('build', 'winpacker', 'pkgs.zip')) as zf:
+        assert b'VERSION = 2' in zf.read('app/cli.py')
+
+
+# The stages which don't depend on the app or its dependencies
+INDEPENDENT_STAGES = {'icon', 'license', 'python', 'msvcrt', 'commands', 'extra_files'}
+
+
+def test_unchanged_rebuild_reuses_stages(app_project):
+    build(app_project('compile_bytecode = true\n'))
+    bundler = build(app_project('compile_bytecode = true\n'))
+
+    assert set(bundler._reused) == INDEPENDENT_STAGES | {'dependencies', 'packages', 'bytecode'}
+    # zip_packages is turned off, so it only checks there's no zip to remove
+    assert bundler._ran == {'zip_packages'}
+
+
+def test_changed_package_invalidates_later_stages(app_project):
+    build(app_project('compile_bytecode = true\n'))
+    with open(os.path.join('app', 'cli.py'), 'a') as f:
+        f.write('VERSION = 2\n')
+    bundler = build(app_project('compile_bytecode = true\n'))
+
+    assert {'packages', 'bytecode'} <= bundler._ran
+    assert set(bundler._reused) == INDEPENDENT_STAGES | {'dependencies'}
+
+
+def test_changed_lockfile_invalidates_dependencies(app_project):
+    build(app_project('compile_bytecode = true\n'))
+    with open('pdm.lock', 'a') as f:
+        f.write('# changed\n')
+    bundler = build(app_project('compile_bytecode = true\n'))
+
+    assert {'dependencies', 'packages', 'bytecode'} <= bundler._ran
+    assert set(bundler._reused) == INDEPENDENT_STAGES
+
+
+def test_changed_icon_only_invalidates_icon(app_project, tmp_path):
+    icon = tmp_path / 'app.ico'
+    icon.write_bytes(b'icon')
+    build(app_project(f'icon = "{icon.as_posix()}"\n'))
+    icon.write_bytes(b'new icon')
+    bundler = build(app_project(f'icon = "{icon.as_posix()}"\n'))
+
+    assert bundler._ran == {'icon', 'zip_packages'}
+    assert set(bundler._reused) == INDEPENDENT_STAGES - {'icon'} | {'dependencies', 'packages'}
+
+
+OTHER_COMMAND = '[tool.pdm.win-packer.commands.other]\nentry_point = "app.cli:main"\n{}'
+
+
+def test_unchanged_launchers_are_reused(app_project):
+    bin_dir = os.path.join('build', 'winpacker', 'bin')
+    build(app_project(OTHER_COMMAND.format('')))
+    demo = os.stat(os.path.join(bin_dir, 'demo.exe')).st_mtime_ns
+    other = os.stat(os.path.join(bin_dir, 'other.exe')).st_mtime_ns
+
+    bundler = build(app_project(OTHER_COMMAND.format('console = true\n')))
+
+    assert 'commands' in bundler._ran
+    assert os.stat(os.path.join(bin_dir, 'demo.exe')).st_mtime_ns == demo
+    assert os.stat(os.path.join(bin_dir, 'other.exe')).st_mtime_ns != other
+
+
+def test_removed_command_launcher_is_deleted(app_project):
+    bin_dir = os.path.join('build', 'winpacker', 'bin')
+    build(app_project(OTHER_COMMAND.format('')))
+    demo = os.stat(os.path.join(bin_dir, 'demo.exe')).st_mtime_ns
+
+    build(app_project())
+
+    assert sorted(os.listdir(bin_dir)) == ['demo.exe']
+    assert os.stat(os.path.join(bin_dir, 'demo.exe')).st_mtime_ns == demo
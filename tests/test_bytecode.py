@@ -0,0 +1,78 @@
+import sys
+import zipfile
+import importlib.util
+
+import pytest
+from pdm.exceptions import ProjectError
+
+from pdm_winpacker.winpacker.bundler import bytecode
+from pdm_winpacker.winpacker.bundler.bytecode import (
+    bytecode_path, compile_files, compile_tree, find_compiler, target_magic,
+)
+
+
+def test_target_magic_from_stdlib_zip(tmp_path):
+    with zipfile.ZipFile(tmp_path / 'python313.zip', 'w') as zf:
+        zf.writestr('os.pyc', b'\x01\x02\r\n' + bytes(12))
+    assert target_magic(str(tmp_path), '3.13.0') == b'\x01\x02\r\n'
+
+
+def test_target_magic_of_final_release(tmp_path):
+    assert target_magic(str(tmp_path), '3.11.4') == (3495).to_bytes(2, 'little') + b'\r\n'
+
+
+def test_target_magic_of_unknown_version(tmp_path):
+    with pytest.raises(ProjectError, match='3.99'):
+        target_magic(str(tmp_path), '3.99.0')
+
+
+def test_find_compiler_skips_candidates_with_other_magic(monkeypatch, tmp_path):
+    monkeypatch.setattr(bytecode.shutil, 'which', lambda name: None)
+    missing = str(tmp_path / 'python.exe')
+    version = '.'.join(map(str, sys.version_info[:3]))
+    assert find_compiler(version, importlib.util.MAGIC_NUMBER, [missing]) == [sys.executable]
+
+
+def test_find_compiler_without_a_match(monkeypatch):
+    monkeypatch.setattr(bytecode.shutil, 'which', lambda name: None)
+    with pytest.raises(ProjectError, match='bytecode_python'):
+        find_compiler('3.7.9', b'\x00\x00\r\n')
+
+
+@pytest.fixture
+def tree(tmp_path):
+    pkgs = tmp_path / 'pkgs'
+    (pkgs / 'app').mkdir(parents=True)
+    (pkgs / 'app' / '__init__.py').write_text('')
+    (pkgs / 'app' / 'cli.py').write_text('def main():\n    pass\n')
+    (pkgs / 'app' / 'broken.py').write_text('def main(:\n')
+    return pkgs
+
+
+def test_compile_tree(tree):
+    errors = compile_tree([sys.executable], str(tree))
+
+    assert 'broken.py' in errors
+    pyc = bytecode_path(str(tree / 'app' / 'cli.py'), sys.implementation.cache_tag)
+    with open(pyc, 'rb') as f:
+        header = f.read(8)
+    # Unchecked hash-based bytecode, so modification times don't matter
+    assert header[:4] == importlib.util.MAGIC_NUMBER
+    assert int.from_bytes(header[4:], 'little') == 0b01
+    assert (tree / 'app' / 'cli.py').exists()
+
+
+@pytest.mark.parametrize('compile', [
+    lambda tree: compile_tree([sys.executable], str(tree), sourceless=True),
+    lambda tree: compile_files([sys.executable], str(tree), ['app/__init__.py', 'app/cli.py', 'app/broken.py'],
+                               workers=2, sourceless=True),
+])
+def test_sourceless(tree, compile):
+    errors = compile(tree)
+
+    assert 'broken.py' in errors
+    assert sorted(p.name for p in (tree / 'app').iterdir()) == ['__init__.pyc', 'broken.py', 'cli.pyc']
+    spec = importlib.util.spec_from_file_location('cli', tree / 'app' / 'cli.pyc')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert callable(module.main)
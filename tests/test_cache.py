@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from pdm_winpacker.winpacker import PackedApp
+from pdm_winpacker.winpacker.cache import Cache, parse_size
+
+
+@pytest.mark.parametrize('value, size', [(1048576, 1048576), ('500MB', 500 * 1024 ** 2), ('5 GiB', 5 * 1024 ** 3),
+                                         ('1.5K', 1536), ('0', 0)])
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+
+def test_parse_invalid_size():
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_no_max_size_by_default(make_project):
+    assert PackedApp(make_project()).cache_max_size is None
+
+
+def test_max_size(make_project):
+    assert PackedApp(make_project('cache_max_size = "2GB"\n')).cache_max_size == 2 * 1024 ** 3
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    cache = Cache(tmp_path / 'cache')
+    cache.root.mkdir()
+    for n, name in enumerate(['old.whl', 'newer.whl', 'newest.whl']):
+        path = cache.root / name
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 + n, 1000 + n))
+
+    evicted, freed = cache.prune(250)
+
+    assert (evicted, freed) == (['old.whl'], 100)
+    assert sorted(cache.entries()) == ['newer.whl', 'newest.whl']
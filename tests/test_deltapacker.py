@@ -0,0 +1,51 @@
+import json
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from pdm.exceptions import PdmUsageError
+
+from pdm_winpacker.winpacker.packers import DeltaPacker, ZipPacker
+from pdm_winpacker.winpacker.packers.deltapacker import DELTA_MANIFEST, read_file_hashes
+
+
+@pytest.fixture
+def packed_app(tmp_path):
+    return SimpleNamespace(project=None, config={}, artifact_name='App_1.0', dist_dir=str(tmp_path / 'dist'),
+                           delta_from=None)
+
+
+@pytest.mark.parametrize('name', ['App_1.0.zip', 'App_1.0_delta.zip', 'App_1.0.files.json'])
+def test_previous_build_written_by_this_build(packed_app, tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    packed_app.delta_from = f'dist/../dist/{name}'
+
+    with pytest.raises(PdmUsageError, match="written by this build"):
+        DeltaPacker(packed_app).check_previous([ZipPacker(packed_app)])
+
+
+def test_previous_build_elsewhere(packed_app, tmp_path):
+    packed_app.delta_from = str(tmp_path / 'releases' / 'App_1.0.zip')
+    DeltaPacker(packed_app).check_previous([ZipPacker(packed_app)])
+
+
+def test_read_file_hashes(tmp_path):
+    package = tmp_path / 'App_1.0.zip'
+    with zipfile.ZipFile(package, 'w') as zf:
+        zf.writestr('app/__init__.py', b'')
+        zf.writestr('app/', b'')
+    files_manifest = tmp_path / 'App_1.0.files.json'
+    files_manifest.write_text(json.dumps({'version': 1, 'files': {'app/__init__.py': 'abc'}}))
+
+    empty_sha256 = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    assert read_file_hashes(str(package)) == {'app/__init__.py': empty_sha256}
+    assert read_file_hashes(str(files_manifest)) == {'app/__init__.py': 'abc'}
+
+
+def test_read_file_hashes_of_delta_package(tmp_path):
+    package = tmp_path / 'App_1.0_delta.zip'
+    with zipfile.ZipFile(package, 'w') as zf:
+        zf.writestr(DELTA_MANIFEST, '{}')
+
+    with pytest.raises(PdmUsageError, match="is a delta package"):
+        read_file_hashes(str(package))
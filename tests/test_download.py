@@ -0,0 +1,158 @@
+import hashlib
+
+import pytest
+import requests
+
+from pdm_winpacker.winpacker import utils
+from pdm_winpacker.winpacker.utils import DownloadError, download
+
+
+CONTENT = bytes(range(256)) * 64
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Chunks small enough that part of a response is written before it breaks off
+    monkeypatch.setattr(utils, 'DOWNLOAD_CHUNK_SIZE', 1024)
+    monkeypatch.setattr(utils, 'DOWNLOAD_BACKOFF', 0)
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+
+def send(status, body=b'', headers=None, length=None):
+    """A response, with a Content-Length of ``length`` if the body is to be
+    cut short.
+    """
+    def respond(handler):
+        handler.send_response(status)
+        handler.send_header('Content-Length', str(len(body) if length is None else length))
+        handler.send_header('Connection', 'close')
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        handler.wfile.flush()
+        handler.close_connection = True
+    return respond
+
+
+def send_range(handler):
+    start = int(handler.headers['Range'].removeprefix('bytes=').rstrip('-'))
+    headers = {'Content-Range': 'bytes {}-{}/{}'.format(start, len(CONTENT) - 1, len(CONTENT))}
+    send(206, CONTENT[start:], headers)(handler)
+
+
+def send_broken_chunks(handler):
+    handler.send_response(200)
+    handler.send_header('Transfer-Encoding', 'chunked')
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+    handler.wfile.write(b'1000\r\n' + CONTENT[:4096] + b'\r\n')
+    handler.wfile.write(b'1000\r\n' + CONTENT[4096:4106])
+    handler.wfile.flush()
+    handler.close_connection = True
+
+
+def test_download(http_server, session, tmp_path):
+    http_server.responses = [send(200, CONTENT)]
+    target = tmp_path / 'file.bin'
+
+    assert download(http_server.url, target, session=session) == SHA256
+
+    assert target.read_bytes() == CONTENT
+    assert not (tmp_path / 'file.bin.part').exists()
+    assert 'Range' not in http_server.requests[0]
+
+
+def test_resume_after_truncation(http_server, session, tmp_path):
+    half = len(CONTENT) // 2
+    http_server.responses = [send(200, CONTENT[:half], length=len(CONTENT)), send_range]
+    target = tmp_path / 'file.bin'
+
+    assert download(http_server.url, target, sha256=SHA256, session=session) == SHA256
+
+    assert target.read_bytes() == CONTENT
+    assert http_server.requests[1]['Range'] == 'bytes={}-'.format(half)
+
+
+def test_resume_ignored_by_server(http_server, session, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(b'stale')
+    http_server.responses = [send(200, CONTENT)]
+    target = tmp_path / 'file.bin'
+
+    download(http_server.url, target, sha256=SHA256, session=session)
+
+    assert target.read_bytes() == CONTENT
+
+
+def test_range_not_satisfiable_restarts(http_server, session, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(CONTENT + b'extra')
+    http_server.responses = [send(416), send(200, CONTENT)]
+    target = tmp_path / 'file.bin'
+
+    download(http_server.url, target, sha256=SHA256, session=session)
+
+    assert target.read_bytes() == CONTENT
+    assert 'Range' in http_server.requests[0]
+    assert 'Range' not in http_server.requests[1]
+
+
+@pytest.mark.parametrize('status', [500, 503, 429])
+def test_server_errors_are_retried(http_server, session, tmp_path, status):
+    http_server.responses = [send(status), send(200, CONTENT)]
+    target = tmp_path / 'file.bin'
+
+    download(http_server.url, target, sha256=SHA256, session=session)
+
+    assert target.read_bytes() == CONTENT
+    assert len(http_server.requests) == 2
+
+
+@pytest.mark.parametrize('status', [403, 404])
+def test_client_errors_are_not_retried(http_server, session, tmp_path, status):
+    http_server.responses = [send(status), send(200, CONTENT)]
+    target = tmp_path / 'file.bin'
+
+    with pytest.raises(requests.HTTPError):
+        download(http_server.url, target, session=session)
+
+    assert not target.exists()
+    assert len(http_server.requests) == 1
+
+
+def test_retries_run_out(http_server, session, tmp_path):
+    http_server.responses = [send(503)] * 3
+    target = tmp_path / 'file.bin'
+
+    with pytest.raises(requests.HTTPError):
+        download(http_server.url, target, session=session, retries=2)
+
+    assert not target.exists()
+    assert len(http_server.requests) == 3
+
+
+def test_chunked_encoding_error_is_retried(http_server, session, tmp_path):
+    http_server.responses = [send_broken_chunks, send_range]
+    target = tmp_path / 'file.bin'
+
+    download(http_server.url, target, sha256=SHA256, session=session)
+
+    assert target.read_bytes() == CONTENT
+    assert http_server.requests[1]['Range'] == 'bytes=4096-'
+
+
+def test_hash_mismatch(http_server, session, tmp_path):
+    target = tmp_path / 'file.bin'
+    target.write_bytes(b'previous download')
+    http_server.responses = [send(200, CONTENT[:-1])]
+
+    with pytest.raises(DownloadError, match='Hash mismatch'):
+        download(http_server.url, target, sha256=SHA256, session=session)
+
+    assert not (tmp_path / 'file.bin.part').exists()
+    assert target.read_bytes() == b'previous download'
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import textwrap
+import zipfile
+
+from pdm_winpacker.winpacker.bundler.command import _IMPORTTIME_SOURCE
+
+
+def _run(tmp_path, code):
+    (tmp_path / 'pkg').mkdir()
+    (tmp_path / 'pkg' / '__init__.py').write_text('from . import child\n')
+    (tmp_path / 'pkg' / 'child.py').write_text('import json\n')
+    (tmp_path / 'pkg' / 'data.txt').write_text('some data')
+    with zipfile.ZipFile(tmp_path / 'zipped.zip', 'w') as zf:
+        zf.writestr('zipped/__init__.py', '')
+    script = textwrap.dedent('''
+        import sys, importlib.util
+        spec = importlib.util.spec_from_file_location('_winpacker_importtime', sys.argv[1])
+        timer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(timer)
+        sys.path[:0] = [sys.argv[2], sys.argv[2] + '/zipped.zip']
+    ''') + textwrap.dedent(code)
+    return subprocess.run([sys.executable, '-c', script, _IMPORTTIME_SOURCE, str(tmp_path)],
+                          capture_output=True, text=True, check=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+
+
+def test_imports_are_timed(tmp_path):
+    result = _run(tmp_path, '''
+        import pkg
+        import zipped
+    ''')
+    lines = result.stderr.splitlines()
+    assert lines[0] == 'import time: self [us] | cumulative | imported package'
+    names = [line.split('|')[2].rstrip() for line in lines[1:]]
+    # Nested imports are indented and reported before the module importing them
+    assert names.index('     json') < names.index('   pkg.child') < names.index(' pkg')
+    assert ' zipped' in names
+    assert len(names) == len(set(names))
+
+
+def test_loaders_are_unchanged(tmp_path):
+    result = _run(tmp_path, '''
+        import importlib.machinery, zipimport
+        import pkg, zipped
+        loader = pkg.__spec__.loader
+        assert type(loader) is importlib.machinery.SourceFileLoader
+        assert pkg.__loader__ is loader
+        assert loader.is_package('pkg')
+        assert loader.get_data(loader.path.replace('__init__.py', 'data.txt')) == b'some data'
+        assert loader.get_resource_reader('pkg').open_resource('data.txt').read() == b'some data'
+        assert isinstance(zipped.__loader__, zipimport.zipimporter)
+        print('ok')
+    ''')
+    assert result.stdout == 'ok\n'
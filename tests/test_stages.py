@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+from pdm.exceptions import ProjectError
+
+from pdm_winpacker.winpacker.bundler.stages import Stage, StageGraph
+
+
+def recorder(log, name, action=None):
+    def run():
+        log.append(('start', name))
+        if action is not None:
+            action()
+        log.append(('end', name))
+    return run
+
+
+def test_stages_run_after_what_they_require():
+    log = []
+    StageGraph([
+        Stage('c', recorder(log, 'c'), requires=['a', 'b']),
+        Stage('b', recorder(log, 'b'), requires=['a']),
+        Stage('a', recorder(log, 'a')),
+    ]).run()
+
+    for before, after in [('a', 'b'), ('a', 'c'), ('b', 'c')]:
+        assert log.index(('end', before)) < log.index(('start', after))
+
+
+def test_independent_stages_run_concurrently():
+    # Each stage waits for the other to start, which only works if they
+    # run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    log = []
+    StageGraph([
+        Stage('a', recorder(log, 'a', barrier.wait)),
+        Stage('b', recorder(log, 'b', barrier.wait)),
+    ]).run()
+    assert len(log) == 4
+
+
+def test_failure_stops_later_stages():
+    log = []
+
+    def fail():
+        raise RuntimeError('broken')
+
+    with pytest.raises(RuntimeError, match='broken'):
+        StageGraph([
+            Stage('a', recorder(log, 'a', fail)),
+            Stage('b', recorder(log, 'b'), requires=['a']),
+        ]).run()
+    assert ('start', 'b') not in log
+
+
+def test_dependency_cycle():
+    with pytest.raises(ProjectError, match='cycle'):
+        StageGraph([
+            Stage('a', lambda: None, requires=['b']),
+            Stage('b', lambda: None, requires=['a']),
+        ])
+
+
+def test_unknown_required_stage():
+    with pytest.raises(ProjectError, match='unknown stage b'):
+        StageGraph([Stage('a', lambda: None, requires=['b'])])
+
+
+@pytest.mark.parametrize('inputs, outputs', [((), ('pkgs',)), (('pkgs/app',), ()), (('.',), ())])
+def test_unordered_stages_using_the_same_paths(inputs, outputs):
+    with pytest.raises(ProjectError, match="aren't ordered"):
+        StageGraph([
+            Stage('a', lambda: None, outputs=['pkgs']),
+            Stage('b', lambda: None, inputs=inputs, outputs=outputs),
+        ])
+
+
+def test_ordered_stages_can_use_the_same_paths():
+    StageGraph([
+        Stage('a', lambda: None, outputs=['pkgs']),
+        Stage('b', lambda: None, requires=['a'], inputs=['pkgs'], outputs=['pkgs']),
+    ])
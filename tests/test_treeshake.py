@@ -0,0 +1,78 @@
+import pytest
+
+from pdm_winpacker.winpacker.bundler.treeshake import shake
+
+
+def write(path, text=''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.fixture
+def pkgs(tmp_path):
+    pkgs = tmp_path / 'pkgs'
+    write(pkgs / 'app' / '__init__.py', 'import numpy\nfrom . import cli\n')
+    write(pkgs / 'app' / 'cli.py', 'def main():\n    pass\n')
+    write(pkgs / 'app' / 'unused.py')
+    write(pkgs / 'app' / 'py.typed')
+    write(pkgs / 'app' / 'cli.pyi')
+    write(pkgs / 'app' / 'tests' / 'test_cli.py')
+    write(pkgs / 'app' / 'data' / 'logo.png')
+    write(pkgs / 'numpy' / '__init__.py')
+    write(pkgs / 'numpy' / 'core' / '_multiarray.cp311-win_amd64.pyd')
+    write(pkgs / 'numpy' / 'core' / 'helpers.py')
+    write(pkgs / 'numpy-1.0.dist-info' / 'METADATA')
+    write(pkgs / 'numpy-1.0.dist-info' / 'RECORD', 'numpy/__init__.py,,\n')
+    write(pkgs / 'numpy.libs' / 'libopenblas.dll')
+    write(pkgs / 'pywin32_system32' / 'pywintypes311.dll')
+    write(pkgs / 'unused' / '__init__.py')
+    write(pkgs / 'unused' / 'sub' / 'mod.py')
+    write(pkgs / 'unused-1.0.dist-info' / 'METADATA')
+    write(pkgs / 'unused-1.0.dist-info' / 'top_level.txt', 'unused\n')
+    return pkgs
+
+
+def test_unreachable_modules_are_removed(pkgs):
+    shake(str(pkgs), ['app'])
+    assert (pkgs / 'app' / 'cli.py').exists()
+    assert not (pkgs / 'app' / 'unused.py').exists()
+    assert not (pkgs / 'unused').exists()
+    assert not (pkgs / 'unused-1.0.dist-info').exists()
+
+
+def test_packages_with_extensions_are_kept_whole(pkgs):
+    shake(str(pkgs), ['app'])
+    assert (pkgs / 'numpy' / 'core' / 'helpers.py').exists()
+    assert (pkgs / 'numpy' / 'core' / '_multiarray.cp311-win_amd64.pyd').exists()
+    assert (pkgs / 'numpy-1.0.dist-info' / 'METADATA').exists()
+    assert not (pkgs / 'numpy-1.0.dist-info' / 'RECORD').exists()
+
+
+def test_top_level_directories_without_modules_are_kept(pkgs):
+    shake(str(pkgs), ['app'])
+    assert (pkgs / 'numpy.libs' / 'libopenblas.dll').exists()
+    assert (pkgs / 'pywin32_system32' / 'pywintypes311.dll').exists()
+
+
+def test_data_tests_and_typing_files(pkgs):
+    shake(str(pkgs), ['app'])
+    assert (pkgs / 'app' / 'data' / 'logo.png').exists()
+    assert not (pkgs / 'app' / 'tests').exists()
+    assert not (pkgs / 'app' / 'py.typed').exists()
+    assert not (pkgs / 'app' / 'cli.pyi').exists()
+
+
+def test_keep_and_sources(pkgs):
+    write(pkgs / 'plugin' / '__init__.py')
+    write(pkgs / 'plugin' / 'extra.py')
+    write(pkgs / 'preamble_dep.py')
+    shake(str(pkgs), ['app'], keep=['plugin'], sources=['import preamble_dep\n'])
+    assert (pkgs / 'plugin' / 'extra.py').exists()
+    assert (pkgs / 'preamble_dep.py').exists()
+    assert not (pkgs / 'unused').exists()
+
+
+def test_returns_number_of_files_removed(pkgs):
+    # app/unused.py, app/py.typed, app/cli.pyi, app/tests/test_cli.py, two
+    # modules in unused, its two dist-info files and numpy's RECORD
+    assert shake(str(pkgs), ['app']) == 9
@@ -0,0 +1,58 @@
+import zipfile
+
+import pytest
+
+from pdm_winpacker.winpacker.bundler import wheelinstaller
+from pdm_winpacker.winpacker.bundler.wheelinstaller import extract_wheel
+from pdm_winpacker.winpacker.utils import file_sha256
+
+
+@pytest.fixture
+def wheel(tmp_path):
+    path = tmp_path / 'demo-1.0-py3-none-any.whl'
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('demo/__init__.py', 'VERSION = "1.0"\n')
+        zf.writestr('demo-1.0.data/purelib/demo_extra.py', '')
+        zf.writestr('demo-1.0.data/scripts/demo', '')
+        zf.writestr('demo-1.0.dist-info/METADATA', 'Name: demo\n')
+    return path
+
+
+def test_extract_wheel(wheel, tmp_path):
+    target = tmp_path / 'pkgs'
+    extract_wheel(wheel, target)
+
+    assert (target / 'demo' / '__init__.py').read_text() == 'VERSION = "1.0"\n'
+    assert (target / 'demo_extra.py').is_file()
+    assert (target / 'demo-1.0.dist-info' / 'METADATA').is_file()
+    assert not (target / 'demo-1.0.data').exists()
+
+
+def test_extract_wheel_with_exclude(wheel, tmp_path):
+    target = tmp_path / 'pkgs'
+    extract_wheel(wheel, target, exclude=['pkgs/*.dist-info'])
+
+    assert (target / 'demo' / '__init__.py').is_file()
+    assert not (target / 'demo-1.0.dist-info').exists()
+
+
+def test_extract_wheel_into_cache(wheel, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    entry = extract_wheel(wheel, tmp_path / 'a', cache_dir=cache_dir)
+
+    assert entry.name == '{}-{}'.format(wheel.name, file_sha256(wheel)[:16])
+    assert (tmp_path / 'a' / 'demo' / '__init__.py').is_file()
+    assert (entry / 'demo' / '__init__.py').is_file()
+
+
+def test_known_hash_isnt_worked_out_again(wheel, tmp_path, monkeypatch):
+    sha256 = file_sha256(wheel)
+
+    def no_hashing(path):
+        raise AssertionError(f"{path} was hashed again")
+    monkeypatch.setattr(wheelinstaller, 'file_sha256', no_hashing)
+
+    entry = extract_wheel(wheel, tmp_path / 'pkgs', cache_dir=tmp_path / 'cache', sha256=sha256)
+
+    assert entry.name == '{}-{}'.format(wheel.name, sha256[:16])
+    assert (tmp_path / 'pkgs' / 'demo' / '__init__.py').is_file()
@@ -0,0 +1,122 @@
+import os
+import zlib
+import zipfile
+
+import pytest
+
+from pdm_winpacker.winpacker.packers import zipwriter
+from pdm_winpacker.winpacker.packers.zippacker import _compress
+from pdm_winpacker.winpacker.packers.zipwriter import ZipWriter
+
+
+METHODS = [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA]
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def _add(writer, path, arcname, method):
+    crc, file_size, method, data = _compress(str(path), method, None)
+    writer.add(str(path), arcname, data, crc, file_size, method)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_round_trip(tmp_path, method):
+    files = {
+        'app/__init__.py': b'print("hello")\n' * 100,
+        'app/empty.txt': b'',
+        'random.bin': os.urandom(4096),
+    }
+    output = tmp_path / 'out.zip'
+    with ZipWriter(output) as writer:
+        for name, data in files.items():
+            _add(writer, _write(tmp_path / 'src' / name, data), name, method)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(files)
+        for name, data in files.items():
+            assert zf.read(name) == data
+
+
+def test_incompressible_files_are_stored(tmp_path):
+    path = _write(tmp_path / 'random.bin', os.urandom(4096))
+    crc, file_size, method, data = _compress(str(path), zipfile.ZIP_DEFLATED, None)
+    assert method == zipfile.ZIP_STORED
+    assert (crc, file_size, data) == (zlib.crc32(path.read_bytes()), 4096, path.read_bytes())
+
+
+def test_duplicate_members_share_compressed_data(tmp_path):
+    content = b'the same content\n' * 500
+    first = _write(tmp_path / 'a' / 'first.txt', content)
+    second = _write(tmp_path / 'b' / 'second.txt', content)
+    crc, file_size, method, data = _compress(str(first), zipfile.ZIP_DEFLATED, None)
+
+    output = tmp_path / 'out.zip'
+    with ZipWriter(output) as writer:
+        writer.add(str(first), 'a/first.txt', data, crc, file_size, method)
+        writer.add(str(second), 'b/second.txt', data, crc, file_size, method)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert zf.read('a/first.txt') == zf.read('b/second.txt') == content
+
+
+def test_non_ascii_names(tmp_path):
+    names = ['données/café.txt', '日本語/ファイル.py', 'plain.txt']
+    output = tmp_path / 'out.zip'
+    with ZipWriter(output) as writer:
+        for name in names:
+            _add(writer, _write(tmp_path / 'src' / name, name.encode('utf-8')), name, zipfile.ZIP_DEFLATED)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == names
+        for info in zf.infolist():
+            assert bool(info.flag_bits & 0x800) == (not info.filename.isascii())
+            assert zf.read(info) == info.filename.encode('utf-8')
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_zip64(tmp_path, monkeypatch, method):
+    # Lower the limits so small files and archives need the zip64 extensions
+    monkeypatch.setattr(zipwriter, 'ZIP64_LIMIT', 1000)
+    monkeypatch.setattr(zipwriter, 'ZIP_FILECOUNT_LIMIT', 2)
+    monkeypatch.setattr(zipwriter, 'STREAM_CHUNK_SIZE', 512)
+    files = {f'file{i}.bin': os.urandom(1500) + b'\0' * 1500 for i in range(3)}
+
+    output = tmp_path / 'out.zip'
+    with ZipWriter(output) as writer:
+        for i, (name, data) in enumerate(files.items()):
+            path = _write(tmp_path / 'src' / name, data)
+            if i % 2:
+                writer.add_file(str(path), name, method)
+            else:
+                _add(writer, path, name, method)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        assert [info.filename for info in zf.infolist()] == list(files)
+        assert zf.infolist()[-1].header_offset > 1000
+        for name, data in files.items():
+            assert zf.read(name) == data
+
+
+def test_stream_large_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(zipwriter, 'STREAM_CHUNK_SIZE', 100)
+    data = b'streamed in chunks\n' * 1000
+    path = _write(tmp_path / 'big.txt', data)
+
+    output = tmp_path / 'out.zip'
+    with ZipWriter(output) as writer:
+        writer.add_file(str(path), 'big.txt', zipfile.ZIP_DEFLATED)
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.testzip() is None
+        info = zf.getinfo('big.txt')
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < info.file_size == len(data)
+        assert zf.read(info) == data